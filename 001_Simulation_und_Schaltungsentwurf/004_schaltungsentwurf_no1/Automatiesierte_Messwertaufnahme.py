@@ -7,13 +7,16 @@ Created on Tue May  6 08:41:03 2025
 """
 
 # %% Init
-import time
 import sys
 import os
 
-sys.path.append(os.path.dirname(__file__)+'\\redpitaya_scpi')
+# Client with binary transfer (fast_acq)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '005_self_tuned_filter', 'redpitaya_scpi'))
 
-#import redpitaya_scpi as scpi
+import redpitaya_scpi as scpi
+import fast_acq
+import gen_shadow
+import sweep_scheduler
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -47,43 +50,44 @@ offset = 0.0
 freqs = np.arange(10, 1000, 10)
 print("Parameters:\n","Waveform:",func,"\n","Amplitude:",ampl,"[v]\n","Offset:",offset,"[V]\n","Frequency range:",min(freqs),"to",max(freqs))
 
-for freq in freqs:
+# Expected filter (sets the dwell time per point instead of a flat 1 s)
+ftype_expected = 'LP'
+f0_expected = 100  # Hz
+Q_expected = 1
+tol = 1e-3  # relative error left by the transient
 
-    red_ip.tx_txt('GEN:RST')  # Signal Generator reset
-    red_ip.tx_txt('SOUR1:FUNC ' + str(func).upper())  # Wave form
-    red_ip.tx_txt('SOUR1:VOLT ' + str(ampl))  # Magnitude
-    red_ip.tx_txt('SOUR1:VOLT:OFFS ' + str(offset))  # Offset
-    red_ip.tx_txt('SOUR1:FREQ:FIX ' + str(freq))  # Frequency
-    red_ip.tx_txt('OUTPUT1:STATE ON')  # Output
-    red_ip.tx_txt('SOUR1:TRig:INT')
-    time.sleep(1)
+# Generator setup once, per frequency only the changed frequency is sent
+gen = gen_shadow.ShadowGenerator(red_ip, 1)
+gen.reset()  # Signal Generator reset
+gen.set(func=scpi.Waveform[str(func).upper()], volt=ampl, offset=offset)  # Wave form, Magnitude, Offset
 
-    # Trigger
+# Acquisition setup once, per frequency only start and trigger are sent
+with red_ip.batch():
     red_ip.tx_txt('ACQ:RST')  # Input reset
     red_ip.tx_txt('ACQ:DEC 64')  # Decimation
     red_ip.tx_txt('ACQ:TRIG:LEV 0.5')  # Trigger level
     red_ip.tx_txt('ACQ:TRIG:DLY 8192')  # Delay
-    red_ip.tx_txt('ACQ:START')  # Start measurement
-    red_ip.tx_txt('ACQ:TRIG NOW')
-
-    # Input IN1
-    time.sleep(0.1)  # in seconds
-    red_ip.tx_txt('ACQ:SOUR1:DATA?')  # Readout buffer IN1
-    IN1str = red_ip.rx_txt()
-    IN1str = IN1str.strip('{}\n\r').replace("  ", "").split(',')
-    IN1 = np.array(list(map(float, IN1str)))
-    DF_IN1[str(freq)] = IN1
 
-    # Input IN2
-    time.sleep(0.1)  # in seconds
-    red_ip.tx_txt('ACQ:SOUR2:DATA?')  # Readout buffer IN2
-    IN2str = red_ip.rx_txt()
-    IN2str = IN2str.strip('{}\n\r').replace("  ", "").split(',')
-    IN2 = np.array(list(map(float, IN2str)))
+# Retune (phase-continuous) and wait tau * ln(jump / tol) with tau = Q / (pi f0).
+# Without confirmation captures, they would change the acquisition settings above.
+sched = sweep_scheduler.SettlingScheduler(f0_expected, Q_expected, ftype_expected, tol=tol)
+for freq in sched.run(gen, freqs, confirm=False):
+
+    # Trigger
+    with red_ip.batch():
+        red_ip.tx_txt('ACQ:START')  # Start measurement
+        red_ip.tx_txt('ACQ:TRIG NOW')
+
+    # Input IN1 and IN2, both read with one round trip as soon as the buffer is full
+    red_ip.wait_triggered(timeout=5)
+    red_ip.wait_filled(timeout=5)
+    IN1, IN2 = fast_acq.read_multi(red_ip)  # Readout buffer IN1, IN2 (binary)
+    DF_IN1[str(freq)] = IN1
     DF_IN2[str(freq)] = IN2
 
     red_ip.tx_txt('OUTPUT2:STATE OFF')
 
+print(f"Settling: {sum(p['dwell'] for p in sched.log):.1f} s in total for {len(sched.log)} points")
 
 
 Data_IN1 = 'daten/IN1_INT_IN'  # + str(datetime.now().strftime('%Y-%m-%d_%H_%M'))
@@ -13,7 +13,6 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 import pandas as pd
-import redpitaya_scpi as scpi
 import scipy.signal as sig
 
 import datetime
@@ -21,6 +20,12 @@ import time
 import sys
 import os
 
+# Client with binary transfer (fast_acq) from 005 instead of the old copy in this folder
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '005_self_tuned_filter', 'redpitaya_scpi'))
+import redpitaya_scpi as scpi
+import fast_acq
+import gen_shadow
+
 #%% Import von KiCad
 
 filepath = r'C:\Users\nilsr\OneDrive\Desktop\Nils\001_Studium\006_Semester6\001_Analoge_Schaltungen\schaltungsentwurf_no1\schaltungsentwurf_no1.raw'
@@ -94,15 +99,15 @@ offset = 0.0
 freqs = np.linspace(50, 1000, 100)
 print("Parameters:\n","Waveform:",func,"\n","Amplitude:",ampl,"[v]\n","Offset:",offset,"[V]\n","Frequency range:",min(freqs),"to",max(freqs))
 
+# Generator setup once, per frequency only the changed frequency is sent
+gen = gen_shadow.ShadowGenerator(red_ip, 1)
+gen.reset()  # Signal Generator reset
+gen.set(func=scpi.Waveform[str(func).upper()], volt=ampl, offset=offset)  # Wave form, Magnitude, Offset
+
 for freq in freqs:
 
-    red_ip.tx_txt('GEN:RST')  # Signal Generator reset
-    red_ip.tx_txt('SOUR1:FUNC ' + str(func).upper())  # Wave form
-    red_ip.tx_txt('SOUR1:VOLT ' + str(ampl))  # Magnitude
-    red_ip.tx_txt('SOUR1:VOLT:OFFS ' + str(offset))  # Offset
-    red_ip.tx_txt('SOUR1:FREQ:FIX ' + str(freq))  # Frequency
-    red_ip.tx_txt('OUTPUT1:STATE ON')  # Output
-    red_ip.tx_txt('SOUR1:TRig:INT')
+    gen.set(freq=freq)  # Frequency (phase-continuous, no generator reset)
+    gen.output(True)  # Output (only sent once)
     time.sleep(1)
 
     # Trigger
@@ -112,25 +117,12 @@ for freq in freqs:
     red_ip.tx_txt('ACQ:TRIG:DLY 8192')  # Delay
     red_ip.tx_txt('ACQ:START')  # Start measurement
     red_ip.tx_txt('ACQ:TRIG NOW')
-    
-    min_periods = 5
-    wait_time = max(0.1, min_periods/freq)
-    #time.sleep(wait_time)
-
-    # Input IN1
-    time.sleep(wait_time)  # in seconds
-    red_ip.tx_txt('ACQ:SOUR1:DATA?')  # Readout buffer IN1
-    IN1str = red_ip.rx_txt()
-    IN1str = IN1str.strip('{}\n\r').replace("  ", "").split(',')
-    IN1 = np.array(list(map(float, IN1str)))
-    DF_IN1[str(freq)] = IN1
 
-    # Input IN2
-    time.sleep(wait_time)  # in seconds
-    red_ip.tx_txt('ACQ:SOUR2:DATA?')  # Readout buffer IN2
-    IN2str = red_ip.rx_txt()
-    IN2str = IN2str.strip('{}\n\r').replace("  ", "").split(',')
-    IN2 = np.array(list(map(float, IN2str)))
+    # Input IN1 and IN2, both read with one round trip as soon as the buffer is full
+    red_ip.wait_triggered(timeout=5)
+    red_ip.wait_filled(timeout=5)
+    IN1, IN2 = fast_acq.read_multi(red_ip)  # Readout buffer IN1, IN2 (binary)
+    DF_IN1[str(freq)] = IN1
     DF_IN2[str(freq)] = IN2
 
     red_ip.tx_txt('OUTPUT2:STATE OFF')
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decimation and capture length per test frequency
+Input signal: IN1
+Output signal: IN2
+
+A fixed ACQ:DEC 64 and the full 16384 samples hold 0.08 periods at 10 Hz and 84
+periods at 10 kHz. The planner chooses for every frequency
+    - the decimation for about `spp` samples per period (ACQ:DEC:Factor accepts
+      1, 2, 4, 8, 16 and every integer from 17 to 65536, ACQ:DEC only powers of two)
+    - the number of samples for `periods` whole periods (ACQ:SOUR<n>:DATA:STArt:N),
+      limited by the buffer. ACQ:TRig:DLY counts from the middle of the buffer,
+      num_samples after the trigger need DLY num_samples - 8192
+    - the coherent frequency periods * fs / num_samples, which the generator can
+      be set to, so the tone lies exactly on DFT bin `periods`
+
+Only the planned samples after the trigger are transferred. The gain IN2 / IN1
+is the ratio of the single DFT bins, no window and no sine fit.
+
+Usage:
+    p = acq_plan.plan(10.0, periods=10)
+    gen.set(freq=p.coherent_freq)
+    x, y = acq_plan.capture(rp, p)
+    H, H_std = acq_plan.single_bin(x, y, p.periods)
+"""
+
+# %% Init
+from typing import NamedTuple, Tuple
+import numpy as np
+import pandas as pd
+import redpitaya_scpi as scpi
+import fast_acq
+from redpitaya_scpi import ADC_RATE, BUFFER_SIZE
+
+DEC_MAX = 65536
+
+
+class AcqPlan(NamedTuple):
+    freq: float             # requested frequency in Hz
+    dec: int                # ACQ:DEC:Factor
+    fs: float               # sampling rate in Hz
+    num_samples: int        # samples after the trigger (DATA:STArt:N)
+    periods: int            # whole periods in the capture (DFT bin of the tone)
+    coherent_freq: float    # periods * fs / num_samples
+
+
+# %% Planning
+def valid_dec(dec: float) -> int:
+    '''Nearest decimation accepted by ACQ:DEC:Factor (powers of two up to 16, then every integer).'''
+    if dec >= 16.5:
+        return int(min(round(dec), DEC_MAX))
+    return int(2 ** np.clip(np.round(np.log2(max(dec, 1))), 0, 4))
+
+
+def plan(freq: float, periods: int = 10, spp: float = 64, max_samples: int = BUFFER_SIZE) -> AcqPlan:
+    '''
+    Decimation and capture length for `periods` whole periods of freq.
+
+    Args:
+        freq (float): Test frequency in Hz.
+        periods (int, optional): Periods in the capture. Defaults to 10.
+        spp (float, optional): Samples per period aimed at. Defaults to 64.
+        max_samples (int, optional): Upper limit of the capture length. Defaults to BUFFER_SIZE.
+
+    Returns:
+        AcqPlan. At very low frequencies the periods are reduced to what fits at DEC_MAX.
+    '''
+    assert freq > 0 and periods >= 1, "Frequency and periods need to be positive"
+    # At least `spp` samples per period, but all periods have to fit into the buffer
+    dec = valid_dec(ADC_RATE / (spp * freq))
+    while dec < DEC_MAX and periods * ADC_RATE / (dec * freq) > max_samples:
+        dec = valid_dec(dec + 1 if dec >= 16 else 2 * dec)
+    fs = ADC_RATE / dec
+    periods = int(max(min(periods, np.floor(max_samples * freq / fs)), 1))
+    num_samples = int(min(round(periods * fs / freq), max_samples))
+    return AcqPlan(freq, dec, fs, num_samples, periods, periods * fs / num_samples)
+
+
+def plan_sweep(freqs, periods: int = 10, spp: float = 64, max_samples: int = BUFFER_SIZE) -> pd.DataFrame:
+    '''Plans for all frequencies of a sweep, with the capture time per point.'''
+    df = pd.DataFrame([plan(f, periods, spp, max_samples) for f in freqs])
+    df['capture_s'] = df['num_samples'] / df['fs']
+    return df
+
+
+# %% Capture and estimation
+def capture(rp: scpi.scpi, p: AcqPlan, trig: str = 'NOW', trig_lvl: float = 0.0, timeout: float = None) -> np.ndarray:
+    '''
+    Standard buffer capture of p.num_samples after the trigger on IN1 and IN2,
+    only these samples are read (one round trip for both channels).
+
+    Returns:
+        (2, p.num_samples) float32 array in Volts.
+    '''
+    with rp.batch():
+        rp.tx_txt('ACQ:RST')
+        rp.tx_txt('ACQ:DATA:FORMAT BIN')
+        rp.tx_txt(f"ACQ:DEC:Factor {p.dec}")
+        rp.tx_txt(f"ACQ:TRig:DLY {p.num_samples - BUFFER_SIZE // 2}")
+        rp.tx_txt(f"ACQ:TRig:LEV {trig_lvl}")
+        rp.tx_txt('ACQ:START')
+        rp.tx_txt(f"ACQ:TRig {trig}")
+
+    if timeout is None:
+        timeout = 2 * p.num_samples / p.fs + 5
+    rp.wait_triggered(timeout=timeout)
+    rp.wait_filled(timeout=timeout)
+    tpos = int(rp.txrx_txt('ACQ:TPOS?'))
+    data = fast_acq.read_multi(rp, start=tpos, num_samples=p.num_samples)
+    rp.tx_txt('ACQ:STOP')
+    return data
+
+
+def single_bin(x: np.ndarray, y: np.ndarray, periods: int) -> Tuple[complex, float]:
+    '''
+    Gain y / x from DFT bin `periods` of a period-coherent capture.
+
+    Returns:
+        (gain, standard deviation of the complex gain from the residual noise)
+    '''
+    n = len(x)
+    e = np.exp(-2j * np.pi * periods * np.arange(n) / n)
+    X, Y = 2 * (x @ e) / n, 2 * (y @ e) / n
+    # Residual after removing offset and tone, same convention as sweep_scheduler.tone_response
+    var = []
+    for v, V in ((x, X), (y, Y)):
+        r = v - np.mean(v) - np.real(V * np.conj(e))
+        var.append(np.sum(r**2) / max(n - 3, 1) * 4 / n)
+    H = Y / X
+    return H, abs(H) * np.sqrt(var[0] / abs(X)**2 + var[1] / abs(Y)**2)
+
+
+# %% Example: fixed dec 64 / 16384 samples compared with the plan
+if __name__ == '__main__':
+    freqs = np.array([10, 30, 100, 300, 1000, 3000, 10000])
+    df = plan_sweep(freqs, periods=10)
+    df['periods_dec64'] = BUFFER_SIZE * 64 / ADC_RATE * freqs
+    print(df.round(4).to_string(index=False))
+    print(f"Samples transferred: {df['num_samples'].sum()} instead of {len(freqs) * BUFFER_SIZE}")
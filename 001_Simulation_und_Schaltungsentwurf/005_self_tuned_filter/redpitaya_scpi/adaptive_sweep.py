@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Adaptive frequency grid for stepped sine sweeps
+Input signal: IN1
+Output signal: IN2
+
+Instead of a uniform grid (np.arange(800, 1200, 5)), the sweep starts with a
+coarse log grid and refines it where the response needs it:
+    - at the fitted f0 and the -3 dB frequencies f0 (sqrt(1 + 1/4Q^2) +- 1/2Q),
+      if no measured point is closer than 1/8 of the bandwidth
+    - in the intervals with the largest phase change or magnitude curvature
+After every batch a second-order model (LP, HP, BP or BS) is fitted to the complex
+gains, weighted by their standard deviation. The sweep stops when the confidence
+half-widths of f0, Q and H0 are within the requested relative bounds.
+
+The measurement is a callable freqs -> (H, H_std), so the refinement works with
+any point measurement; board_measure() uses the settling-aware scheduler and a
+tone capture per point.
+
+Usage:
+    sweep = adaptive_sweep.AdaptiveSweep(100, 10000, 'BP', f0_tol=1e-3, Q_tol=1e-2)
+    fit = sweep.run(adaptive_sweep.board_measure(rp, gen, sched))
+    print(fit['f0'], fit['Q'], fit['H0'], len(sweep.freqs))
+"""
+
+# %% Init
+from typing import Callable, Optional, Tuple
+import numpy as np
+import pandas as pd
+from scipy.optimize import least_squares
+import redpitaya_scpi as scpi
+from gen_shadow import ShadowGenerator
+from sweep_scheduler import SettlingScheduler, capture_tone, response
+
+
+# %% Second-order fit
+def initial_guess_bode(f: np.ndarray, H: np.ndarray, ftype: str) -> Tuple[float, float, float]:
+    '''f0, Q and H0 from the measured points: extremum or phase crossing, -3 dB width.'''
+    mag = np.abs(H)
+    if ftype == 'BP':
+        i = int(np.argmax(mag))
+        H0 = mag[i]
+    elif ftype == 'BS':
+        i = int(np.argmin(mag))
+        H0 = max(mag[0], mag[-1])
+    else:
+        # LP -90 deg, HP +90 deg at f0
+        i = int(np.argmin(np.abs(np.angle(H, deg=True) - (-90 if ftype == 'LP' else 90))))
+        H0 = mag[0] if ftype == 'LP' else mag[-1]
+    f0 = f[i]
+    if ftype in ('LP', 'HP'):
+        return f0, max(mag[i] / H0, 0.1), H0
+
+    # -3 dB width of the peak (BP) or the notch (BS)
+    inside = mag >= H0 / np.sqrt(2) if ftype == 'BP' else mag <= H0 / np.sqrt(2)
+    lo, hi = i, i
+    while lo > 0 and inside[lo - 1]:
+        lo -= 1
+    while hi < len(f) - 1 and inside[hi + 1]:
+        hi += 1
+    width = f[min(hi + 1, len(f) - 1)] - f[max(lo - 1, 0)]
+    return f0, float(np.clip(f0 / max(width, 1e-9), 0.3, 300)), H0
+
+
+def fit_bode_second_order(
+    f: np.ndarray,
+    H: np.ndarray,
+    H_std: np.ndarray,
+    ftype: str = 'BP',
+    guess: Optional[Tuple[float, float, float]] = None
+) -> dict:
+    '''
+    Weighted least squares fit of response(f, f0, Q, H0, ftype) to complex gains.
+
+    Returns:
+        dict with f0, Q, H0, their standard deviations f0_std, Q_std, H0_std (scaled with the
+        reduced chi-square if the model does not fit within the noise) and chi2 (reduced).
+    '''
+    # H_std is the standard deviation of the complex gain, real and imaginary part get 1 / sqrt(2) of it
+    w = np.sqrt(2) / np.maximum(H_std, 1e-6 * np.max(np.abs(H)))
+
+    def residual(p):
+        r = (response(f, np.exp(p[0]), np.exp(p[1]), p[2], ftype) - H) * w
+        return np.concatenate((r.real, r.imag))
+
+    f0, Q, H0 = guess if guess is not None else initial_guess_bode(f, H, ftype)
+    best = None
+    # A few start values for Q, the cost has local minima for far off Q
+    for q in {Q, Q / 4, Q * 4}:
+        res = least_squares(residual, [np.log(f0), np.log(q), H0], x_scale=[0.01, 0.1, abs(H0) * 0.01 + 1e-12])
+        if best is None or res.cost < best.cost:
+            best = res
+
+    dof = max(2 * len(f) - 3, 1)
+    chi2 = 2 * best.cost / dof
+    try:
+        cov = np.linalg.inv(best.jac.T @ best.jac) * max(chi2, 1.0)
+        std = np.sqrt(np.diag(cov))
+    except np.linalg.LinAlgError:
+        std = np.full(3, np.inf)
+    f0, Q, H0 = np.exp(best.x[0]), np.exp(best.x[1]), best.x[2]
+    return {'f0': f0, 'Q': Q, 'H0': H0, 'f0_std': f0 * std[0], 'Q_std': Q * std[1], 'H0_std': std[2], 'chi2': chi2}
+
+
+# %% Adaptive sweep
+class AdaptiveSweep(object):
+    '''
+    Coarse log grid, refined around resonance and phase changes until f0, Q and H0 are known well enough.
+
+    Args:
+        f_min (float): Lowest frequency in Hz.
+        f_max (float): Highest frequency in Hz.
+        ftype (str, optional): 'LP', 'HP', 'BP' or 'BS'. Defaults to 'BP'.
+        n_start (int, optional): Points of the coarse log grid. Defaults to 9.
+        batch (int, optional): Points added per refinement step. Defaults to 4.
+        f0_tol (float, optional): Relative confidence half-width for f0. Defaults to 1e-3.
+        Q_tol (float, optional): Relative confidence half-width for Q. Defaults to 1e-2.
+        H0_tol (float, optional): Relative confidence half-width for H0. Defaults to 1e-2.
+        z (float, optional): Confidence factor (1.96 for 95 %). Defaults to 1.96.
+        max_points (int, optional): Upper limit of measured points. Defaults to 60.
+    '''
+
+    def __init__(
+        self,
+        f_min: float,
+        f_max: float,
+        ftype: str = 'BP',
+        n_start: int = 9,
+        batch: int = 4,
+        f0_tol: float = 1e-3,
+        Q_tol: float = 1e-2,
+        H0_tol: float = 1e-2,
+        z: float = 1.96,
+        max_points: int = 60
+    ):
+        assert ftype in ('LP', 'HP', 'BP', 'BS'), f"{ftype} is not a defined filter type"
+        assert 0 < f_min < f_max, "f_min needs to be below f_max"
+        self.f_min = f_min
+        self.f_max = f_max
+        self.ftype = ftype
+        self.n_start = n_start
+        self.batch = batch
+        self.tol = {'f0': f0_tol, 'Q': Q_tol, 'H0': H0_tol}
+        self.z = z
+        self.max_points = max_points
+        self.freqs = np.zeros(0)
+        self.H = np.zeros(0, dtype=complex)
+        self.H_std = np.zeros(0)
+        self.result = None          # last fit
+        self.history = []           # (points, fit) after every batch
+
+    def add(self, freqs, H, H_std) -> None:
+        '''Add measured points (kept sorted by frequency).'''
+        f = np.concatenate((self.freqs, np.atleast_1d(freqs).astype(float)))
+        idx = np.argsort(f)
+        self.freqs = f[idx]
+        self.H = np.concatenate((self.H, np.atleast_1d(H)))[idx]
+        self.H_std = np.concatenate((self.H_std, np.atleast_1d(H_std)))[idx]
+
+    def fit(self) -> dict:
+        guess = None
+        if self.result is not None:
+            guess = (self.result['f0'], self.result['Q'], self.result['H0'])
+        self.result = fit_bode_second_order(self.freqs, self.H, self.H_std, self.ftype, guess)
+        self.history.append((len(self.freqs), self.result))
+        return self.result
+
+    def converged(self) -> bool:
+        '''True if the confidence half-widths of f0, Q and H0 are within the bounds.'''
+        r = self.result
+        if r is None or len(self.freqs) < 5:
+            return False
+        return all(self.z * r[f'{k}_std'] <= tol * abs(r[k]) for k, tol in self.tol.items())
+
+    def candidates(self) -> np.ndarray:
+        '''Next batch of frequencies: model points (f0, -3 dB) first, then the most curved intervals.'''
+        f = self.freqs
+        phase = np.unwrap(np.angle(self.H))
+        mag = 20 * np.log10(np.abs(self.H))
+        curv = np.zeros(len(f))
+        curv[1:-1] = np.abs(np.diff(mag, 2))
+        # Score of the intervals: phase change plus magnitude curvature at both ends (dB)
+        order = np.argsort(np.degrees(np.abs(np.diff(phase))) + curv[:-1] + curv[1:])[::-1]
+
+        spacing = max(1 / (8 * self.result['Q']), 1e-4) if self.result is not None else 1e-2
+        new = []
+        while not new and spacing >= 1e-4:
+            def free(x: float) -> bool:
+                pts = np.concatenate((f, new))
+                return self.f_min <= x <= self.f_max and np.min(np.abs(np.log(pts / x))) > spacing
+
+            if self.result is not None:
+                f0, Q = self.result['f0'], self.result['Q']
+                root = np.sqrt(1 + 1 / (4 * Q**2))
+                for x in (f0, f0 * (root - 1 / (2 * Q)), f0 * (root + 1 / (2 * Q))):
+                    if len(new) < self.batch and free(x):
+                        new.append(x)
+            for i in order:
+                if len(new) >= self.batch:
+                    break
+                mid = np.sqrt(f[i] * f[i + 1])
+                if free(mid):
+                    new.append(mid)
+            # Grid is dense enough for the spacing, but the bounds are not reached yet
+            spacing /= 2
+        return np.array(sorted(new))
+
+    def run(self, measure: Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]) -> dict:
+        '''
+        Measure the coarse grid, then refine until converged() or max_points.
+
+        Args:
+            measure (callable): freqs -> (H, H_std), complex gains and their standard deviations.
+
+        Returns:
+            Last fit (see fit_bode_second_order).
+        '''
+        freqs = np.geomspace(self.f_min, self.f_max, self.n_start)
+        while len(freqs):
+            self.add(freqs, *measure(freqs))
+            self.fit()
+            if self.converged() or len(self.freqs) >= self.max_points:
+                break
+            freqs = self.candidates()[:self.max_points - len(self.freqs)]
+        return self.result
+
+    @property
+    def data(self) -> pd.DataFrame:
+        '''Measured points with the column names of the plot scripts (find_center_frequency_by_phase).'''
+        return pd.DataFrame({
+            'Frequency [Hz]': self.freqs,
+            'Amplitude [dB]': 20 * np.log10(np.abs(self.H)),
+            'Phase [deg]': np.angle(self.H, deg=True),
+            'H_std': self.H_std,
+        })
+
+
+# %% Measurement on the board
+def board_measure(
+    rp: scpi.scpi,
+    gen: ShadowGenerator,
+    sched: SettlingScheduler,
+    periods: int = 20,
+    confirm: bool = True
+) -> Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]]:
+    '''
+    Point measurement for AdaptiveSweep.run: settling-aware retune (sched.run) and one
+    tone capture of `periods` periods per frequency.
+    '''
+    def measure(freqs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        result = {}
+        for freq in sched.run(gen, freqs, confirm=confirm):
+            result[freq] = capture_tone(rp, freq, periods)
+        H, H_std = zip(*(result[f] for f in freqs))
+        return np.array(H), np.array(H_std)
+    return measure
+
+
+# %% Example: bandpass around 1 kHz
+if __name__ == '__main__':
+    import time
+    import matplotlib.pyplot as plt
+    from redpitaya_scpi import Waveform
+    from labdesk import LABDESK
+
+    rp = scpi.scpi(LABDESK["ELIE4"])
+
+    gen = ShadowGenerator(rp, 1)
+    gen.reset()
+    gen.set(func=Waveform.SINE, volt=0.5, offset=0.0)
+    sched = SettlingScheduler(f0=1000, Q=5, ftype='BP', tol=1e-3)
+
+    sweep = AdaptiveSweep(100, 10000, 'BP')
+    t0 = time.perf_counter()
+    fit = sweep.run(board_measure(rp, gen, sched))
+    gen.output(False)
+    print(f"{len(sweep.freqs)} points in {time.perf_counter() - t0:.1f} s")
+    for k in ('f0', 'Q', 'H0'):
+        print(f"{k} = {fit[k]:.4g} +- {sweep.z * fit[k + '_std']:.2g}")
+    sweep.data.to_csv('data/bode_adaptive.csv', index=False)
+
+    f = np.geomspace(sweep.f_min, sweep.f_max, 500)
+    model = response(f, fit['f0'], fit['Q'], fit['H0'], sweep.ftype)
+    fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True)
+    ax1.semilogx(f, 20 * np.log10(np.abs(model)), label='fit')
+    ax1.semilogx(sweep.freqs, sweep.data['Amplitude [dB]'], 'o', label='measured')
+    ax1.set_ylabel('dB')
+    ax1.legend()
+    ax2.semilogx(f, np.angle(model, deg=True))
+    ax2.semilogx(sweep.freqs, sweep.data['Phase [deg]'], 'o')
+    ax2.set_ylabel('Phase / deg')
+    ax2.set_xlabel('f / Hz')
+    plt.show()
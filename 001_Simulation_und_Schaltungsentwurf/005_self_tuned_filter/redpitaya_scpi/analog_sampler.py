@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Continuous sampling of the slow analog inputs (AIN0..AIN3) in the background
+
+scpi.analog_get_data() costs one round trip per vector. The sampler queues
+`depth` vectors (4 * depth ANALOG:PIN? queries) per round trip, timestamps
+every vector and writes it into a fixed-size ring buffer. Used to log the
+phase detector output (V_av of the multiplier, see theorie2.py) on AIN0
+while the filter tunes itself.
+
+The sampler shares the connection with the measurement: commands for the
+board have to be sent inside `with sampler.paused():`, which waits for the
+running round trip to finish.
+
+Usage:
+    import analog_sampler
+    with analog_sampler.AnalogSampler(rp, size=10000) as sampler:
+        for t, ain in sampler:               # blocks until the next vector
+            print(t, ain[0])
+            if ...:
+                break
+        with sampler.paused():
+            rp.tx_txt('SOUR1:FREQ:FIX 1000')
+    t, ain = sampler.data()                  # (n,) timestamps, (n, 4) Volts
+    print(f'{sampler.rate:.1f} vectors/s')
+"""
+
+# %% Init
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+import numpy as np
+from redpitaya_scpi import scpi
+
+
+# %% Sampler
+class AnalogSampler(object):
+    '''
+    Background thread reading all 4 slow analog inputs into a ring buffer.
+
+    Args:
+        rp (scpi): Connected board.
+        size (int, optional): Number of vectors kept in the ring buffer. Defaults to 10000.
+        depth (int, optional): Vectors queued per round trip. Defaults to 8.
+        interval (float, optional): Minimum time between round trips in seconds,
+            0 samples as fast as the connection allows. Defaults to 0.
+    '''
+
+    def __init__(self, rp: scpi, size: int = 10000, depth: int = 8, interval: float = 0.0):
+        assert size > 0 and depth > 0, "size and depth must be positive"
+        self.rp = rp
+        self.size = size
+        self.depth = depth
+        self.interval = interval
+
+        self._t = np.zeros(size)                # time.time() of each vector
+        self._data = np.zeros((size, 4))        # AIN0..AIN3 in Volts
+        self._count = 0                         # vectors written since start()
+        self._t_start = None
+        self._t_last = None
+        self.error = None                       # exception that stopped the thread
+
+        self._bus = threading.Lock()            # held while a round trip is running
+        self._new = threading.Condition()       # notified on new vectors and on stop
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> 'AnalogSampler':
+        '''Clear the ring buffer and start sampling.'''
+        assert self._thread is None, "sampler is already running"
+        self._count = 0
+        self._t_start = time.perf_counter()
+        self._t_last = None
+        self.error = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='AnalogSampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        '''Stop sampling after the running round trip. Raises the error that stopped the thread, if any.'''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @contextmanager
+    def paused(self):
+        '''Use the connection for other commands, sampling continues after the block.'''
+        with self._bus:
+            yield self.rp
+
+    def _run(self) -> None:
+        rp = self.rp
+        try:
+            while not self._stop.is_set():
+                t_round = time.perf_counter()
+                with self._bus:
+                    t_send = time.time()
+                    with rp.batch():
+                        replies = [rp.txrx_txt(f"ANALOG:PIN? AIN{i}") for _ in range(self.depth) for i in range(4)]
+                        rp.check_error()
+                    t_recv = time.time()
+                values = np.array([reply.result() for reply in replies], dtype=float).reshape(self.depth, 4)
+                # The board answers the queued vectors one after another between send and receive
+                stamps = t_send + (np.arange(self.depth) + 0.5) / self.depth * (t_recv - t_send)
+                self._push(stamps, values)
+
+                if self.interval:
+                    self._stop.wait(max(0.0, self.interval - (time.perf_counter() - t_round)))
+        except Exception as e:
+            self.error = e
+        finally:
+            self._stop.set()
+            with self._new:
+                self._new.notify_all()
+
+    def _push(self, stamps: np.ndarray, values: np.ndarray) -> None:
+        with self._new:
+            idx = (self._count + np.arange(len(stamps))) % self.size
+            self._t[idx] = stamps
+            self._data[idx] = values
+            self._count += len(stamps)
+            self._t_last = time.perf_counter()
+            self._new.notify_all()
+
+    # %% Readout
+    @property
+    def count(self) -> int:
+        '''Number of vectors sampled since start() (including overwritten ones).'''
+        return self._count
+
+    @property
+    def rate(self) -> float:
+        '''Achieved sample rate in vectors/s.'''
+        if not self._count:
+            return 0.0
+        return self._count / (self._t_last - self._t_start)
+
+    def data(self, last: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Copy of the ring buffer content, oldest vector first.
+
+        Args:
+            last (int, optional): Only return the newest `last` vectors. Defaults to all in the buffer.
+
+        Returns:
+            (n,) timestamps (time.time()) and (n, 4) AIN0..AIN3 in Volts.
+        '''
+        with self._new:
+            n = min(self._count, self.size if last is None else min(last, self.size))
+            idx = np.arange(self._count - n, self._count) % self.size
+            return self._t[idx], self._data[idx]
+
+    def __iter__(self) -> Iterator[Tuple[float, np.ndarray]]:
+        '''Yield (timestamp, AIN0..AIN3) for every new vector until the sampler stops.
+        A consumer slower than the sampler skips the vectors already overwritten.'''
+        pos = self._count
+        while True:
+            with self._new:
+                while pos >= self._count and not self._stop.is_set():
+                    self._new.wait()
+                if pos >= self._count:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                pos = max(pos, self._count - self.size)
+                i = pos % self.size
+                t, ain = self._t[i], self._data[i].copy()
+            pos += 1
+            yield t, ain
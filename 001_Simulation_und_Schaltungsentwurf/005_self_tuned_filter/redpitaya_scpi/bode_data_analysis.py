@@ -2,8 +2,8 @@
 # -*- coding: utf-8 -*-
 """
 Data analysis for Bode plots
-Input signal: DF_IN1
-Output signal: DF_IN2
+Input signal: IN1
+Output signal: IN2
 
 @author: Mirco Meiners (HSB)
 """
@@ -12,6 +12,7 @@ import numpy as np
 import scipy.signal as sig
 import pandas as pd
 from fit_sin import fit_sin
+import capture_archive
 import matplotlib.pyplot as plt
 
 # %% Array of tones (GEN):
@@ -24,25 +25,18 @@ t = np.linspace(0, 8.389e-3, N)
 ts = 8.389e-3 / N  # sampling time
 
 # %% Data storage and read
-# + str(datetime.now().strftime('%Y-%m-%d_%H_%M'))
-Data_IN1 = 'data/IN1_UB_VBS'
-# + str(datetime.now().strftime('%Y-%m-%d_%H_%M'))
-Data_IN2 = 'data/IN2_UB_VBP'
-# Data_IN = 'data/IN_UB_VBS_VBP'  # + str(datetime.now().strftime('%Y-%m-%d_%H_%M'))
-
-DF_IN1 = pd.read_csv(Data_IN1 + '.csv')
-DF_IN2 = pd.read_csv(Data_IN2 + '.csv')
-
-# DF_IN1 = pd.read_parquet(Data_IN1 + '.parquet')
-# DF_IN2 = pd.read_parquet(Data_IN2 + '.parquet')
+# Memory mapped archive of bode_data_meas.py, ARC.volts(ARC.find(freq)) is a view
+# of IN1 and IN2 at one frequency, a capture is only read when it is used
+ARC = capture_archive.open_archive('data/bode_run/data')
 
 # %% Fitting and extraction of sine params
 SigParam_IN1 = pd.DataFrame()
 SigParam_IN2 = pd.DataFrame()
 
 for freq in freqs:
-    SigParam_IN1[str(freq)] = fit_sin(t, DF_IN1[str(freq)].values)
-    SigParam_IN2[str(freq)] = fit_sin(t, DF_IN2[str(freq)].values)
+    IN1, IN2 = ARC.volts(ARC.find(freq))  # views into the file
+    SigParam_IN1[str(freq)] = fit_sin(t, IN1)
+    SigParam_IN2[str(freq)] = fit_sin(t, IN2)
 
 # %% Test fitting for f = 800 Hz
 plt.plot(t, ampl * np.sin(2 * np.pi * 800 * t) + offset, label='OUT1')
@@ -61,10 +55,12 @@ MAG_dB_IN1_fit = 20 * np.log10(np.abs(SigParam_IN2.iloc[0] / ampl))
 MAG_dB_IN2_fit = 20 * np.log10(np.abs(SigParam_IN2.iloc[0] / ampl))
 MAG_dB_fit = 20 * np.log10(np.abs(SigParam_IN2.iloc[0] / SigParam_IN1.iloc[0]))
 
-# %% Magnitudes (rms) via std on DataFrame
-MAG_dB_IN1 = 20 * np.log10(np.abs(DF_IN1.std() / ampl))
-MAG_dB_IN2 = 20 * np.log10(np.abs(DF_IN2.std() / ampl))
-MAG_dB = 20 * np.log10(np.abs(DF_IN2.std() / DF_IN2.std()))
+# %% Magnitudes (rms) via std of the captures
+STD = pd.DataFrame({str(freq): ARC.volts(ARC.find(freq)).std(axis=1, ddof=1) for freq in freqs},
+                   index=['IN1', 'IN2'])
+MAG_dB_IN1 = 20 * np.log10(np.abs(STD.loc['IN1'] / ampl))
+MAG_dB_IN2 = 20 * np.log10(np.abs(STD.loc['IN2'] / ampl))
+MAG_dB = 20 * np.log10(np.abs(STD.loc['IN2'] / STD.loc['IN2']))
 
 # %% Phase difference
 # Ref.:
@@ -79,27 +75,29 @@ lags = sig.correlation_lags(len(y1), len(y2))
 phase_rad_xcorr = lags[np.argmax(corr)] * ts * w[0]
 phase_deg_xcorr = np.rad2deg(phase_rad_xcorr)
 
-# %% Cross-correlation with dataframes and synthesized input signal
+# %% Cross-correlation with the captures and synthesized input signal
 phase_IN1 = np.ndarray(len(freqs))
 phase_IN2 = np.ndarray(len(freqs))
 
 for n in range(0, len(freqs)):
     vin = ampl * np.sin(2 * np.pi * freqs[n] * t)
-    corr1 = sig.correlate(vin, DF_IN1[str(freqs[n])].values)
-    corr2 = sig.correlate(vin, DF_IN2[str(freqs[n])].values)
-    lags1 = sig.correlation_lags(len(vin), len(DF_IN1[str(freqs[n])]))
-    lags2 = sig.correlation_lags(len(vin), len(DF_IN2[str(freqs[n])]))
+    IN1, IN2 = ARC.volts(ARC.find(freqs[n]))
+    corr1 = sig.correlate(vin, IN1)
+    corr2 = sig.correlate(vin, IN2)
+    lags1 = sig.correlation_lags(len(vin), len(IN1))
+    lags2 = sig.correlation_lags(len(vin), len(IN2))
     phase_rad_xcorr1 = 2 * np.pi * freqs[n] * lags1[np.argmax(corr1)] * ts
     phase_rad_xcorr2 = 2 * np.pi * freqs[n] * lags2[np.argmax(corr2)] * ts
     phase_IN1[n] = np.rad2deg(phase_rad_xcorr1)
     phase_IN2[n] = np.rad2deg(phase_rad_xcorr2)
 
-# %% Cross-correlation with dataframes and measured input signal as DF_IN1
+# %% Cross-correlation with the captures and measured input signal as IN1
 PHASE_xcorr = pd.Series()
 
 for freq in freqs:
-    corr = sig.correlate(DF_IN1[str(freq)].values, DF_IN2[str(freq)])
-    lags = sig.correlation_lags(len(DF_IN1[str(freq)]), len(DF_IN2[str(freq)]))
+    IN1, IN2 = ARC.volts(ARC.find(freq))
+    corr = sig.correlate(IN1, IN2)
+    lags = sig.correlation_lags(len(IN1), len(IN2))
     phase_rad_xcorr = 2 * np.pi * freq * lags[np.argmax(corr)] * ts
     PHASE_xcorr = np.rad2deg(phase_rad_xcorr)
 
@@ -9,11 +9,13 @@ Output signal: DF_IN2
 """
 
 # %% Init
-import time
 from datetime import datetime
 import redpitaya_scpi as scpi
+import fast_acq
+import gen_shadow
+import sweep_scheduler
+import sweep_run
 import numpy as np
-import pandas as pd
 # import matplotlib.pyplot as plt
 
 # %% Connection params
@@ -38,109 +40,102 @@ trig_lvl = 0.5
 # %% Measurement / Data Accquisition
 TSTAMP = datetime.datetime.now()
 
-DF_IN1 = pd.DataFrame()
-DF_IN2 = pd.DataFrame()
-
 # Parameters
 func = 'SINE'
 ampl = 0.5
 offset = 0.0
 freqs = np.arange(800, 1200, 5)
 
-for freq in freqs:
-
-    rp.tx_txt('ANALOG:RST ')  # Set analog outputs to 0V
-    rp.tx_txt('GEN:RST')  # Signal Generator reset
-    rp.tx_txt('PHAS:ALIGN')  # Synchronize
-    rp.tx_txt('SOUR1:TRig:INT')
-    rp.tx_txt('SOUR1:FUNC ' + str(func))  # Wellenform
-    rp.tx_txt('SOUR1:VOLT ' + str(ampl))  # Amplitude
-    rp.tx_txt('SOUR1:VOLT:OFFS ' + str(offset))  # Offset
-    rp.tx_txt('SOUR1:PHAS ' + str(offset))  # Offset
-    rp.tx_txt('SOUR1:FREQ:FIX:Direct ' + str(freq))  # Frequenz
-    # rp.tx_txt('SOUR1:FREQ:FIX ' + str(freq))  # Frequenz
-
-    # Enable output
-    rp.tx_txt('OUTPUT1:STATE ON')
-    rp.tx_txt('SOUR1:TRig:INT')
-
-    time.sleep(1)  # in Sekunden
+# Expected filter (sets the dwell time per point instead of a flat 1 s)
+f0_expected = 1000  # Hz
+Q_expected = 5
+tol = 1e-3  # relative error left by the transient
+
+# Captures go to disk as they arrive (capture archive: preallocated memory map
+# + JSON sidecar), an interrupted run continues at the first missing frequency
+run = sweep_run.SweepRun('data/bode_run', freqs, n_chan=2, n_samples=READ_DATA_SIZE,
+                         meta={'func': func, 'ampl': ampl, 'offset': offset, 'dec': dec, 'board': IP,
+                               'units': 'VOLTS'})
+
+# Generator setup once, per frequency only SOUR1:FREQ:FIX:Direct is sent
+# (phase-continuous, the DUT is not restarted at every point)
+rp.tx_txt('ANALOG:RST ')  # Set analog outputs to 0V
+gen = gen_shadow.ShadowGenerator(rp, 1)
+gen.reset()  # GEN:RST, PHAS:ALIGN
+gen.set(func=scpi.Waveform[func], volt=ampl, offset=offset, phase=0.0)
+
+# Retune (phase-continuous), wait tau * ln(jump / tol) with tau = Q / (pi f0),
+# confirm steady state with short captures, then yield for the real capture
+sched = sweep_scheduler.SettlingScheduler(f0_expected, Q_expected, 'BP', tol=tol)
+for freq in sched.run(gen, run.pending()):
 
     # print("Start program")
 
     # ACQUISITION
-    rp.tx_txt('ACQ:RST')  # Input reset
-
-    # Get memory region (DMM)
-    start_address = int(rp.txrx_txt('ACQ:AXI:START?'))
-    size = int(rp.txrx_txt('ACQ:AXI:SIZE?'))
+    with rp.batch():
+        rp.tx_txt('ACQ:RST')  # Input reset
+
+        # Get memory region (DMM)
+        start_address = rp.txrx_txt('ACQ:AXI:START?')
+        size = rp.txrx_txt('ACQ:AXI:SIZE?')
+    start_address = int(start_address.result())
+    size = int(size.result())
     start_address2 = round(start_address + size/2)
 
-    rp.tx_txt(f"ACQ:AXI:DEC {dec}")  # Decimation
-    # rp.tx_txt(f"ACQ:DEC {dec}")  # Decimation (1, 8, 16, 64, 1024, 8192)
+    with rp.batch():
+        rp.tx_txt(f"ACQ:AXI:DEC {dec}")  # Decimation
+        # rp.tx_txt(f"ACQ:DEC {dec}")  # Decimation (1, 8, 16, 64, 1024, 8192)
 
-    rp.tx_txt('ACQ:AXI:DATA:Units VOLTS')  # Set units
-    # rp.tx_txt('ACQ:DATA:Units VOLTS')
+        rp.tx_txt('ACQ:AXI:DATA:Units VOLTS')  # Set units
+        # rp.tx_txt('ACQ:DATA:Units VOLTS')
 
-    rp.tx_txt(f"ACQ:AXI:SOUR1:Trig:Dly {DATA_SIZE}")  # Trigger delay ch1
-    rp.tx_txt(f"ACQ:AXI:SOUR2:Trig:Dly {DATA_SIZE}")  # Trigger delay ch2
-    # rp.tx_txt(f"ACQ:TRig:DLY {DATA_SIZE}")  # Delay
+        rp.tx_txt(f"ACQ:AXI:SOUR1:Trig:Dly {DATA_SIZE}")  # Trigger delay ch1
+        rp.tx_txt(f"ACQ:AXI:SOUR2:Trig:Dly {DATA_SIZE}")  # Trigger delay ch2
+        # rp.tx_txt(f"ACQ:TRig:DLY {DATA_SIZE}")  # Delay
 
-    # Set-up channel 1 and 2 buffers to each work with half of available memory space.
-    rp.tx_txt(f"ACQ:AXI:SOUR1:SET:Buffer {start_address},{size/2}")
-    rp.tx_txt(f"ACQ:AXI:SOUR2:SET:Buffer {start_address2},{size/2}")
+        # Set-up channel 1 and 2 buffers to each work with half of available memory space.
+        rp.tx_txt(f"ACQ:AXI:SOUR1:SET:Buffer {start_address},{size/2}")
+        rp.tx_txt(f"ACQ:AXI:SOUR2:SET:Buffer {start_address2},{size/2}")
 
-    rp.tx_txt('ACQ:AXI:SOUR1:ENable ON')  # Enable DMM ch1
-    rp.tx_txt('ACQ:AXI:SOUR2:ENable ON')  # Enable DMM ch2
+        rp.tx_txt('ACQ:AXI:SOUR1:ENable ON')  # Enable DMM ch1
+        rp.tx_txt('ACQ:AXI:SOUR2:ENable ON')  # Enable DMM ch2
 
-    rp.tx_txt(f"ACQ:TRig:LEV {trig_lvl}")  # Trigger level
+        rp.tx_txt(f"ACQ:TRig:LEV {trig_lvl}")  # Trigger level
 
-    rp.tx_txt('ACQ:START')  # Start aquisition
-    # rp.tx_txt('ACQ:TRig NOW')  # Trigger manually
+        rp.tx_txt('ACQ:START')  # Start aquisition
+        # rp.tx_txt('ACQ:TRig NOW')  # Trigger manually
 
     # print("Waiting for trigger\n")
-    # This loop is not needed, if triggered manually
-    while 1:
-        rp.tx_txt('ACQ:TRig:STAT?')
-        if rp.rx_txt() == 'TD':
-            break
+    # Polled at intervals matching the capture time, raises TimeoutError after 10 s
+    t_trig = rp.wait_triggered(timeout=10)
 
-    # while 1:
-    #    rp.tx_txt('ACQ:TRig:FILL?')
-    #    if rp.rx_txt() == '1':
-    #        break
+    # t_fill = rp.wait_filled(timeout=10)
 
     # wait for fill adc buffer DMM
-    while 1:
-        rp.tx_txt('ACQ:AXI:SOUR1:TRig:FILL?')
-        if rp.rx_txt() == '1':
-            print('DMA buffer full\n')
-            break
+    t_fill = rp.wait_filled(timeout=10, axi=True)
+    print(f'DMA buffer full after {t_trig + t_fill:.3f} s\n')
 
     # Data Acquisition
 
-    # Input IN1
+    # Input IN1 and IN2 from the trigger position, both read with one round trip
     # rp.tx_txt('ACQ:SOUR1:DATA?')  # Readout buffer IN1
-    posIN1 = int(rp.txrx_txt('ACQ:AXI:SOUR1:Trig:Pos?'))
-    rp.tx_txt(f"ACQ:AXI:SOUR1:DATA:Start:N? {posIN1},{READ_DATA_SIZE}")
-    IN1str = rp.rx_txt()
-    IN1str = IN1str.strip('{}\n\r').replace("  ", "").split(',')
-    DF_IN1[str(freq)] = np.array(list(map(float, IN1str)))
-
-    # Input IN2
     # rp.tx_txt('ACQ:SOUR2:DATA?')  # Readout buffer IN2
-    posIN2 = int(rp.txrx_txt('ACQ:AXI:SOUR2:Trig:Pos?'))
-    rp.tx_txt(f"ACQ:AXI:SOUR2:DATA:Start:N? {posIN2},{READ_DATA_SIZE}")
-    IN2str = rp.rx_txt()
-    IN2str = IN2str.strip('{}\n\r').replace("  ", "").split(',')
-    DF_IN2[str(freq)] = np.array(list(map(float, IN2str)))
+    # Stored with its sample rate, the capture starts at the trigger
+    run.store(freq, fast_acq.read_multi(rp, num_samples=READ_DATA_SIZE, axi=True),
+              dec=dec, fs=scpi.ADC_RATE / dec, trig_pos=0)
+
+
+# %% Deep memory capture (128 MB) of the last point, streamed to disk in binary blocks
+# Host memory stays bounded, the file can be opened with np.load(..., mmap_mode='r')
+# IN_AXI = rp.acq_axi_save('data/IN_AXI_UB_VBS_VBP.npy', num_samples=int(size / 4), block_size=1024 * 1024)
 
+print(f"Settling: {sum(p['dwell'] for p in sched.log):.1f} s in total for {len(sched.log)} points")
 
 # Stop Acquisition
 rp.tx_txt('ACQ:STOP')
 
 # Stopp des Generators
-rp.tx_txt('OUTPUT1:STATE OFF')
+gen.output(False)
 
 # %% Data storage
 # + str(datetime.now().strftime('%Y-%m-%d_%H_%M'))
@@ -150,6 +145,9 @@ Data_IN2 = 'data/IN2_UB_VBP'
 # Data_IN = 'data/IN_UB_VBS_VBP'  #+ str(datetime.now().strftime('%Y-%m-%d_%H_%M'))
 
 # %% Store data on disk as comma-seperated-values
+# The archive data/bode_run/data.npy is about 5x smaller and is read directly
+# by bode_data_analysis.py, the CSV files are kept for other tools
+DF_IN1, DF_IN2 = run.frames()  # wide layout with one column per frequency
 DF_IN1.to_csv(Data_IN1 + '.csv', index=False)
 DF_IN2.to_csv(Data_IN2 + '.csv', index=False)
 
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Archive for captures: raw sample blocks with a JSON sidecar
+
+One archive is a block with a JSON sidecar:
+    <name>.npy    (n_captures, n_chan, n_samples) int16 (RAW) or float32 (VOLTS)
+    <name>.json   attrs (board, units, dtype, scale in V per count, ...), written once
+    <name>.jsonl  one record per written capture (index, freq, dec, fs, trig_pos,
+                  length, ...), appended line by line
+
+The .npy block is opened as memory map, so a capture is a NumPy view into the
+file: loading one frequency reads only its samples, nothing is parsed. Compared
+with a float64 CSV (about 20 bytes per sample as text) float32 is 5x and int16
+10x smaller. A record is appended after its samples are flushed, so the records
+only list captures that are on disk; a line cut off by a crash is ignored.
+
+Usage:
+    arc = capture_archive.create('data/bode', 80, attrs={'board': IP, 'units': 'VOLTS'})
+    arc.write(i, np.stack((IN1, IN2)), freq=freq, dec=64, fs=125e6 / 64, trig_pos=0)
+
+    arc = capture_archive.open_archive('data/bode')   # read only, memory mapped
+    IN1, IN2 = arc.volts(arc.find(1000))
+"""
+
+# %% Init
+import json
+import os
+import time
+from enum import Enum
+from typing import List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+
+# %% Archive
+class CaptureArchive(object):
+    '''
+    Memory mapped capture block with its sidecar, use create() or open_archive().
+
+    Args:
+        path (str): Archive name without extension.
+        data (memmap): Sample block.
+        meta (dict): Sidecar content ('attrs' and 'records').
+    '''
+
+    def __init__(self, path: str, data: np.ndarray, meta: dict):
+        self.path = path
+        self.data = data
+        self.meta = meta
+
+    @property
+    def attrs(self) -> dict:
+        return self.meta['attrs']
+
+    @property
+    def records(self) -> List[Optional[dict]]:
+        '''Metadata per capture (without the index), None for rows that have not been written.'''
+        return self.meta['records']
+
+    @property
+    def scale(self) -> float:
+        '''Volts per stored unit (1 for float32 blocks in Volts).'''
+        return self.attrs.get('scale', 1.0)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    # %% Writing
+    def _append_record(self, line: dict) -> None:
+        '''One JSON line, on disk before write() returns.'''
+        with open(self.path + '.jsonl', 'a') as f:
+            f.write(json.dumps(line) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write(self, i: int, capture: np.ndarray, **record) -> None:
+        '''
+        Store capture (n_chan, n) in row i with its metadata (freq, dec, fs, trig_pos, ...).
+        Shorter captures are padded with zeros, the length is kept in the record.
+        '''
+        capture = np.asarray(capture)
+        n = capture.shape[-1]
+        assert capture.shape[0] == self.data.shape[1] and n <= self.data.shape[2], \
+            f"Capture {capture.shape} does not fit into {self.data.shape[1:]}"
+        self.data[i, :, :n] = capture
+        self.data[i, :, n:] = 0
+        self.data.flush()           # samples on disk before the record lists them
+        self.records[i] = {key: _plain(value) for key, value in record.items()}
+        self.records[i]['length'] = int(n)
+        self._append_record(dict(index=int(i), **self.records[i]))
+
+    # %% Reading
+    def find(self, freq: float) -> int:
+        '''Index of the capture at freq.'''
+        for i, rec in enumerate(self.records):
+            if rec is not None and np.isclose(rec.get('freq', np.nan), freq, rtol=1e-9, atol=0):
+                return i
+        raise KeyError(f"No capture at {freq} Hz in {self.path}")
+
+    def raw(self, i: int) -> np.ndarray:
+        '''Stored samples of capture i (n_chan, length), a view into the file.'''
+        assert self.records[i] is not None, f"Capture {i} has not been written"
+        return self.data[i, :, :self.records[i]['length']]
+
+    def volts(self, i: int) -> np.ndarray:
+        '''Capture i in Volts (a view for float32 blocks, scaled float32 copy for int16).'''
+        raw = self.raw(i)
+        return raw if self.scale == 1.0 and raw.dtype == np.float32 else raw.astype(np.float32) * self.scale
+
+    @property
+    def freqs(self) -> np.ndarray:
+        '''Frequency of every written capture (NaN if not recorded).'''
+        return np.array([rec.get('freq', np.nan) for rec in self.records if rec is not None])
+
+    def table(self) -> pd.DataFrame:
+        '''Records of the written captures as DataFrame (one row per capture).'''
+        return pd.DataFrame([dict(index=i, **rec) for i, rec in enumerate(self.records) if rec is not None])
+
+    def frames(self) -> Tuple[pd.DataFrame, ...]:
+        '''One wide DataFrame per channel with a column str(freq) per capture (old CSV layout).'''
+        written = [(i, rec) for i, rec in enumerate(self.records) if rec is not None]
+        n = min((rec['length'] for _, rec in written), default=0)
+        return tuple(pd.DataFrame({str(_plain(rec.get('freq', i))): self.volts(i)[ch, :n] for i, rec in written})
+                     for ch in range(self.data.shape[1]))
+
+
+def _plain(value):
+    '''NumPy scalars and enums as JSON values.'''
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+# %% Create / open
+def create(
+    path: str,
+    n_captures: int,
+    n_chan: int = 2,
+    n_samples: int = 16384,
+    dtype: str = 'float32',
+    attrs: Optional[dict] = None,
+    scale: float = 1.0
+) -> CaptureArchive:
+    '''
+    New archive with a preallocated block (the file is sparse until written).
+
+    Args:
+        path (str): Archive name without extension (<path>.npy, <path>.json).
+        n_captures (int): Number of captures.
+        n_chan (int, optional): Channels per capture. Defaults to 2.
+        n_samples (int, optional): Maximum samples per channel. Defaults to 16384.
+        dtype (str, optional): 'float32' (Volts) or 'int16' (RAW). Defaults to 'float32'.
+        attrs (dict, optional): Global metadata (board, units, ...).
+        scale (float, optional): Volts per count for int16 blocks. Defaults to 1.
+    '''
+    assert np.dtype(dtype) in (np.float32, np.int16), "Samples are stored as float32 or int16"
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    data = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=dtype, shape=(n_captures, n_chan, n_samples))
+    attrs = dict(attrs or {}, dtype=np.dtype(dtype).name, scale=scale,
+                 created=time.strftime('%Y-%m-%d %H:%M:%S'))
+    # Attributes are replaced atomically, an existing archive of the same name starts empty
+    tmp = path + '.json.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(attrs, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path + '.json')
+    with open(path + '.jsonl', 'w'):
+        pass
+    return CaptureArchive(path, data, {'attrs': attrs, 'records': [None] * n_captures})
+
+
+def open_archive(path: str, mode: str = 'r') -> CaptureArchive:
+    '''Open an archive as memory map ('r' read only, 'r+' to continue writing).'''
+    with open(path + '.json') as f:
+        attrs = json.load(f)
+    data = np.load(path + '.npy', mmap_mode=mode)
+    records = [None] * data.shape[0]
+    complete = 0            # bytes of complete lines
+    if os.path.exists(path + '.jsonl'):
+        with open(path + '.jsonl', 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break           # last line cut off by a crash, its capture is not complete
+                rec = json.loads(line)
+                records[rec.pop('index')] = rec      # a rewritten row replaces the older record
+                complete += len(line)
+        if mode != 'r' and complete < os.path.getsize(path + '.jsonl'):
+            os.truncate(path + '.jsonl', complete)  # new records start on a line of their own
+    return CaptureArchive(path, data, {'attrs': attrs, 'records': records})
+
+
+def from_frames(path: str, frames, attrs: Optional[dict] = None, **record) -> CaptureArchive:
+    '''
+    Convert wide DataFrames (one per channel, column str(freq) per capture, e.g. from the
+    old CSV files) into an archive. Extra keyword arguments are stored in every record.
+    '''
+    cols = list(frames[0].columns)
+    arc = create(path, len(cols), len(frames), len(frames[0]), 'float32', attrs)
+    for i, col in enumerate(cols):
+        arc.write(i, np.stack([df[col].to_numpy(np.float32) for df in frames]), freq=float(col), **record)
+    return arc
+
+
+# %% Example: convert the CSV files of bode_data_meas.py
+if __name__ == '__main__':
+    DF_IN1 = pd.read_csv('data/IN1_UB_VBS.csv')
+    DF_IN2 = pd.read_csv('data/IN2_UB_VBP.csv')
+    arc = from_frames('data/bode_csv', (DF_IN1, DF_IN2), attrs={'units': 'VOLTS'}, dec=64, fs=125e6 / 64, trig_pos=0)
+    size = os.path.getsize('data/bode_csv.npy')
+    print(f"{len(arc)} captures, {size / 1e6:.1f} MB instead of "
+          f"{(os.path.getsize('data/IN1_UB_VBS.csv') + os.path.getsize('data/IN2_UB_VBP.csv')) / 1e6:.1f} MB")
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bode measurement with a logarithmic sweep (chirp) of the generator
+Input signal: IN1
+Output signal: IN2
+
+Instead of 80-100 fixed frequencies with 1 s settling each, the generator runs
+a repeating log sweep (gen_sweep_set, SweepMode.LOG) and one deep memory capture
+records a full sweep period on both inputs. The sweep period is chosen as an
+integer number of samples, so the capture is one period of a periodic signal.
+
+Exponential sweep deconvolution (Farina): IN2 is deconvolved with the measured
+sweep IN1 by regularised spectral division. Harmonic distortion of order k shows
+up in the impulse response before the linear part, delayed by
+    dt_k = T * ln(k) / ln(f2 / f1)
+so the linear response and the harmonics are separated by time windows.
+
+Usage:
+    x, y, fs, T = chirp_bode.measure(rp, 100, 10000, duration=1.0)
+    bode = chirp_bode.transfer_function(x, y, fs, 100, 10000, T)
+"""
+
+# %% Init
+import time
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+import redpitaya_scpi as scpi
+import fast_acq
+from redpitaya_scpi import ADC_RATE, Waveform, SweepMode, SweepDirection
+
+
+# %% Sweep timing
+def sweep_timing(duration: float, dec: int) -> Tuple[int, int]:
+    '''
+    Sweep period as integer number of microseconds (SOUR<n>:SWeep:TIME) that is also
+    an integer number of samples at ADC_RATE / dec.
+
+    Args:
+        duration (float): Wanted sweep period in seconds.
+        dec (int): Decimation, power of two.
+
+    Returns:
+        (time_us, num_samples)
+    '''
+    assert dec > 0 and dec & (dec - 1) == 0, "Decimation needs to be a power of two"
+    # 125 samples per microsecond at dec = 1: time_us has to be a multiple of dec
+    time_us = max(dec, dec * round(duration * 1e6 / dec))
+    return time_us, int(round(time_us * ADC_RATE / 1e6)) // dec
+
+
+def default_dec(f2: float, n_harm: int = 5) -> int:
+    '''Largest power of two decimation that keeps the n_harm-th harmonic of f2 below fs / 2.'''
+    dec = 2 ** int(np.floor(np.log2(ADC_RATE / (2.5 * n_harm * f2))))
+    return int(min(max(dec, 1), 65536))
+
+
+def harmonic_delays(f1: float, f2: float, T: float, n_harm: int) -> np.ndarray:
+    '''Time advance of the harmonic impulse responses k = 1..n_harm in seconds.'''
+    return T * np.log(np.arange(1, n_harm + 1)) / np.log(f2 / f1)
+
+
+# %% Measurement
+def measure(
+    rp: scpi.scpi,
+    f1: float,
+    f2: float,
+    duration: float = 1.0,
+    ampl: float = 0.5,
+    offset: float = 0.0,
+    dec: int = None,
+    settle: float = 0.5
+) -> Tuple[np.ndarray, np.ndarray, float, float]:
+    '''
+    Run a repeating log sweep on OUT1 and capture one period of IN1 and IN2.
+
+    Args:
+        rp (scpi): Connected board.
+        f1 (float): Start frequency in Hz.
+        f2 (float): Stop frequency in Hz.
+        duration (float, optional): Sweep period in seconds (rounded, see sweep_timing). Defaults to 1.0.
+        ampl (float, optional): Amplitude in Volts. Defaults to 0.5.
+        offset (float, optional): Offset in Volts. Defaults to 0.0.
+        dec (int, optional): Decimation. Defaults to default_dec(f2).
+        settle (float, optional): Settling time after the first sweep period in seconds. Defaults to 0.5.
+
+    Returns:
+        x (IN1), y (IN2), sampling rate fs in Hz, sweep period T in seconds.
+    '''
+    dec = default_dec(f2) if dec is None else dec
+    time_us, n = sweep_timing(duration, dec)
+    T = time_us * 1e-6
+
+    rp.tx_txt('GEN:RST')
+    rp.gen_set(1, func=Waveform.SINE, volt=ampl, freq=f1, offset=offset)
+    rp.gen_sweep_set(1, start_freq=f1, stop_freq=f2, time_us=time_us, mode=SweepMode.LOG, direction=SweepDirection.NORMAL)
+    with rp.batch():
+        rp.tx_txt('OUTPUT1:STATE ON')
+        rp.tx_txt('SOUR1:TRig:INT')
+
+    # One full period, so the DUT runs in periodic steady state
+    with rp.timed('settle'):
+        time.sleep(T + settle)
+
+    x, y = fast_acq.capture_axi(rp, n, dec=dec)
+
+    rp.gen_sweep_disable(1)
+    rp.tx_txt('OUTPUT1:STATE OFF')
+    return x.astype(float), y.astype(float), ADC_RATE / dec, T
+
+
+# %% Deconvolution
+def deconvolve(x: np.ndarray, y: np.ndarray, fs: float, f1: float, f2: float, eps: float = 1e-6) -> np.ndarray:
+    '''
+    Periodic impulse response of y with respect to the sweep x (one period each).
+
+    Regularised division Y X* / (|X|^2 + r) with r = eps * max|X|^2 inside [f1, f2]
+    and a large r outside, where the sweep has no energy.
+
+    Returns:
+        Impulse response, length len(x). Negative times are at the end.
+    '''
+    n = len(x)
+    X = np.fft.rfft(x - np.mean(x))
+    Y = np.fft.rfft(y - np.mean(y))
+    f = np.fft.rfftfreq(n, 1 / fs)
+    power = np.abs(X)**2
+    reg = np.where((f >= f1) & (f <= f2), eps, 1e3) * power.max()
+    return np.fft.irfft(Y * np.conj(X) / (power + reg), n)
+
+
+def separate(h: np.ndarray, fs: float, f1: float, f2: float, T: float, n_harm: int = 5) -> List[np.ndarray]:
+    '''
+    Cut the periodic impulse response into the linear part (k = 1) and the harmonic
+    impulse responses k = 2..n_harm, each moved back to t = 0.
+
+    Every window starts slightly before its impulse and ends before the next one,
+    with half-Hann tapers at both ends.
+
+    Returns:
+        List of n_harm arrays of length len(h).
+    '''
+    n = len(h)
+    delays = harmonic_delays(f1, f2, T, n_harm + 1) * fs       # one more for the end of the last window
+    pre = max(int(0.1 * (delays[-1] - delays[-2])), 1)
+
+    parts = []
+    for k in range(1, n_harm + 1):
+        start = int(round(-delays[k - 1])) - pre
+        stop = int(round(-delays[k - 2])) - pre if k > 1 else n - int(round(delays[n_harm - 1])) - pre
+        length = stop - start
+        window = np.ones(length)
+        taper = min(pre, length // 4)
+        if taper:
+            ramp = np.hanning(2 * taper)
+            window[:taper] = ramp[:taper]
+            window[-taper:] = ramp[taper:]
+        idx = np.arange(start, stop) % n
+        part = np.zeros(n)
+        part[idx] = h[idx] * window
+        parts.append(np.roll(part, int(round(delays[k - 1]))))
+    return parts
+
+
+def transfer_function(
+    x: np.ndarray,
+    y: np.ndarray,
+    fs: float,
+    f1: float,
+    f2: float,
+    T: float,
+    n_harm: int = 5,
+    n_points: int = 200,
+    eps: float = 1e-6
+) -> pd.DataFrame:
+    '''
+    Transfer function and harmonic distortion from one sweep period.
+
+    Args:
+        x (ndarray): IN1, one sweep period.
+        y (ndarray): IN2, one sweep period.
+        fs (float): Sampling rate in Hz.
+        f1 (float): Sweep start frequency in Hz.
+        f2 (float): Sweep stop frequency in Hz.
+        T (float): Sweep period in seconds.
+        n_harm (int, optional): Highest harmonic order separated. Defaults to 5.
+        n_points (int, optional): Number of log spaced frequency bins. Defaults to 200.
+        eps (float, optional): Regularisation of the deconvolution. Defaults to 1e-6.
+
+    Returns:
+        DataFrame with freq, H (complex), mag_dB, phase_deg and HD2..HD<n_harm> in dB
+        relative to the fundamental at the output (NaN where k * freq > f2).
+        Near f1 the band edge rings into the harmonic windows: H is accurate from about
+        3 * f1 on, so start the sweep below the band of interest.
+    '''
+    h = deconvolve(x, y, fs, f1, f2, eps)
+    spectra = [np.fft.rfft(part) for part in separate(h, fs, f1, f2, T, n_harm)]
+    f = np.fft.rfftfreq(len(h), 1 / fs)
+
+    # Average the FFT bins within log spaced bins (bins without FFT line are interpolated)
+    edges = np.geomspace(f1, f2, n_points + 1)
+    centers = np.sqrt(edges[:-1] * edges[1:])
+
+    def binned(H: np.ndarray, freqs: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+        i0, i1 = np.searchsorted(f, lo), np.searchsorted(f, hi)
+        cum = np.concatenate(([0], np.cumsum(H)))
+        count = i1 - i0
+        mean = (cum[i1] - cum[i0]) / np.maximum(count, 1)
+        interp = np.interp(freqs, f, H.real) + 1j * np.interp(freqs, f, H.imag)
+        return np.where(count > 0, mean, interp)
+
+    H1 = binned(spectra[0], centers, edges[:-1], edges[1:])
+    bode = pd.DataFrame({'freq': centers, 'H': H1, 'mag_dB': 20 * np.log10(np.abs(H1)),
+                         'phase_deg': np.degrees(np.angle(H1))})
+    for k in range(2, n_harm + 1):
+        # The k-th harmonic of an excitation at f appears at k * f
+        Hk = np.abs(binned(spectra[k - 1], k * centers, k * edges[:-1], k * edges[1:]))
+        hd = 20 * np.log10(np.maximum(Hk, 1e-300) / np.abs(H1))
+        bode[f'HD{k}'] = np.where(k * edges[1:] <= f2, hd, np.nan)
+    return bode
+
+
+# %% Example: Bode plot in seconds
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+    from labdesk import LABDESK
+
+    rp = scpi.scpi(LABDESK["ELIE4"])
+
+    f1, f2 = 100, 10000
+    t0 = time.perf_counter()
+    x, y, fs, T = measure(rp, f1, f2, duration=1.0, ampl=0.5)
+    bode = transfer_function(x, y, fs, f1, f2, T)
+    print(f'Bode plot with {len(bode)} points in {time.perf_counter() - t0:.1f} s')
+    bode.drop(columns='H').to_csv('data/bode_chirp.csv', index=False)
+
+    fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True)
+    ax1.semilogx(bode['freq'], bode['mag_dB'], label='|H|')
+    for k in range(2, 4):
+        ax1.semilogx(bode['freq'], bode['mag_dB'] + bode[f'HD{k}'], '--', label=f'HD{k}')
+    ax1.set_ylabel('dB')
+    ax1.legend()
+    ax2.semilogx(bode['freq'], bode['phase_deg'])
+    ax2.set_ylabel('Phase / deg')
+    ax2.set_xlabel('f / Hz')
+    plt.show()
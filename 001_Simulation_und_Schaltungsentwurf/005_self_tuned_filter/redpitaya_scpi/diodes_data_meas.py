@@ -13,6 +13,7 @@ import numpy as np
 import pandas as pd
 # import matplotlib.pyplot as plt
 import redpitaya_scpi as scpi
+import fast_acq
 
 LABDESK = {
     "ELIE1": "192.168.111.181",
@@ -109,45 +110,23 @@ rp.tx_txt('ACQ:START')  # Start aquisition
 rp.tx_txt('ACQ:TRig NOW')  # Trigger manually
 
 # print("Waiting for trigger\n")
-while 1:
-    rp.tx_txt('ACQ:TRig:STAT?')
-    if rp.rx_txt() == 'TD':
-        break
+# Polled at intervals matching the capture time, raises TimeoutError after 10 s
+t_trig = rp.wait_triggered(timeout=10)
 
-# while 1:
-#    rp.tx_txt('ACQ:TRig:FILL?')
-#    if rp.rx_txt() == '1':
-#        break
+# t_fill = rp.wait_filled(timeout=10)
 
 # wait for fill adc buffer DMM
-while 1:
-    rp.tx_txt('ACQ:AXI:SOUR1:TRig:FILL?')
-    if rp.rx_txt() == '1':
-        print('DMA buffer full\n')
-        break
+t_fill = rp.wait_filled(timeout=10, axi=True)
+print(f'DMA buffer full after {t_trig + t_fill:.3f} s\n')
 
 # Data Acquisition
 for meas in range(0, 1):
 
-    # Input IN1
+    # Input IN1 and IN2 from the trigger position, both read with one round trip
     # time.sleep(0.1)  # in seconds
     # rp.tx_txt('ACQ:SOUR1:DATA?')  # Readout buffer IN1
-    posIN1 = int(rp.txrx_txt('ACQ:AXI:SOUR1:Trig:Pos?'))
-    rp.tx_txt(f"ACQ:AXI:SOUR1:DATA:Start:N? {posIN1},{READ_DATA_SIZE}")
-    IN1str = rp.rx_txt()
-    IN1str = IN1str.strip('{}\n\r').replace("  ", "").split(',')
-    DF_IN1[str(meas)] = np.array(list(map(float, IN1str)))
-
-    # Get write pointer at trigger location
-
-    # Input IN2
-    # time.sleep(0.1)  # in seconds
     # rp.tx_txt('ACQ:SOUR2:DATA?')  # Readout buffer IN2
-    posIN2 = int(rp.txrx_txt('ACQ:AXI:SOUR2:Trig:Pos?'))
-    rp.tx_txt(f"ACQ:AXI:SOUR2:DATA:Start:N? {posIN2},{READ_DATA_SIZE}")
-    IN2str = rp.rx_txt()
-    IN2str = IN2str.strip('{}\n\r').replace("  ", "").split(',')
-    DF_IN2[str(meas)] = np.array(list(map(float, IN2str)))
+    DF_IN1[str(meas)], DF_IN2[str(meas)] = fast_acq.read_multi(rp, num_samples=READ_DATA_SIZE, axi=True)
 
 
 # Stop Acquisition
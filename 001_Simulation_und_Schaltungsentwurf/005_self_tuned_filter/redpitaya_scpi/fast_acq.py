@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Binary capture readout shared by the measurement scripts
+
+The board is switched to ACQ:DATA:FORMAT BIN, so a capture of 16384 samples
+is transferred as a 64 kB float32 block instead of ~200 kB of text and is
+converted with np.frombuffer instead of split() and map(float).
+
+Usage:
+    import fast_acq
+    IN1 = fast_acq.read_buffer(rp, 1)                 # standard buffer
+    IN1 = fast_acq.read_axi(rp, 1, READ_DATA_SIZE)    # deep memory, from the trigger position
+    IN1, IN2 = fast_acq.read_multi(rp)                # both inputs in one round trip
+    IN1, IN2 = fast_acq.capture_axi(rp, 2**20, dec=64) # complete deep memory capture
+"""
+
+# %% Init
+import numpy as np
+from redpitaya_scpi import scpi, Units, ADC_RATE
+
+
+# %% Readout
+def set_binary(rp: scpi) -> None:
+    '''Switch the data transfer to binary. ACQ:RST sets ASCII again, read_buffer()
+    and read_axi() call this before every capture.'''
+    if rp.data_format != 'BIN':
+        rp.tx_txt('ACQ:DATA:FORMAT BIN')
+
+
+def read_buffer(rp: scpi, chan: int, **kwargs) -> np.ndarray:
+    '''
+    Read a capture from the standard buffer as binary block.
+
+    Args:
+        rp (scpi): Connected board.
+        chan (int): Input channel (1 or 2).
+        **kwargs: Buffer selection of scpi.acq_data (start, end, num_samples, ...).
+
+    Returns:
+        float32 array in Volts (int16 for ACQ:DATA:Units RAW).
+    '''
+    set_binary(rp)
+    return _native(rp.acq_data(chan, **kwargs))
+
+
+def read_axi(
+    rp: scpi,
+    chan: int,
+    num_samples: int,
+    start: int = None,
+    units: Units = Units.VOLTS
+) -> np.ndarray:
+    '''
+    Read a capture from the deep memory (DMA) buffer as binary block.
+
+    Args:
+        rp (scpi): Connected board.
+        chan (int): Input channel (1 or 2).
+        num_samples (int): Number of samples.
+        start (int, optional): First sample. Defaults to the trigger position
+            (ACQ:AXI:SOUR<n>:Trig:Pos?).
+        units (Units, optional): Units set with ACQ:AXI:DATA:Units. Defaults to VOLTS.
+
+    Returns:
+        float32 array in Volts (int16 for RAW).
+    '''
+    set_binary(rp)
+    if start is None:
+        start = int(rp.txrx_txt(f"ACQ:AXI:SOUR{chan}:Trig:Pos?"))
+    rp.tx_txt(f"ACQ:AXI:SOUR{chan}:DATA:Start:N? {start},{num_samples}")
+    data = rp.rx_arb()
+    with rp.timed('parse'):
+        return _native(rp._acq_data_convert(units.value, 'BIN', data))
+
+
+def read_multi(rp: scpi, chans=(1, 2), **kwargs) -> np.ndarray:
+    '''
+    Read several channels as binary blocks with one round trip (scpi.acq_data_multi).
+
+    Args:
+        rp (scpi): Connected board.
+        chans (tuple): Input channels. Defaults to (1, 2).
+        **kwargs: Buffer selection of scpi.acq_data_multi (num_samples, axi, ...).
+
+    Returns:
+        (len(chans), n_samples) float32 array in Volts (int16 for RAW).
+    '''
+    set_binary(rp)
+    return rp.acq_data_multi(chans, **kwargs)
+
+
+def capture_axi(
+    rp: scpi,
+    num_samples: int,
+    dec: int = 64,
+    trig: str = 'NOW',
+    trig_lvl: float = 0.0,
+    timeout: float = None
+) -> np.ndarray:
+    '''
+    Capture IN1 and IN2 into the deep memory (both channels get half of it)
+    and read num_samples from the trigger position on.
+
+    Args:
+        rp (scpi): Connected board.
+        num_samples (int): Samples per channel after the trigger.
+        dec (int, optional): Decimation (ACQ:AXI:DEC). Defaults to 64.
+        trig (str, optional): Trigger source (ACQ:TRig), e.g. 'NOW', 'CH1_PE', 'AWG_PE'. Defaults to 'NOW'.
+        trig_lvl (float, optional): Trigger level in Volts. Defaults to 0.0.
+        timeout (float, optional): Timeout for trigger and fill in seconds.
+            Defaults to twice the capture time plus 5 s.
+
+    Returns:
+        (2, num_samples) float32 array in Volts.
+    '''
+    with rp.batch():
+        rp.tx_txt('ACQ:RST')  # Input reset
+        start_address = rp.txrx_txt('ACQ:AXI:START?')
+        size = rp.txrx_txt('ACQ:AXI:SIZE?')
+    start_address = int(start_address.result())
+    size = int(size.result())
+    assert num_samples * 2 <= size // 2, f"{num_samples} samples do not fit into half of the deep memory ({size} bytes)"
+
+    with rp.batch():
+        rp.tx_txt(f"ACQ:AXI:DEC {dec}")
+        rp.tx_txt('ACQ:AXI:DATA:Units VOLTS')
+        for chan, address in ((1, start_address), (2, start_address + size // 2)):
+            rp.tx_txt(f"ACQ:AXI:SOUR{chan}:Trig:Dly {num_samples}")
+            rp.tx_txt(f"ACQ:AXI:SOUR{chan}:SET:Buffer {address},{size // 2}")
+            rp.tx_txt(f"ACQ:AXI:SOUR{chan}:ENable ON")
+        rp.tx_txt(f"ACQ:TRig:LEV {trig_lvl}")
+        rp.tx_txt('ACQ:START')
+        rp.tx_txt(f"ACQ:TRig {trig}")
+
+    if timeout is None:
+        timeout = 2 * num_samples * dec / ADC_RATE + 5
+    rp.wait_triggered(timeout=timeout)
+    rp.wait_filled(timeout=timeout, axi=True)
+    data = read_multi(rp, num_samples=num_samples, axi=True)
+    rp.tx_txt('ACQ:STOP')
+    return data
+
+
+def _native(buff: np.ndarray) -> np.ndarray:
+    '''Big endian block -> native byte order (float32 / int16).'''
+    return buff.astype(buff.dtype.newbyteorder('='))
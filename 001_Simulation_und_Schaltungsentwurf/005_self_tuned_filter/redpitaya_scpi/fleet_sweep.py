@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bode measurements on several lab benches in parallel
+Input signal: IN1
+Output signal: IN2
+
+Two modes:
+    - split:   one frequency list is shared by identical benches. Every bench
+               takes the next open frequency, so fast benches do more points.
+    - configs: every bench sweeps the full list with its own DUT configuration.
+
+A bench that fails is dropped, its open frequency goes back to the queue and the
+run continues on the remaining benches.
+"""
+
+# %% Init
+import asyncio
+import time
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+from redpitaya_scpi_async import AsyncScpi
+from redpitaya_scpi import Waveform
+from labdesk import LABDESK
+
+
+# %% Measurement of one frequency point
+async def measure_point(
+    rp: AsyncScpi,
+    freq: float,
+    ampl: float = 0.5,
+    offset: float = 0.0,
+    dec: int = 64,
+    trig_lvl: float = 0.0,
+    settle: float = 1.0,
+    timeout: float = 10.0
+) -> np.ndarray:
+    '''Set the generator to freq, wait for settling and return IN1/IN2 as (2, N) array.'''
+    await rp.gen_set(1, func=Waveform.SINE, volt=ampl, freq=freq, offset=offset)
+    await rp.tx_txt('OUTPUT1:STATE ON')
+    await asyncio.sleep(settle)  # other benches keep working meanwhile
+
+    await rp.tx_txt_many([
+        'ACQ:RST',
+        f'ACQ:DEC:Factor {dec}',
+        f'ACQ:TRig:LEV {trig_lvl}',
+        'ACQ:TRig:DLY 8192',
+        'ACQ:START',
+        'ACQ:TRig CH1_PE'
+    ])
+    await rp.wait_triggered(timeout=timeout)
+    await rp.wait_filled(timeout=timeout)
+
+    return np.stack([await rp.acq_data(1), await rp.acq_data(2)])
+
+
+# %% Fleet runner
+async def _split_worker(board, ip, queue, results, failed, kwargs):
+    '''Take frequencies from the shared queue until it is empty or the bench fails.'''
+    try:
+        async with AsyncScpi(ip, timeout=kwargs.get('timeout', 10.0)) as rp:
+            while not queue.empty():
+                freq = queue.get_nowait()
+                try:
+                    results[(board, freq)] = await measure_point(rp, freq, **kwargs)
+                except BaseException:
+                    queue.put_nowait(freq)  # give the point to another bench
+                    raise
+            await rp.tx_txt('OUTPUT1:STATE OFF')
+    except Exception as e:     # any failure drops only this bench
+        failed[board] = repr(e)
+        print(f'{board} ({ip}) dropped: {e!r}')
+
+
+async def _config_worker(board, ip, freqs, results, failed, kwargs):
+    '''Sweep all frequencies with this bench's own configuration.'''
+    try:
+        async with AsyncScpi(ip, timeout=kwargs.get('timeout', 10.0)) as rp:
+            for freq in freqs:
+                results[(board, freq)] = await measure_point(rp, freq, **kwargs)
+            await rp.tx_txt('OUTPUT1:STATE OFF')
+    except Exception as e:     # any failure drops only this bench
+        failed[board] = repr(e)
+        print(f'{board} ({ip}) dropped: {e!r}')
+
+
+async def run_fleet(
+    boards: Dict[str, str],
+    freqs: np.ndarray,
+    configs: Optional[Dict[str, dict]] = None,
+    **kwargs
+) -> pd.DataFrame:
+    '''
+    Run one sweep on several benches and merge the captures.
+
+    Args:
+        boards (dict): Bench name -> IP, e.g. a subset of LABDESK.
+        freqs (ndarray): Frequencies in Hz.
+        configs (dict, optional): Bench name -> keyword arguments for measure_point.
+            If given, every bench sweeps all frequencies with its own configuration.
+            Otherwise the frequencies are split across the benches.
+        **kwargs: Common keyword arguments for measure_point (ampl, dec, settle, ...).
+
+    Returns:
+        DataFrame with one column per capture and MultiIndex columns (chan, board, freq).
+        ``attrs['failed']`` lists dropped benches, ``attrs['missing']`` frequencies
+        that no bench could measure (split mode only), ``attrs['mode']`` is 'split' or 'configs'.
+    '''
+    results: Dict[tuple, np.ndarray] = {}
+    failed: Dict[str, str] = {}
+
+    if configs is None:
+        queue: asyncio.Queue = asyncio.Queue()
+        for freq in freqs:
+            queue.put_nowait(freq)
+        # Points given back by a failing bench after the others finished need another round
+        while not queue.empty() and len(failed) < len(boards):
+            await asyncio.gather(*(_split_worker(board, ip, queue, results, failed, kwargs)
+                                   for board, ip in boards.items() if board not in failed))
+        missing: List[float] = []
+        while not queue.empty():
+            missing.append(queue.get_nowait())
+    else:
+        await asyncio.gather(*(_config_worker(board, ip, freqs, results, failed, {**kwargs, **configs.get(board, {})})
+                               for board, ip in boards.items()))
+        missing = []
+
+    # Build the dataset once instead of growing it column by column
+    keys = sorted(results, key=lambda k: (k[1], k[0]))
+    columns = pd.MultiIndex.from_tuples(
+        [(f'IN{ch + 1}', board, str(freq)) for ch in range(2) for board, freq in keys],
+        names=['chan', 'board', 'freq'])
+    data = np.column_stack([results[key][ch] for ch in range(2) for key in keys]) if keys else None
+    DF = pd.DataFrame(data, columns=columns)
+    DF.attrs['failed'] = failed
+    DF.attrs['missing'] = sorted(missing)
+    DF.attrs['mode'] = 'split' if configs is None else 'configs'
+
+    return DF
+
+
+def bode_layout(DF: pd.DataFrame, chan: str) -> pd.DataFrame:
+    '''
+    Captures of one channel ('IN1' or 'IN2') with columns str(freq) as in bode_data_meas.py.
+    In split mode every frequency comes from one bench and the board level is dropped.
+    In configs mode every bench measures every frequency, the columns stay (board, freq).
+    '''
+    if DF.attrs.get('mode') == 'split':
+        return DF[chan].droplevel('board', axis=1)
+    return DF[chan]
+
+
+# %% Example: split one sweep over six benches
+if __name__ == '__main__':
+    freqs = np.arange(800, 1200, 5)
+
+    t0 = time.perf_counter()
+    DF = asyncio.run(run_fleet(LABDESK, freqs, ampl=0.5, dec=64, trig_lvl=0.0))
+    print(f'{DF.shape[1] // 2} points in {time.perf_counter() - t0:.1f} s, failed: {DF.attrs["failed"]}')
+
+    # Same layout as bode_data_meas.py (columns str(freq))
+    DF_IN1 = bode_layout(DF, 'IN1')
+    DF_IN2 = bode_layout(DF, 'IN2')
+    DF_IN1.to_csv('data/IN1_UB_VBS.csv', index=False)
+    DF_IN2.to_csv('data/IN2_UB_VBP.csv', index=False)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Generator channel with shadow state: only changed settings are sent
+
+The sweep scripts used to send GEN:RST, PHAS:ALIGN and the full generator
+setup for every frequency point, which restarts the DUT's transient each
+time. ShadowGenerator remembers the last value sent per command and only
+sends what changed. While the output is on, a new frequency is set with
+SOUR<n>:FREQ:FIX:Direct, so the signal continues without a phase jump.
+The answers of settings() come from the shadow state, only unknown values
+are queried (once, in one round trip).
+
+All commands for the channel have to go through the ShadowGenerator, or the
+shadow state is out of date (call invalidate() after raw tx_txt commands).
+
+Usage:
+    import gen_shadow
+    gen = gen_shadow.ShadowGenerator(rp, 1)
+    gen.reset()                                  # GEN:RST + PHAS:ALIGN, once
+    gen.set(func=Waveform.SINE, volt=0.5, offset=0.0, phase=0.0)
+    for freq in freqs:
+        gen.set(freq=freq)                       # one command per step
+        gen.output(True)                         # sent only the first time
+"""
+
+# %% Init
+from typing import Dict, List, Optional
+import numpy as np
+from redpitaya_scpi import scpi, Waveform, TriggerSource, Load
+
+# gen_set() argument -> command header (without SOUR<n>:)
+_HEADERS = {
+    'func': 'FUNC',
+    'volt': 'VOLT',
+    'freq': 'FREQ:FIX',
+    'offset': 'VOLT:OFFS',
+    'phase': 'PHAS',
+    'dcyc': 'DCYC',
+    'data': 'TRAC:DATA:DATA',
+    'trig_sour': 'TRIG:SOUR',
+}
+
+
+# %% Generator
+class ShadowGenerator(object):
+    '''
+    One generator channel that sends only changed settings.
+
+    Args:
+        rp (scpi): Connected board.
+        chan (int, optional): Output channel (1 or 2). Defaults to 1.
+        siglab (bool, optional): `True` if operating with SIGNALlab 250-12. Defaults to `False`.
+    '''
+
+    def __init__(self, rp: scpi, chan: int = 1, siglab: bool = False):
+        assert chan in (1, 2), "Channel needs to be either 1 or 2"
+        self.rp = rp
+        self.chan = chan
+        self.siglab = siglab
+        self._sent: Dict[str, str] = {}       # header -> last command sent
+        self._answers: Dict[str, str] = {}    # header -> answer of a settings() query
+        self.sent_count = 0                   # commands sent (for comparison with the full setup)
+
+    # %% Shadow state
+    def _header(self, cmd: str) -> str:
+        return cmd.split(' ', 1)[0].upper()
+
+    def _value(self, header: str) -> Optional[str]:
+        '''Last known value for a header, from a sent command or a query answer.'''
+        if header in self._sent:
+            return self._sent[header].split(' ', 1)[1]
+        return self._answers.get(header)
+
+    @staticmethod
+    def _same(old: Optional[str], new: str) -> bool:
+        if old is None:
+            return False
+        try:
+            return float(old) == float(new)
+        except ValueError:
+            return old.upper() == new.upper()
+
+    def invalidate(self) -> None:
+        '''Forget the shadow state, the next set() sends every given setting again.'''
+        self._sent.clear()
+        self._answers.clear()
+
+    def reset(self) -> None:
+        '''Reset and synchronise both generators (GEN:RST, PHAS:ALIGN). Only needed once before a sweep.'''
+        with self.rp.batch():
+            self.rp.tx_txt('GEN:RST')
+            self.rp.tx_txt('PHAS:ALIGN')
+            self.rp.check_error()
+        self.invalidate()
+        self._sent[f"OUTPUT{self.chan}:STATE"] = f"OUTPUT{self.chan}:STATE OFF"
+        self.sent_count += 2
+
+    # %% Settings
+    def set(
+        self,
+        func: Optional[Waveform] = None,
+        volt: Optional[float] = None,
+        freq: Optional[float] = None,
+        offset: Optional[float] = None,
+        phase: Optional[float] = None,
+        dcyc: Optional[float] = None,
+        data: Optional[np.ndarray] = None,
+        trig_sour: Optional[TriggerSource] = None,
+        ext_trig_deb_us: Optional[int] = None,
+        ext_trig_lev: Optional[float] = None,
+        load: Optional[Load] = None
+    ) -> List[str]:
+        '''
+        Change generator settings, arguments as in scpi.gen_set. Arguments left at None
+        keep their current value. Settings equal to the shadow state are not sent.
+
+        Returns:
+            The commands that were sent.
+        '''
+        given = {'func': func, 'volt': volt, 'freq': freq, 'offset': offset, 'phase': phase, 'dcyc': dcyc,
+                 'data': data, 'trig_sour': trig_sour}
+        wanted = {f"SOUR{self.chan}:{_HEADERS[k]}" for k, v in given.items() if v is not None}
+        if ext_trig_deb_us is not None:
+            wanted.add('SOUR:TRIG:EXT:DEBOUNCER:US')
+        if ext_trig_lev is not None:
+            wanted.add('TRIG:EXT:LEV')
+        if load is not None:
+            wanted.add(f"SOUR{self.chan}:LOAD")
+
+        # Unchanged settings are taken from the shadow state for the validation
+        known_func = self._value(f"SOUR{self.chan}:FUNC")
+        func = func if func is not None else Waveform(known_func.upper()) if known_func else Waveform.SINE
+        volt = volt if volt is not None else float(self._value(f"SOUR{self.chan}:VOLT") or 1)
+        freq = freq if freq is not None else float(self._value(f"SOUR{self.chan}:FREQ:FIX") or 1000)
+
+        args = (self.chan, func, volt, freq, offset, phase, dcyc, data, trig_sour, ext_trig_deb_us, ext_trig_lev, load)
+        self.rp._validate_gen_set_params(*args, False, self.siglab)
+
+        cmds = []
+        for cmd in self.rp._gen_set_cmds(*args, self.siglab):
+            header = self._header(cmd)
+            if header not in wanted:
+                continue
+            if header.endswith(':TRAC:DATA:DATA'):
+                if self._sent.get(header) == cmd:
+                    continue
+            elif self._same(self._value(header), cmd.split(' ', 1)[1]):
+                continue
+            cmds.append(cmd)
+
+        sent = []
+        if cmds:
+            with self.rp.batch():
+                for cmd in cmds:
+                    header = self._header(cmd)
+                    self._sent[header] = cmd
+                    self._answers.pop(header, None)
+                    if header.endswith(':FREQ:FIX') and self.output_on:
+                        # Running output: change the frequency without restarting the waveform
+                        cmd = f"SOUR{self.chan}:FREQ:FIX:Direct {cmd.split(' ', 1)[1]}"
+                    self.rp.tx_txt(cmd)
+                    sent.append(cmd)
+                self.rp.check_error()
+            self.sent_count += len(sent)
+
+        return sent
+
+    @property
+    def output_on(self) -> bool:
+        return (self._value(f"OUTPUT{self.chan}:STATE") or '').upper() == 'ON'
+
+    def output(self, on: bool = True) -> None:
+        '''Switch the output, nothing is sent if it already is in that state.
+        Switching on also triggers the generator (SOUR<n>:TRig:INT).'''
+        if on == self.output_on and self._value(f"OUTPUT{self.chan}:STATE") is not None:
+            return
+        state = 'ON' if on else 'OFF'
+        with self.rp.batch():
+            self.rp.tx_txt(f"OUTPUT{self.chan}:STATE {state}")
+            if on:
+                self.rp.tx_txt(f"SOUR{self.chan}:TRig:INT")
+        self._sent[f"OUTPUT{self.chan}:STATE"] = f"OUTPUT{self.chan}:STATE {state}"
+        self.sent_count += 2 if on else 1
+
+    def settings(self) -> List[str]:
+        '''
+        Generator settings in the order of scpi.gen_get_settings
+        [func, volt, freq, offs, phas, dcyc, trig_sour, ext_trig_deb_us (, ext_trig_lev, load)].
+        Known values come from the shadow state, the others are queried in one round trip
+        and kept until they are changed.
+        '''
+        headers = [f"SOUR{self.chan}:{h}" for h in ('FUNC', 'VOLT', 'FREQ:FIX', 'VOLT:OFFS', 'PHAS', 'DCYC', 'TRIG:SOUR')]
+        headers.append('SOUR:TRIG:EXT:DEBOUNCER:US')
+        if self.siglab:
+            headers += ['TRIG:EXT:LEV', f"SOUR{self.chan}:LOAD"]
+
+        unknown = [h for h in headers if self._value(h) is None]
+        if unknown:
+            with self.rp.batch():
+                replies = [self.rp.txrx_txt(h + '?') for h in unknown]
+                self.rp.check_error()
+            for header, reply in zip(unknown, replies):
+                self._answers[header] = reply.result()
+
+        return [self._value(h) for h in headers]
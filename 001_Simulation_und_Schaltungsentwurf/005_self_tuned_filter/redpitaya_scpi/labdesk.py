@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IP addresses of the Red Pitaya boards at the lab desks
+
+Usage:
+    from labdesk import LABDESK
+    rp = scpi.scpi(LABDESK["ELIE4"])
+"""
+
+# %% Connection params
+LABDESK = {
+    "ELIE1": "192.168.111.181",
+    "ELIE2": "192.168.111.182",
+    "ELIE3": "192.168.111.183",
+    "ELIE4": "192.168.111.184",
+    "ELIE5": "192.168.111.185",
+    "ELIE6": "192.168.111.186"
+}
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+System identification with a maximum length sequence (MLS)
+Input signal: IN1
+Output signal: IN2
+
+An m-sequence of order 14 (16383 chips, the full arbitrary waveform buffer) is
+uploaded with gen_set(func=Waveform.ARBITRARY) and played with one chip per
+capture sample (f_rep = fs / L). The captured periods are averaged and the
+periodic impulse responses of IN1 and IN2 are obtained by circular correlation
+with the sequence. The correlation is computed with the fast Hadamard transform
+after reordering the samples by LFSR state (Cohn-Lempel), O(N log N) and
+without any window. The Bode plot is rfft(h_IN2) / rfft(h_IN1).
+
+Usage:
+    seq = mls.Mls(order=14, f_max=5000)
+    x, y = mls.measure(rp, seq, ampl=0.5, periods=4)
+    h = mls.impulse_response(seq, x, y)          # (2, periods, L)
+    bode = mls.bode(seq, h, 100, 5000)
+"""
+
+# %% Init
+import time
+from typing import Tuple
+import numpy as np
+import pandas as pd
+import redpitaya_scpi as scpi
+import fast_acq
+from redpitaya_scpi import ADC_RATE, BUFFER_SIZE, Waveform
+
+# Exponents of primitive polynomials x^m + ... + 1 (without x^m), recurrence a[n+m] = XOR a[n+i].
+# Order 14 is the longest sequence that fits into the arbitrary waveform buffer.
+PRIMITIVE = {
+    2: (1, 0), 3: (1, 0), 4: (1, 0), 5: (2, 0), 6: (1, 0), 7: (1, 0),
+    8: (4, 3, 2, 0), 9: (4, 0), 10: (3, 0), 11: (2, 0), 12: (6, 4, 1, 0),
+    13: (4, 3, 1, 0), 14: (10, 6, 1, 0)
+}
+
+
+# %% Sequence
+def _fwht(a: np.ndarray) -> np.ndarray:
+    '''Fast Walsh-Hadamard transform (natural order) along the last axis, length 2^m.'''
+    shape = a.shape
+    n = shape[-1]
+    h = 1
+    while h < n:
+        a = a.reshape(shape[:-1] + (-1, 2, h))
+        a = np.stack((a[..., 0, :] + a[..., 1, :], a[..., 0, :] - a[..., 1, :]), axis=-2)
+        h *= 2
+    return a.reshape(shape)
+
+
+class Mls(object):
+    '''
+    m-sequence with the index maps for the fast correlation.
+
+    Args:
+        order (int, optional): Order m, length L = 2^m - 1. Defaults to 14 (16383).
+        f_max (float, optional): Highest frequency of interest in Hz, sets the decimation
+            so that fs >= 4 * f_max. Defaults to 5000.
+        dec (int, optional): Decimation of the capture, overrides f_max.
+    '''
+
+    def __init__(self, order: int = 14, f_max: float = 5000.0, dec: int = None):
+        assert order in PRIMITIVE, f"Order needs to be in {min(PRIMITIVE)}..{max(PRIMITIVE)}"
+        L = 2**order - 1
+        assert L <= BUFFER_SIZE, f"Sequence is longer than the arbitrary waveform buffer ({BUFFER_SIZE})"
+        if dec is None:
+            dec = int(min(max(2 ** int(np.floor(np.log2(ADC_RATE / (4 * f_max)))), 1), 65536))
+        self.order = order
+        self.length = L
+        self.dec = dec
+        self.fs = ADC_RATE / dec
+        self.f_rep = self.fs / L            # one chip per capture sample
+
+        # Bits a[n] and the vectors v_j with a[n + j] = <v_j, x_n>, where x_n = (a[n], ..., a[n + m - 1])
+        taps = PRIMITIVE[order]
+        bits = np.zeros(L + order, dtype=np.int64)
+        bits[0] = 1
+        vec = np.zeros(L + order, dtype=np.int64)
+        vec[:order] = 1 << np.arange(order)
+        for n in range(order, L + order):
+            for t in taps:
+                bits[n] ^= bits[n - order + t]
+                vec[n] ^= vec[n - order + t]
+        self.bits = bits[:L]
+        self.seq = 1.0 - 2.0 * self.bits                           # +-1, sum = -1
+
+        # LFSR state of every sample, and the functional that gives a[n - k] from it
+        self._state = np.zeros(L, dtype=np.int64)
+        for j in range(order):
+            self._state |= bits[j:j + L] << j
+        self._wk = vec[(L - np.arange(L)) % L]
+        assert len(np.unique(self._state)) == L, "Polynomial is not primitive"
+
+    def correlate(self, y: np.ndarray) -> np.ndarray:
+        '''Circular cross-correlation r[k] = sum_n y[n] seq[n - k] along the last axis (length L).'''
+        Y = np.zeros(y.shape[:-1] + (self.length + 1,))
+        Y[..., self._state] = y
+        return _fwht(Y)[..., self._wk]
+
+
+# %% Measurement
+def measure(
+    rp: scpi.scpi,
+    seq: Mls,
+    ampl: float = 0.5,
+    offset: float = 0.0,
+    periods: int = 4,
+    settle: float = 0.5
+) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Play the MLS on OUT1 and capture `periods` periods of IN1 and IN2.
+
+    Args:
+        rp (scpi): Connected board.
+        seq (Mls): Sequence.
+        ampl (float, optional): Amplitude in Volts. Defaults to 0.5.
+        offset (float, optional): Offset in Volts. Defaults to 0.0.
+        periods (int, optional): Periods captured and averaged. Defaults to 4.
+        settle (float, optional): Settling time in seconds, one period is added. Defaults to 0.5.
+
+    Returns:
+        IN1 and IN2 as (periods, L) arrays.
+    '''
+    rp.tx_txt('GEN:RST')
+    rp.gen_set(1, func=Waveform.ARBITRARY, volt=ampl, freq=seq.f_rep, offset=offset, data=seq.seq)
+    with rp.batch():
+        rp.tx_txt('OUTPUT1:STATE ON')
+        rp.tx_txt('SOUR1:TRig:INT')
+
+    with rp.timed('settle'):
+        time.sleep(settle + 1 / seq.f_rep)
+
+    x, y = fast_acq.capture_axi(rp, periods * seq.length, dec=seq.dec)
+    rp.tx_txt('OUTPUT1:STATE OFF')
+    return x.reshape(periods, seq.length), y.reshape(periods, seq.length)
+
+
+# %% Estimation
+def impulse_response(seq: Mls, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    '''
+    Periodic impulse responses of IN1 and IN2 for every captured period.
+
+    With the MLS autocorrelation (L at 0, -1 elsewhere) the correlation gives
+    r[k] = (L + 1) h[k] - sum(h) and sum(y) = -sum(h), so h = (r - sum(y)) / (L + 1).
+
+    Returns:
+        (2, periods, L) array, IN1 and IN2.
+    '''
+    data = np.stack([np.atleast_2d(x), np.atleast_2d(y)]).astype(float)
+    r = seq.correlate(data)
+    return (r - data.sum(axis=-1, keepdims=True)) / (seq.length + 1)
+
+
+def bode(seq: Mls, h: np.ndarray, f_min: float = 0.0, f_max: float = None) -> pd.DataFrame:
+    '''
+    Transfer function IN2 / IN1 on the FFT bins of one period (spacing f_rep).
+
+    Args:
+        seq (Mls): Sequence.
+        h (ndarray): Impulse responses from impulse_response().
+        f_min (float, optional): Lowest frequency in Hz. Defaults to 0.
+        f_max (float, optional): Highest frequency in Hz. Defaults to fs / 4.
+
+    Returns:
+        DataFrame with freq, H (complex), mag_dB, phase_deg, H_std (standard
+        deviation of H from the period to period variation) and noise_dB.
+    '''
+    f_max = seq.fs / 4 if f_max is None else f_max
+    spec = np.fft.rfft(h, axis=-1)                      # (2, periods, bins)
+    f = np.fft.rfftfreq(seq.length, 1 / seq.fs)
+    band = (f >= f_min) & (f <= f_max) & (f > 0)
+
+    periods = spec.shape[1]
+    X, Y = spec.mean(axis=1)[:, band]
+    H = Y / X
+    if periods > 1:
+        var = spec.var(axis=1, ddof=1)[:, band] / periods
+        H_std = np.abs(H) * np.sqrt(var[1] / np.abs(Y)**2 + var[0] / np.abs(X)**2)
+    else:
+        H_std = np.full(len(H), np.nan)
+
+    return pd.DataFrame({
+        'freq': f[band],
+        'H': H,
+        'mag_dB': 20 * np.log10(np.abs(H)),
+        'phase_deg': np.degrees(np.angle(H)),
+        'H_std': H_std,
+        'noise_dB': 20 * np.log10(H_std / np.abs(H)),
+    })
+
+
+# %% Example: state-variable filter
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+    from labdesk import LABDESK
+
+    rp = scpi.scpi(LABDESK["ELIE4"])
+
+    seq = Mls(order=14, f_max=5000)
+    print(f'L = {seq.length}, fs = {seq.fs:.0f} Hz, resolution {seq.f_rep:.2f} Hz')
+    t0 = time.perf_counter()
+    x, y = measure(rp, seq, ampl=0.5, periods=4)
+    h = impulse_response(seq, x, y)
+    result = bode(seq, h, 100, 5000)
+    print(f'Measured in {time.perf_counter() - t0:.1f} s')
+    result.drop(columns='H').to_csv('data/bode_mls.csv', index=False)
+
+    fig, (ax0, ax1, ax2) = plt.subplots(3, 1)
+    t = np.arange(seq.length) / seq.fs
+    ax0.plot(t * 1e3, h[1].mean(axis=0), label='h IN2')
+    ax0.set_xlabel('t / ms')
+    ax0.legend()
+    ax1.semilogx(result['freq'], result['mag_dB'])
+    ax1.set_ylabel('dB')
+    ax2.semilogx(result['freq'], result['phase_deg'])
+    ax2.set_ylabel('Phase / deg')
+    ax2.set_xlabel('f / Hz')
+    plt.show()
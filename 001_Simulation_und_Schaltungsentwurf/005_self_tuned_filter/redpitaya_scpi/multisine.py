@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bode measurement with a multisine uploaded as arbitrary waveform
+Input signal: IN1
+Output signal: IN2
+
+All tones of a frequency band are played at once: one period of the multisine
+is uploaded with gen_set(func=Waveform.ARBITRARY, data=...) and repeated by the
+generator at f_rep. The capture holds an integer number of periods with an
+integer number of samples each, so every tone lies exactly on an FFT bin of the
+period spectrum (no leakage, no window).
+
+Tone grid (bins k of one period, spacing f_rep = df / 2):
+    - excited:   odd bins in the band, Schroeder phases for a low crest factor
+    - detection: every `detect_every`-th odd bin is left out (odd distortion)
+                 and all even bins stay empty (even distortion, only seen in the
+                 band if f_max > 2 * f_min)
+
+All periods of both channels are transformed with one batched rfft. Averaging over
+the periods gives H at every tone, its standard deviation (noise) and the level
+of the distortion products at the neighbouring detection bins.
+
+Usage:
+    ms = multisine.Multisine(700, 1300, df=5)
+    x, y = multisine.measure(rp, ms, ampl=0.5, periods=8)
+    bode = multisine.estimate(ms, x, y)
+"""
+
+# %% Init
+import time
+from typing import Tuple
+import numpy as np
+import pandas as pd
+import redpitaya_scpi as scpi
+import fast_acq
+from redpitaya_scpi import ADC_RATE, BUFFER_SIZE, Waveform
+
+
+# %% Design
+class Multisine(object):
+    '''
+    Schroeder-phase multisine with tones on exact FFT bins of the capture.
+
+    Args:
+        f_min (float): Lowest tone in Hz.
+        f_max (float): Highest tone in Hz.
+        df (float, optional): Spacing of the excited tones in Hz. Defaults to 5.
+        dec (int, optional): Decimation of the capture. Defaults to the largest power of two
+            with fs >= 10 * f_max (harmonics up to 5th order below fs / 2).
+        detect_every (int, optional): Every n-th odd bin is not excited. 0 excites all odd bins. Defaults to 4.
+    '''
+
+    def __init__(self, f_min: float, f_max: float, df: float = 5.0, dec: int = None, detect_every: int = 4):
+        if dec is None:
+            dec = int(min(max(2 ** int(np.floor(np.log2(ADC_RATE / (10 * f_max)))), 1), 65536))
+        self.dec = dec
+        self.fs = ADC_RATE / dec
+        self.period = int(round(2 * self.fs / df))      # samples per period in the capture
+        self.f_rep = self.fs / self.period              # repetition frequency = bin spacing
+        assert f_max < self.f_rep * BUFFER_SIZE / 2, "f_max is too high for the arbitrary waveform buffer"
+
+        k = np.arange(int(np.ceil(f_min / self.f_rep)), int(np.floor(f_max / self.f_rep)) + 1)
+        odd = k[k % 2 == 1]
+        skip = np.zeros(len(odd), dtype=bool)
+        if detect_every:
+            skip[detect_every - 1::detect_every] = True
+        self.lines = odd[~skip]                          # excited bins
+        self.odd_detect = odd[skip]                      # odd bins without excitation
+        self.even_detect = k[k % 2 == 0]                 # even bins without excitation
+        assert len(self.lines) > 0, "No tone in the band, reduce df"
+
+        # Schroeder phases: phi_i = -pi * i * (i - 1) / F
+        i = np.arange(1, len(self.lines) + 1)
+        self.phases = -np.pi * i * (i - 1) / len(self.lines)
+
+    @property
+    def freqs(self) -> np.ndarray:
+        '''Frequencies of the excited tones in Hz.'''
+        return self.lines * self.f_rep
+
+    def waveform(self, n: int = BUFFER_SIZE) -> np.ndarray:
+        '''One period with n samples, peak normalised to 1 (data for SOUR<n>:TRAC:DATA:DATA).'''
+        spec = np.zeros(n // 2 + 1, dtype=complex)
+        spec[self.lines] = np.exp(1j * self.phases)
+        wave = np.fft.irfft(spec, n)
+        return wave / np.max(np.abs(wave))
+
+    @property
+    def crest_factor(self) -> float:
+        '''Peak / rms of the waveform (single sine: 1.41).'''
+        wave = self.waveform()
+        return np.max(np.abs(wave)) / np.sqrt(np.mean(wave**2))
+
+
+# %% Measurement
+def measure(
+    rp: scpi.scpi,
+    ms: Multisine,
+    ampl: float = 0.5,
+    offset: float = 0.0,
+    periods: int = 8,
+    settle: float = 0.5
+) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Upload the multisine to OUT1, wait for steady state and capture `periods` periods.
+
+    Args:
+        rp (scpi): Connected board.
+        ms (Multisine): Excitation.
+        ampl (float, optional): Peak amplitude in Volts. Defaults to 0.5.
+        offset (float, optional): Offset in Volts. Defaults to 0.0.
+        periods (int, optional): Number of periods captured (>= 2 for the noise estimate). Defaults to 8.
+        settle (float, optional): Settling time in seconds, at least one period is added. Defaults to 0.5.
+
+    Returns:
+        IN1 and IN2 as (periods, ms.period) arrays.
+    '''
+    rp.tx_txt('GEN:RST')
+    rp.gen_set(1, func=Waveform.ARBITRARY, volt=ampl, freq=ms.f_rep, offset=offset, data=ms.waveform())
+    with rp.batch():
+        rp.tx_txt('OUTPUT1:STATE ON')
+        rp.tx_txt('SOUR1:TRig:INT')
+
+    with rp.timed('settle'):
+        time.sleep(settle + 1 / ms.f_rep)
+
+    # Any window of whole periods works in steady state, no trigger needed
+    x, y = fast_acq.capture_axi(rp, periods * ms.period, dec=ms.dec)
+    rp.tx_txt('OUTPUT1:STATE OFF')
+    return x.reshape(periods, ms.period), y.reshape(periods, ms.period)
+
+
+# %% Estimation
+def estimate(ms: Multisine, x: np.ndarray, y: np.ndarray) -> pd.DataFrame:
+    '''
+    Transfer function, noise and distortion at every tone from averaged periods.
+
+    Args:
+        ms (Multisine): Excitation.
+        x (ndarray): IN1 as (periods, ms.period) array.
+        y (ndarray): IN2 as (periods, ms.period) array.
+
+    Returns:
+        DataFrame per tone with freq, H (complex), mag_dB, phase_deg,
+        H_std (standard deviation of H from the period to period variation),
+        noise_dB (H_std relative to |H|), and nl_odd_dB / nl_even_dB (output level at the
+        neighbouring odd / even detection bins relative to the tone at the output).
+    '''
+    periods = x.shape[0]
+    spec = np.fft.rfft(np.stack([x, y]), axis=-1)       # (2, periods, bins), one batched FFT
+    mean = spec.mean(axis=1)
+    X, Y = mean[0], mean[1]
+
+    H = Y[ms.lines] / X[ms.lines]
+    if periods > 1:
+        # Variance of the averaged spectra, propagated to H (uncorrelated IN1 / IN2 noise)
+        var = spec.var(axis=1, ddof=1) / periods
+        rel = var[1][ms.lines] / np.abs(Y[ms.lines])**2 + var[0][ms.lines] / np.abs(X[ms.lines])**2
+        H_std = np.abs(H) * np.sqrt(rel)
+    else:
+        H_std = np.full(len(H), np.nan)
+
+    def detect(bins: np.ndarray) -> np.ndarray:
+        '''Output level at the detection bins, interpolated at the tones, relative to the tone output.'''
+        if len(bins) == 0:
+            return np.full(len(H), np.nan)
+        level = np.interp(ms.lines, bins, np.abs(Y[bins]))
+        return 20 * np.log10(level / np.abs(Y[ms.lines]))
+
+    return pd.DataFrame({
+        'freq': ms.freqs,
+        'H': H,
+        'mag_dB': 20 * np.log10(np.abs(H)),
+        'phase_deg': np.degrees(np.angle(H)),
+        'H_std': H_std,
+        'noise_dB': 20 * np.log10(H_std / np.abs(H)),
+        'nl_odd_dB': detect(ms.odd_detect),
+        'nl_even_dB': detect(ms.even_detect),
+    })
+
+
+# %% Example: band of bode_data_meas.py in one capture
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+    from labdesk import LABDESK
+
+    rp = scpi.scpi(LABDESK["ELIE4"])
+
+    ms = Multisine(800, 1200, df=5)
+    print(f'{len(ms.lines)} tones, crest factor {ms.crest_factor:.2f}, period {1 / ms.f_rep:.3f} s')
+    t0 = time.perf_counter()
+    x, y = measure(rp, ms, ampl=0.5, periods=8)
+    bode = estimate(ms, x, y)
+    print(f'Measured in {time.perf_counter() - t0:.1f} s')
+    bode.drop(columns='H').to_csv('data/bode_multisine.csv', index=False)
+
+    fig, (ax1, ax2) = plt.subplots(2, 1, sharex=True)
+    ax1.plot(bode['freq'], bode['mag_dB'], 'o-', label='|H|')
+    ax1.plot(bode['freq'], bode['mag_dB'] + bode['noise_dB'], ':', label='noise')
+    ax1.plot(bode['freq'], bode['mag_dB'] + bode['nl_odd_dB'], '--', label='odd distortion')
+    ax1.plot(bode['freq'], bode['mag_dB'] + bode['nl_even_dB'], '--', label='even distortion')
+    ax1.set_ylabel('dB')
+    ax1.legend()
+    ax2.plot(bode['freq'], bode['phase_deg'], 'o-')
+    ax2.set_ylabel('Phase / deg')
+    ax2.set_xlabel('f / Hz')
+    plt.show()
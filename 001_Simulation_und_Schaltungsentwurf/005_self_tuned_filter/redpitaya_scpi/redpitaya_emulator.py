@@ -0,0 +1,1002 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local Red Pitaya SCPI emulator with a simulated biquad DUT
+
+Speaks the subset of the SCPI protocol used by redpitaya_scpi.scpi on a local
+TCP port, so acquisition code can be run and benchmarked without a STEMlab:
+
+    - GEN:RST, PHAS:ALIGN, SOUR<n>:* and OUTPUT<n>:STATE (continuous, burst,
+      sweep and arbitrary waveforms)
+    - ACQ:* (standard 16384 sample buffer) and ACQ:AXI:* (deep memory)
+    - *STB?, *IDN?, *OPC?, *CLS, *RST, SYST:ERR:NEXT?, SYST:ERR:COUN?
+    - ANALOG:PIN? AIN<n>
+
+OUT1 is wired to IN1 and to the DUT input, the DUT output goes to IN2. The DUT is
+a state-variable biquad (lowpass, highpass, bandpass or bandstop) with centre
+frequency f0, quality factor Q and gain H0. Gaussian noise is added on both inputs.
+The DUT runs at a multiple of the capture rate, at least OVERSAMPLE times f0 and the
+generator frequency, so its response follows the analog one at every ACQ:DEC.
+Data is returned as ASCII '{...}' or binary '#' block, depending on ACQ:DATA:FORMAT.
+
+Network latency (added to every answer) and a bandwidth limit can be injected
+to measure transport and sweep optimisations reproducibly.
+
+Usage:
+    with RedPitayaEmulator(dut=BiquadDUT(f0=1000, Q=5), latency=0.02) as emu:
+        rp = scpi.scpi(emu.address[0], port=emu.address[1])
+
+or from the command line:
+    python redpitaya_emulator.py --f0 1000 --Q 5 --latency 0.02
+"""
+
+# %% Init
+import argparse
+import re
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from typing import Optional
+import numpy as np
+import scipy.signal as sig
+
+ADC_RATE = 125e6        # STEMlab 125-14 sampling rate
+BUFFER_SIZE = 16384     # standard acquisition buffer
+AXI_START = 0x1000000   # emulated DMA memory region
+AXI_SIZE = 0x8000000    # 128 MB
+OVERSAMPLE = 256        # DUT simulation rate relative to f0 and the generator frequency
+SIM_SAMPLES = 2**24     # longest DUT simulation per render
+
+
+# %% Device under test
+class BiquadDUT(object):
+    """State-variable biquad filter used as device under test."""
+
+    def __init__(self, f0: float = 1000, Q: float = 1, H0: float = 1, ftype: str = 'BP'):
+        """ftype is one of 'LP', 'HP', 'BP', 'BS'."""
+        assert ftype in ('LP', 'HP', 'BP', 'BS'), f"{ftype} is not a defined filter type"
+        self.f0 = f0
+        self.Q = Q
+        self.H0 = H0
+        self.ftype = ftype
+        self._sos = {}
+
+    def response(self, f):
+        """Complex frequency response H(j2πf)."""
+        s = 2j * np.pi * np.asarray(f, dtype=float)
+        w0 = 2 * np.pi * self.f0
+        den = s**2 + s * w0 / self.Q + w0**2
+        num = {'LP': w0**2, 'HP': s**2, 'BP': s * w0 / self.Q, 'BS': s**2 + w0**2}[self.ftype]
+        return self.H0 * num / den
+
+    def settling_time(self) -> float:
+        """Time for the envelope to settle to ~1e-9 (20 envelope time constants Q/(π f0))."""
+        return 20 * max(self.Q, 0.5) / (np.pi * self.f0)
+
+    def oversampling(self, fs: float, f_gen: float = 0.0) -> int:
+        """Power of two k, so the DUT is simulated at k * fs >= OVERSAMPLE * max(f0, f_gen)."""
+        return int(2 ** max(np.ceil(np.log2(OVERSAMPLE * max(self.f0, f_gen) / fs)), 0))
+
+    def sos(self, fs: float) -> np.ndarray:
+        """Second-order section of the bilinear transform at sample rate fs, prewarped at f0."""
+        if fs not in self._sos:
+            w0 = 2 * fs * np.tan(np.pi * min(self.f0, 0.49 * fs) / fs)
+            p = np.roots([1, w0 / self.Q, w0**2])
+            z, k = {'LP': ([], self.H0 * w0**2),
+                    'HP': ([0, 0], self.H0),
+                    'BP': ([0], self.H0 * w0 / self.Q),
+                    'BS': ([1j * w0, -1j * w0], self.H0)}[self.ftype]
+            zd, pd, kd = sig.bilinear_zpk(np.array(z), p, k, fs)
+            self._sos[fs] = sig.zpk2sos(zd, pd, kd, pairing='minimal' if len(z) < 2 else 'nearest')
+        return self._sos[fs]
+
+
+# %% Signal generator
+class _GenState(object):
+    """Settings of one generator channel."""
+
+    def __init__(self):
+        self.func = 'SINE'
+        self.volt = 1.0
+        self.freq = 1000.0
+        self.offset = 0.0
+        self.phase = 0.0
+        self.dcyc = 0.5
+        self.trig_sour = 'INT'
+        self.data = np.zeros(1)
+        self.output = False
+        self.burst = False
+        self.ncyc = 1
+        self.nor = 1
+        self.period_us = None
+        self.init_val = 0.0
+        self.last_val = 0.0
+        self.sweep = False
+        self.sweep_start = 1000.0
+        self.sweep_stop = 10000.0
+        self.sweep_time_us = 1.0
+        self.sweep_mode = 'LINEAR'
+        self.sweep_dir = 'NORMAL'
+
+    def copy(self):
+        new = _GenState()
+        new.__dict__.update(self.__dict__)
+        return new
+
+
+class _Generator(object):
+    """One generator channel. Every change starts a new segment at the current time,
+    continuous waveforms keep their phase across frequency changes."""
+
+    def __init__(self):
+        self.state = _GenState()
+        self.segments = [(0.0, self.state.copy(), 0.0)]    # (t_start, settings, phase at start in cycles)
+
+    def update(self, t: float, reset_phase: bool = False, **changes) -> None:
+        t0, old, cyc0 = self.segments[-1]
+        cycles = 0.0 if reset_phase else (cyc0 + old.freq * (t - t0)) % 1.0
+        self.state.__dict__.update(changes)
+        self.segments.append((t, self.state.copy(), cycles))
+        # Segments older than one second before the newest one are no longer needed
+        while len(self.segments) > 2 and self.segments[1][0] < t - 1.0:
+            self.segments.pop(0)
+
+    def max_freq(self) -> float:
+        """Highest frequency of the kept segments (sweep end points included)."""
+        return max(max(st.freq, st.sweep_start, st.sweep_stop) if st.sweep else st.freq
+                   for _, st, _ in self.segments)
+
+    def render(self, t: np.ndarray) -> np.ndarray:
+        out = np.zeros_like(t)
+        starts = [seg[0] for seg in self.segments]
+        for i, (t0, st, cyc0) in enumerate(self.segments):
+            t1 = starts[i + 1] if i + 1 < len(starts) else np.inf
+            lo, hi = np.searchsorted(t, [t0, t1])
+            if hi > lo and st.output:
+                out[lo:hi] = self._waveform(st, t[lo:hi] - t0, cyc0)
+        return out
+
+    def _waveform(self, st: _GenState, tau: np.ndarray, cyc0: float) -> np.ndarray:
+        if st.func == 'DC':
+            return np.full_like(tau, st.offset + st.volt)
+        if st.func == 'DC_NEG':
+            return np.full_like(tau, st.offset - st.volt)
+
+        if st.sweep:
+            u = self._sweep_cycles(st, tau)
+        else:
+            u = cyc0 + st.freq * tau
+        u = u + st.phase / 360.0
+        wave = st.offset + st.volt * self._shape(st, u % 1.0)
+
+        if st.burst:
+            period = st.period_us * 1e-6 if st.period_us else st.ncyc / st.freq
+            n_burst = np.floor(tau / period)
+            inside = (tau - n_burst * period) < st.ncyc / st.freq
+            wave = np.where(inside & (n_burst < st.nor), st.offset + st.volt * self._shape(st, (st.freq * (tau - n_burst * period) + st.phase / 360.0) % 1.0), st.last_val)
+        return wave
+
+    @staticmethod
+    def _shape(st: _GenState, u: np.ndarray) -> np.ndarray:
+        if st.func == 'SINE':
+            return np.sin(2 * np.pi * u)
+        if st.func == 'SQUARE':
+            return np.where(u < 0.5, 1.0, -1.0)
+        if st.func == 'TRIANGLE':
+            return 1.0 - 4.0 * np.abs(u - 0.5)
+        if st.func == 'SAWU':
+            return 2.0 * u - 1.0
+        if st.func == 'SAWD':
+            return 1.0 - 2.0 * u
+        if st.func == 'PWM':
+            return np.where(u < st.dcyc, 1.0, -1.0)
+        if st.func == 'ARBITRARY':
+            return st.data[np.minimum((u * len(st.data)).astype(int), len(st.data) - 1)]
+        return np.zeros_like(u)
+
+    @staticmethod
+    def _sweep_cycles(st: _GenState, tau: np.ndarray) -> np.ndarray:
+        """Phase in cycles of a (repeating) linear or logarithmic sweep."""
+        T = st.sweep_time_us * 1e-6
+        f1, f2 = st.sweep_start, st.sweep_stop
+
+        def cycles(x):      # integral of f over [0, x] for one upward sweep
+            if st.sweep_mode == 'LOG':
+                k = np.log(f2 / f1)
+                return f1 * T / k * (np.exp(k * x / T) - 1.0)
+            return f1 * x + (f2 - f1) * x**2 / (2 * T)
+
+        if st.sweep_dir == 'UP_DOWN':
+            n, x = np.divmod(tau, 2 * T)
+            up = x < T
+            full = cycles(T)
+            return n * 2 * full + np.where(up, cycles(np.minimum(x, T)), 2 * full - cycles(np.maximum(2 * T - x, 0)))
+        n, x = np.divmod(tau, T)
+        return n * cycles(T) + cycles(x)
+
+
+# %% Emulated board
+class _Board(object):
+    """State of the emulated board, shared by all client connections."""
+
+    def __init__(self, dut: BiquadDUT, noise: float, seed: Optional[int]):
+        self.dut = dut
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.t_start = time.monotonic()
+        self.lock = threading.RLock()
+        self.errors = deque()
+        self.analog = np.zeros(4)
+        self.ext_trig_deb_us = 500
+        self._cache = None      # (fs_sim, t_end, zi) to continue sequential renders
+        self.reset()
+
+    def now(self) -> float:
+        return time.monotonic() - self.t_start
+
+    def reset(self) -> None:
+        self.gen = {1: _Generator(), 2: _Generator()}
+        self.acq_reset()
+        self.axi_reset()
+
+    def acq_reset(self) -> None:
+        self.dec = 1
+        self.avg = True
+        self.units = 'VOLTS'
+        self.data_format = 'ASCII'
+        self.gain = {1: 'LV', 2: 'LV', 3: 'LV', 4: 'LV'}
+        self.trig_lvl = 0.0
+        self.trig_dly = 0
+        self.trig_src = 'DISABLED'
+        self.t_arm = None           # time of ACQ:START
+        self.t_trig = None          # time of the trigger event, None while waiting
+        self.t_trig_set = None      # time of ACQ:TRig
+        self.running = False
+
+    def axi_reset(self) -> None:
+        self.axi_dec = 1
+        self.axi_units = 'VOLTS'
+        self.axi_dly = {1: BUFFER_SIZE, 2: BUFFER_SIZE}
+        self.axi_buffer = {1: (AXI_START, AXI_SIZE // 2), 2: (AXI_START + AXI_SIZE // 2, AXI_SIZE // 2)}
+        self.axi_enable = {1: False, 2: False}
+
+    def error(self, code: int, text: str) -> None:
+        self.errors.append(f'{code},"{text}"')
+
+    # Signal synthesis
+    def render(self, t0: float, n: int, fs: float, chans=(1, 2)) -> np.ndarray:
+        """IN1..IN<n> from t0 on with n samples at rate fs (volts, with noise and clipping)."""
+        # The DUT runs at fs_sim = k * fs, every k-th sample is captured
+        # (k is only reduced for very long captures, see SIM_SAMPLES)
+        k = self.dut.oversampling(fs, self.gen[1].max_freq())
+        while k > 1 and n * k > SIM_SAMPLES:
+            k //= 2
+        fs_sim = k * fs
+        out1 = self.gen[1].render(t0 + np.arange(n * k) / fs_sim)
+        sos = self.dut.sos(fs_sim)
+
+        if self._cache is not None and self._cache[0] == fs_sim and abs(self._cache[1] - t0) < 0.5 / fs_sim:
+            in2, zi = sig.sosfilt(sos, out1, zi=self._cache[2])
+        else:
+            # Run the DUT from rest over the settling time before t0
+            n_pre = int(min(self.dut.settling_time() * fs_sim, 2**22))
+            t_pre = t0 - np.arange(n_pre, 0, -1) / fs_sim
+            zi = np.zeros((sos.shape[0], 2))
+            if n_pre:
+                _, zi = sig.sosfilt(sos, self.gen[1].render(t_pre), zi=zi)
+            in2, zi = sig.sosfilt(sos, out1, zi=zi)
+        self._cache = (fs_sim, t0 + n / fs, zi)
+        out1, in2 = out1[::k], in2[::k]
+
+        signals = {1: out1, 2: in2}
+        data = np.empty((len(chans), n))
+        for i, ch in enumerate(chans):
+            data[i] = signals.get(ch, 0.0) + self.noise * self.rng.standard_normal(n)
+            lim = 20.0 if self.gain[ch] == 'HV' else 1.0
+            np.clip(data[i], -lim, lim, out=data[i])
+        return data
+
+    def invalidate(self, t_change: Optional[float] = None) -> None:
+        """Generator changed (at t_change), sequential renders have to restart and a pending trigger is searched again."""
+        self._cache = None
+        if self.running and self.t_trig is None and self.trig_src not in ('DISABLED', 'NOW'):
+            self.set_trigger(self.trig_src, since=self.t_trig_set, t_change=t_change)
+
+    # Trigger
+    def arm(self) -> None:
+        self.t_arm = self.now()
+        self.t_trig = None
+        self.running = True
+
+    def set_trigger(self, src: str, since: Optional[float] = None, t_change: Optional[float] = None) -> None:
+        """Search the trigger event from now (or from `since`, when a pending trigger is searched again).
+        After a generator change at `t_change` the search starts there, the signal before it is unchanged."""
+        self.trig_src = src
+        self.t_trig_set = self.now() if since is None else since
+        if not self.running or src == 'DISABLED':
+            return
+        fs = ADC_RATE / self.dec
+        pre = max(BUFFER_SIZE - self.post_trigger(), 0)
+        t_min = max(self.t_trig_set, self.t_arm + pre / fs)   # pre-trigger samples have to be recorded first
+        if src == 'NOW':
+            self.t_trig = self.now()
+            return
+        m = re.match(r'(CH[1-4]|EXT|AWG)_(PE|NE)', src)
+        if m is None:
+            self.error(-224, "Illegal parameter value")
+            return
+        # Search for the edge on the input in blocks of one buffer, at most 64 buffers ahead.
+        # Consecutive blocks continue the DUT state, the last sample is kept for the comparison.
+        ch = int(m.group(1)[2]) if m.group(1).startswith('CH') else 1
+        block = BUFFER_SIZE
+        t = t_min if t_change is None else max(t_min, t_change)
+        prev = self.render(t - 1 / fs, 1, fs, chans=(ch,))[0]
+        for _ in range(64):
+            x = np.concatenate((prev, self.render(t, block, fs, chans=(ch,))[0]))
+            if m.group(2) == 'PE':
+                idx = np.nonzero((x[:-1] < self.trig_lvl) & (x[1:] >= self.trig_lvl))[0]
+            else:
+                idx = np.nonzero((x[:-1] > self.trig_lvl) & (x[1:] <= self.trig_lvl))[0]
+            if idx.size:
+                self.t_trig = t + idx[0] / fs
+                return
+            prev = x[-1:]
+            t += block / fs
+
+    def triggered(self) -> bool:
+        return self.t_trig is not None and self.now() >= self.t_trig
+
+    def filled(self, post: int, fs: float) -> bool:
+        return self.triggered() and self.now() >= self.t_trig + post / fs
+
+    # Standard buffer
+    def post_trigger(self) -> int:
+        """Samples written after the trigger: the board counts ACQ:TRig:DLY from the buffer middle."""
+        return max(self.trig_dly + BUFFER_SIZE // 2, 0)
+
+    def buffer_window(self):
+        """Start time of the buffer, sample rate and trigger index.
+
+        With more than BUFFER_SIZE post-trigger samples the trigger itself is already overwritten,
+        the buffer then starts after it.
+        """
+        fs = ADC_RATE / self.dec
+        post = self.post_trigger()
+        offset = BUFFER_SIZE - post if post else BUFFER_SIZE - 1
+        t_ref = self.t_trig if self.t_trig is not None else self.now()
+        return t_ref - offset / fs, fs, offset % BUFFER_SIZE
+
+    def buffer(self, chan: int, start: int, n: int) -> np.ndarray:
+        t0, fs, _ = self.buffer_window()
+        idx = (start + np.arange(n)) % BUFFER_SIZE
+        full = self.render(t0, BUFFER_SIZE, fs, chans=(chan,))[0]
+        return full[idx]
+
+    # Deep memory (AXI)
+    def axi_samples(self, chan: int) -> int:
+        return int(self.axi_buffer[chan][1]) // 2
+
+    def axi_trig_pos(self, chan: int) -> int:
+        return (self.axi_samples(chan) // 2) % max(self.axi_samples(chan), 1)
+
+    def axi_data(self, chan: int, start: int, n: int) -> np.ndarray:
+        fs = ADC_RATE / self.axi_dec
+        t_ref = self.t_trig if self.t_trig is not None else self.now()
+        size = self.axi_samples(chan)
+        offset = (start - self.axi_trig_pos(chan)) % size
+        if offset > size // 2:
+            offset -= size
+        return self.render(t_ref + offset / fs, n, fs, chans=(chan,))[0]
+
+
+# %% SCPI protocol
+class _Handler(socketserver.BaseRequestHandler):
+    """One client connection. Answers are delayed by the emulated latency and
+    sent by a separate thread, so pipelined queries cost one round trip."""
+
+    def setup(self):
+        self.emu: 'RedPitayaEmulator' = self.server.emulator
+        self.board: _Board = self.emu.board
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.outbox = deque()
+        self.outbox_ready = threading.Condition()
+        self.closed = False
+        self.sender = threading.Thread(target=self._send_loop, daemon=True)
+        self.sender.start()
+
+    def handle(self):
+        buf = bytearray()
+        while True:
+            try:
+                chunk = self.request.recv(65536)
+            except OSError:
+                break
+            if not chunk:
+                break
+            buf += chunk
+            while True:
+                end = buf.find(b'\r\n')
+                if end < 0:
+                    end = buf.find(b'\n')
+                    if end < 0:
+                        break
+                    line, buf = bytes(buf[:end]), buf[end + 1:]
+                else:
+                    line, buf = bytes(buf[:end]), buf[end + 2:]
+                t_recv = time.monotonic()
+                answer = self._dispatch(line.decode('utf-8', 'replace').strip())
+                if answer is not None:
+                    if isinstance(answer, str):
+                        answer = answer.encode('utf-8')
+                    self._queue(t_recv + self.emu.latency, answer + b'\r\n')
+
+    def finish(self):
+        with self.outbox_ready:
+            self.closed = True
+            self.outbox_ready.notify()
+        self.sender.join(timeout=1.0)
+
+    def _queue(self, due: float, data: bytes) -> None:
+        with self.outbox_ready:
+            self.outbox.append((due, data))
+            self.outbox_ready.notify()
+
+    def _send_loop(self) -> None:
+        while True:
+            with self.outbox_ready:
+                while not self.outbox and not self.closed:
+                    self.outbox_ready.wait()
+                if not self.outbox:
+                    return
+                due, data = self.outbox.popleft()
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                if self.emu.bandwidth:
+                    view = memoryview(data)
+                    step = max(int(self.emu.bandwidth * 0.01), 1)   # 10 ms slices
+                    for i in range(0, len(view), step):
+                        t = time.monotonic()
+                        self.request.sendall(view[i:i + step])
+                        rest = len(view[i:i + step]) / self.emu.bandwidth - (time.monotonic() - t)
+                        if rest > 0:
+                            time.sleep(rest)
+                else:
+                    self.request.sendall(data)
+            except OSError:
+                return
+
+    def _dispatch(self, line: str):
+        if not line:
+            return None
+        parts = line.split(None, 1)
+        header = parts[0].upper()
+        args = parts[1].strip() if len(parts) > 1 else ''
+        with self.board.lock:
+            for pattern, func in _COMMANDS:
+                m = pattern.fullmatch(header)
+                if m:
+                    try:
+                        return func(self, m, args)
+                    except (ValueError, IndexError, KeyError):
+                        self.board.error(-224, "Illegal parameter value")
+                        return 'ERR!' if header.endswith('?') else None
+            self.board.error(-113, "Undefined header")
+            return 'ERR!' if header.endswith('?') else None
+
+    # Helpers
+    def _format(self, data: np.ndarray, units: str):
+        """Encode samples in the current units and data format."""
+        if units == 'RAW':
+            raw = np.clip(np.round(data * 8192.0), -8192, 8191)
+            if self.board.data_format == 'BIN':
+                payload = raw.astype('>i2').tobytes()
+            else:
+                return '{' + ','.join(str(int(v)) for v in raw) + '}'
+        else:
+            if self.board.data_format == 'BIN':
+                payload = data.astype('>f4').tobytes()
+            else:
+                return '{' + ','.join(f'{v:.6f}' for v in data) + '}'
+        size = str(len(payload)).encode()
+        return b'#' + str(len(size)).encode() + size + payload
+
+    def _gen(self, m, reset_phase=False, **changes):
+        chan = int(m.group(1))
+        b = self.board
+        t = b.now()
+        b.gen[chan].update(t, reset_phase, **changes)
+        b.invalidate(t)
+
+    @staticmethod
+    def _on_off(args: str) -> bool:
+        if args.upper() not in ('ON', 'OFF', '1', '0'):
+            raise ValueError(args)
+        return args.upper() in ('ON', '1')
+
+
+def _cmd(pattern):
+    """Register a handler for a SCPI header (regular expression on the upper-case header)."""
+    def register(func):
+        _COMMANDS.append((re.compile(pattern), func))
+        return func
+    return register
+
+_COMMANDS = []
+
+
+# IEEE and system
+@_cmd(r'\*IDN\?')
+def _idn(h, m, args):
+    return 'REDPITAYA,INSTR2020,EMULATOR,0.1'
+
+@_cmd(r'\*STB\?')
+def _stb(h, m, args):
+    return str(4 if h.board.errors else 0)
+
+@_cmd(r'\*OPC\?')
+def _opc_q(h, m, args):
+    return '1'
+
+@_cmd(r'\*(OPC|ESE|SRE)')
+def _ignored(h, m, args):
+    return None
+
+@_cmd(r'\*(ESE|ESR|SRE)\?')
+def _zero(h, m, args):
+    return '0'
+
+@_cmd(r'\*CLS')
+def _cls(h, m, args):
+    h.board.errors.clear()
+
+@_cmd(r'\*RST')
+def _rst(h, m, args):
+    h.board.reset()
+
+@_cmd(r'SYST(EM)?:ERR(OR)?:NEXT\?')
+def _err_next(h, m, args):
+    return h.board.errors.popleft() if h.board.errors else '0,"No error"'
+
+@_cmd(r'SYST(EM)?:ERR(OR)?:COUN(T)?\?')
+def _err_count(h, m, args):
+    return str(len(h.board.errors))
+
+@_cmd(r'ANALOG:RST')
+def _analog_rst(h, m, args):
+    h.board.analog[:] = 0.0
+
+@_cmd(r'ANALOG:PIN\?')
+def _analog_pin(h, m, args):
+    pin = int(re.fullmatch(r'AIN([0-3])', args.upper()).group(1))
+    # Slow input AIN0 sees the rectified DUT output (phase detector), the others noise
+    level = abs(h.board.dut.response(h.board.gen[1].state.freq)) * h.board.gen[1].state.volt if pin == 0 else 0.0
+    return f'{level + h.board.noise * h.board.rng.standard_normal():.4f}'
+
+# Generator
+@_cmd(r'GEN:RST')
+def _gen_rst(h, m, args):
+    b = h.board
+    t = b.now()
+    for chan in (1, 2):
+        gen = b.gen[chan]
+        defaults = _GenState().__dict__
+        gen.update(t, True, **defaults)
+    b.invalidate(t)
+
+@_cmd(r'PHAS:ALIGN')
+def _phas_align(h, m, args):
+    t = h.board.now()
+    for chan in (1, 2):
+        h.board.gen[chan].update(t, True)
+    h.board.invalidate(t)
+
+@_cmd(r'OUTPUT([12]):STATE')
+def _output(h, m, args):
+    h._gen(m, reset_phase=True, output=h._on_off(args))
+
+@_cmd(r'OUTPUT([12]):STATE\?')
+def _output_q(h, m, args):
+    return 'ON' if h.board.gen[int(m.group(1))].state.output else 'OFF'
+
+@_cmd(r'SOUR([12]):TRIG:INT')
+def _gen_trig_int(h, m, args):
+    h._gen(m, reset_phase=True)
+
+@_cmd(r'SOUR([12]):TRIG:SOUR')
+def _gen_trig_sour(h, m, args):
+    h.board.gen[int(m.group(1))].state.trig_sour = args.upper()
+
+@_cmd(r'SOUR([12]):TRIG:SOUR\?')
+def _gen_trig_sour_q(h, m, args):
+    return h.board.gen[int(m.group(1))].state.trig_sour
+
+@_cmd(r'SOUR:TRIG:EXT:DEB(OUNCER)?:US')
+def _gen_deb(h, m, args):
+    h.board.ext_trig_deb_us = int(args)
+
+@_cmd(r'SOUR:TRIG:EXT:DEB(OUNCER)?:US\?')
+def _gen_deb_q(h, m, args):
+    return str(h.board.ext_trig_deb_us)
+
+@_cmd(r'SOUR([12]):FUNC')
+def _func(h, m, args):
+    func = args.upper()
+    if func not in ('SINE', 'SQUARE', 'TRIANGLE', 'SAWU', 'SAWD', 'PWM', 'ARBITRARY', 'DC', 'DC_NEG'):
+        raise ValueError(func)
+    h._gen(m, func=func)
+
+@_cmd(r'SOUR([12]):VOLT')
+def _volt(h, m, args):
+    h._gen(m, volt=float(args))
+
+@_cmd(r'SOUR([12]):VOLT:OFFS')
+def _offs(h, m, args):
+    h._gen(m, offset=float(args))
+
+@_cmd(r'SOUR([12]):FREQ:FIX(:DIRECT)?')
+def _freq(h, m, args):
+    freq = float(args)
+    if not 0 <= freq <= 50e6:
+        raise ValueError(args)
+    h._gen(m, freq=freq)
+
+@_cmd(r'SOUR([12]):PHAS')
+def _phas(h, m, args):
+    h._gen(m, phase=float(args))
+
+@_cmd(r'SOUR([12]):DCYC')
+def _dcyc(h, m, args):
+    h._gen(m, dcyc=float(args))
+
+@_cmd(r'SOUR([12]):TRAC:DATA:DATA')
+def _arb(h, m, args):
+    data = np.array([float(v) for v in args.split(',')])
+    if len(data) > BUFFER_SIZE:
+        raise ValueError('too many samples')
+    h._gen(m, data=data)
+
+@_cmd(r'SOUR([12]):(FUNC|VOLT|VOLT:OFFS|FREQ:FIX|PHAS|DCYC)\?')
+def _gen_q(h, m, args):
+    st = h.board.gen[int(m.group(1))].state
+    return str({'FUNC': st.func, 'VOLT': st.volt, 'VOLT:OFFS': st.offset, 'FREQ:FIX': st.freq,
+                'PHAS': st.phase, 'DCYC': st.dcyc}[m.group(2)])
+
+@_cmd(r'SOUR([12]):BURS:STAT')
+def _burst(h, m, args):
+    h._gen(m, reset_phase=True, burst=args.upper() == 'BURST')
+
+@_cmd(r'SOUR([12]):BURS:NCYC')
+def _ncyc(h, m, args):
+    h._gen(m, ncyc=int(args))
+
+@_cmd(r'SOUR([12]):BURS:NOR')
+def _nor(h, m, args):
+    h._gen(m, nor=int(args))
+
+@_cmd(r'SOUR([12]):BURS:INT:PER')
+def _per(h, m, args):
+    h._gen(m, period_us=float(args))
+
+@_cmd(r'SOUR([12]):(BURS:)?LASTVALUE')
+def _last(h, m, args):
+    h._gen(m, last_val=float(args))
+
+@_cmd(r'SOUR([12]):(BURS:)?INITVALUE')
+def _init(h, m, args):
+    h._gen(m, init_val=float(args))
+
+@_cmd(r'SOUR([12]):SWEEP:STATE')
+def _sweep_state(h, m, args):
+    h._gen(m, reset_phase=True, sweep=h._on_off(args))
+
+@_cmd(r'SOUR([12]):SWEEP:FREQ:START')
+def _sweep_start(h, m, args):
+    h._gen(m, sweep_start=float(args))
+
+@_cmd(r'SOUR([12]):SWEEP:FREQ:STOP')
+def _sweep_stop(h, m, args):
+    h._gen(m, sweep_stop=float(args))
+
+@_cmd(r'SOUR([12]):SWEEP:TIME')
+def _sweep_time(h, m, args):
+    h._gen(m, sweep_time_us=float(args))
+
+@_cmd(r'SOUR([12]):SWEEP:MODE')
+def _sweep_mode(h, m, args):
+    h._gen(m, sweep_mode=args.upper())
+
+@_cmd(r'SOUR([12]):SWEEP:DIR')
+def _sweep_dir(h, m, args):
+    h._gen(m, sweep_dir=args.upper())
+
+@_cmd(r'SOUR([12]):SWEEP:(PAUSE|RESET)')
+def _sweep_ignored(h, m, args):
+    return None
+
+@_cmd(r'(SOUR:)?TRIG:EXT:(DEBOUNCER:US|LEV)')
+def _gen_ext_ignored(h, m, args):
+    return None
+
+# Acquisition
+@_cmd(r'ACQ:RST')
+def _acq_rst(h, m, args):
+    h.board.acq_reset()
+
+@_cmd(r'ACQ:START')
+def _acq_start(h, m, args):
+    h.board.arm()
+
+@_cmd(r'ACQ:STOP')
+def _acq_stop(h, m, args):
+    h.board.running = False
+
+@_cmd(r'ACQ:DEC(:FACTOR)?')
+def _acq_dec(h, m, args):
+    # ACQ:DEC only takes powers of two, ACQ:DEC:Factor also every integer from 17 on
+    dec = int(args)
+    power_of_two = dec & (dec - 1) == 0
+    if not 1 <= dec <= 65536 or not (power_of_two or (m.group(1) and dec > 16)):
+        raise ValueError(args)
+    h.board.dec = dec
+
+@_cmd(r'ACQ:DEC(:FACTOR)?\?')
+def _acq_dec_q(h, m, args):
+    return str(h.board.dec)
+
+@_cmd(r'ACQ:AVG')
+def _acq_avg(h, m, args):
+    h.board.avg = h._on_off(args)
+
+@_cmd(r'ACQ:AVG\?')
+def _acq_avg_q(h, m, args):
+    return 'ON' if h.board.avg else 'OFF'
+
+@_cmd(r'ACQ:DATA:UNITS')
+def _acq_units(h, m, args):
+    if args.upper() not in ('RAW', 'VOLTS'):
+        raise ValueError(args)
+    h.board.units = args.upper()
+
+@_cmd(r'ACQ:DATA:UNITS\?')
+def _acq_units_q(h, m, args):
+    return h.board.units
+
+@_cmd(r'ACQ:DATA:FORMAT')
+def _acq_format(h, m, args):
+    if args.upper() not in ('ASCII', 'BIN'):
+        raise ValueError(args)
+    h.board.data_format = args.upper()
+
+@_cmd(r'ACQ:DATA:FORMAT\?')
+def _acq_format_q(h, m, args):
+    return h.board.data_format
+
+@_cmd(r'ACQ:BUF:SIZE\?')
+def _acq_buf_size(h, m, args):
+    return str(BUFFER_SIZE)
+
+@_cmd(r'ACQ:SOUR([1-4]):GAIN')
+def _acq_gain(h, m, args):
+    if args.upper() not in ('LV', 'HV'):
+        raise ValueError(args)
+    h.board.gain[int(m.group(1))] = args.upper()
+
+@_cmd(r'ACQ:SOUR([1-4]):GAIN\?')
+def _acq_gain_q(h, m, args):
+    return h.board.gain[int(m.group(1))]
+
+@_cmd(r'ACQ:TRIG')
+def _acq_trig(h, m, args):
+    h.board.set_trigger(args.upper())
+
+@_cmd(r'ACQ:TRIG:STAT\?')
+def _acq_trig_stat(h, m, args):
+    return 'TD' if h.board.triggered() else 'WAIT'
+
+@_cmd(r'ACQ:TRIG:FILL\?')
+def _acq_trig_fill(h, m, args):
+    b = h.board
+    return '1' if b.filled(b.post_trigger(), ADC_RATE / b.dec) else '0'
+
+@_cmd(r'ACQ:TRIG:LEV')
+def _acq_trig_lev(h, m, args):
+    h.board.trig_lvl = float(args.upper().replace('V', ''))
+
+@_cmd(r'ACQ:TRIG:LEV\?')
+def _acq_trig_lev_q(h, m, args):
+    return str(h.board.trig_lvl)
+
+@_cmd(r'ACQ:TRIG:DLY')
+def _acq_trig_dly(h, m, args):
+    h.board.trig_dly = int(args)
+
+@_cmd(r'ACQ:TRIG:DLY:NS')
+def _acq_trig_dly_ns(h, m, args):
+    h.board.trig_dly = int(round(float(args) * 1e-9 * ADC_RATE / h.board.dec))
+
+@_cmd(r'ACQ:TRIG:DLY\?')
+def _acq_trig_dly_q(h, m, args):
+    return str(h.board.trig_dly)
+
+@_cmd(r'ACQ:TRIG:(HYST|EXT:DEBOUNCER:US)')
+def _acq_trig_ignored(h, m, args):
+    return None
+
+@_cmd(r'ACQ:TPOS\?')
+def _acq_tpos(h, m, args):
+    return str(h.board.buffer_window()[2])
+
+@_cmd(r'ACQ:WPOS\?')
+def _acq_wpos(h, m, args):
+    return str((h.board.buffer_window()[2] + h.board.post_trigger()) % BUFFER_SIZE)
+
+@_cmd(r'ACQ:SOUR([1-4]):DATA\?')
+def _acq_data(h, m, args):
+    b = h.board
+    return h._format(b.buffer(int(m.group(1)), 0, BUFFER_SIZE), b.units)
+
+@_cmd(r'ACQ:SOUR([1-4]):DATA:STA(RT)?:(END|N)\?')
+def _acq_data_start(h, m, args):
+    b = h.board
+    start, second = (int(v) for v in args.split(','))
+    n = second if m.group(3) == 'N' else (second - start) % BUFFER_SIZE
+    return h._format(b.buffer(int(m.group(1)), start, n), b.units)
+
+@_cmd(r'ACQ:SOUR([1-4]):DATA:(OLD|LAT(EST)?):N\?')
+def _acq_data_old_last(h, m, args):
+    b = h.board
+    n = int(args)
+    start = 0 if m.group(2) == 'OLD' else BUFFER_SIZE - n
+    return h._format(b.buffer(int(m.group(1)), start, n), b.units)
+
+@_cmd(r'ACQ:SOUR([1-4]):DATA:TRIG\?')
+def _acq_data_trig(h, m, args):
+    b = h.board
+    n, pos = args.split(',')
+    n = int(n)
+    trig_idx = b.buffer_window()[2]
+    start, count = {'PRE_TRIG': (trig_idx - n + 1, n), 'POST_TRIG': (trig_idx, n),
+                    'PRE_POST_TRIG': (trig_idx - n, 2 * n + 1)}[pos.strip().upper()]
+    return h._format(b.buffer(int(m.group(1)), start, count), b.units)
+
+# Deep memory acquisition
+@_cmd(r'ACQ:AXI:START\?')
+def _axi_start(h, m, args):
+    return str(AXI_START)
+
+@_cmd(r'ACQ:AXI:SIZE\?')
+def _axi_size(h, m, args):
+    return str(AXI_SIZE)
+
+@_cmd(r'ACQ:AXI:DEC')
+def _axi_dec(h, m, args):
+    h.board.axi_dec = int(args)
+    h.board.dec = int(args)
+
+@_cmd(r'ACQ:AXI:DATA:UNITS')
+def _axi_units(h, m, args):
+    if args.upper() not in ('RAW', 'VOLTS'):
+        raise ValueError(args)
+    h.board.axi_units = args.upper()
+
+@_cmd(r'ACQ:AXI:SOUR([12]):TRIG:DLY')
+def _axi_dly(h, m, args):
+    h.board.axi_dly[int(m.group(1))] = int(args)
+
+@_cmd(r'ACQ:AXI:SOUR([12]):SET:BUFFER')
+def _axi_buffer(h, m, args):
+    address, size = (float(v) for v in args.split(','))
+    h.board.axi_buffer[int(m.group(1))] = (int(address), int(size))
+
+@_cmd(r'ACQ:AXI:SOUR([12]):ENABLE')
+def _axi_enable(h, m, args):
+    h.board.axi_enable[int(m.group(1))] = h._on_off(args)
+
+@_cmd(r'ACQ:AXI:SOUR([12]):TRIG:FILL\?')
+def _axi_fill(h, m, args):
+    b = h.board
+    chan = int(m.group(1))
+    return '1' if b.filled(b.axi_dly[chan], ADC_RATE / b.axi_dec) else '0'
+
+@_cmd(r'ACQ:AXI:SOUR([12]):TRIG:POS\?')
+def _axi_pos(h, m, args):
+    return str(h.board.axi_trig_pos(int(m.group(1))))
+
+@_cmd(r'ACQ:AXI:SOUR([12]):DATA:START:N\?')
+def _axi_data(h, m, args):
+    b = h.board
+    start, n = (int(v) for v in args.split(','))
+    return h._format(b.axi_data(int(m.group(1)), start, n), b.axi_units)
+
+
+# %% Server
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class RedPitayaEmulator(object):
+    """Local TCP server emulating a Red Pitaya SCPI server with a biquad DUT."""
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        dut: Optional[BiquadDUT] = None,
+        noise: float = 1e-3,
+        latency: float = 0.0,
+        bandwidth: Optional[float] = None,
+        seed: Optional[int] = None
+    ):
+        """
+        Args:
+            host (str): Interface to listen on.
+            port (int): TCP port, 0 picks a free one (see ``address``).
+            dut (BiquadDUT): Device under test between OUT1 and IN2. Defaults to a bandpass at 1 kHz, Q = 1.
+            noise (float): Standard deviation of the input noise in Volts.
+            latency (float): Delay added to every answer in seconds (emulated round trip time).
+            bandwidth (float): Maximum transfer rate of answers in bytes/s, None for unlimited.
+            seed (int): Seed of the noise generator.
+        """
+        self.board = _Board(dut if dut is not None else BiquadDUT(), noise, seed)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self._server = _Server((host, port), _Handler)
+        self._server.emulator = self
+        self._thread = None
+
+    @property
+    def address(self):
+        """(host, port) tuple to pass to scpi.scpi(host, port=port)."""
+        return self._server.server_address[:2]
+
+    @property
+    def dut(self) -> BiquadDUT:
+        return self.board.dut
+
+    @dut.setter
+    def dut(self, dut: BiquadDUT) -> None:
+        with self.board.lock:
+            self.board.dut = dut
+            self.board.invalidate()
+
+    def start(self) -> 'RedPitayaEmulator':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# %% Command line
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Red Pitaya SCPI emulator with a biquad DUT')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--f0', type=float, default=1000.0, help='DUT centre frequency in Hz')
+    parser.add_argument('--Q', type=float, default=1.0, help='DUT quality factor')
+    parser.add_argument('--H0', type=float, default=1.0, help='DUT gain')
+    parser.add_argument('--ftype', default='BP', choices=['LP', 'HP', 'BP', 'BS'])
+    parser.add_argument('--noise', type=float, default=1e-3, help='input noise in V rms')
+    parser.add_argument('--latency', type=float, default=0.0, help='answer delay in s')
+    parser.add_argument('--bandwidth', type=float, default=None, help='answer rate limit in bytes/s')
+    a = parser.parse_args()
+
+    emu = RedPitayaEmulator(a.host, a.port, BiquadDUT(a.f0, a.Q, a.H0, a.ftype), a.noise, a.latency, a.bandwidth)
+    print(f'Red Pitaya emulator on {emu.address[0]}:{emu.address[1]} (DUT {a.ftype}, f0 = {a.f0} Hz, Q = {a.Q}, H0 = {a.H0})')
+    try:
+        emu._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
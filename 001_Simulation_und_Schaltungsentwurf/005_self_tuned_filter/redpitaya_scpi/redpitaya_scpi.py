@@ -2,15 +2,23 @@
 Provides SCPI access to Red Pitaya from host computer.
 """
 
+import errno
+import json
 import socket
+import time
+from collections import deque
+from contextlib import contextmanager
 from enum import Enum
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Sequence, Union
 import numpy as np
 
 __author__ = "Luka Golinar, Iztok Jeras, Miha Gjura"
 __copyright__ = "Copyright 2025, Red Pitaya"
 __OS_version__ = "IN DEV"
 
+ADC_RATE = 125e6        # STEMlab 125-14 sampling rate, used to estimate capture times
+BUFFER_SIZE = 16384     # samples in the standard acquisition buffer
+
 
 class Waveform(Enum):
     """Waveform types for signal generator."""
@@ -134,9 +142,145 @@ class LCRExtShunt(Enum):
     S100K = "S100k"
     S1M = "S1M"
 
+class ErrorPolicy(Enum):
+    """When ``scpi.check_error()`` reads the error status from Red Pitaya."""
+    IMMEDIATE = "immediate"     # after every command function
+    DEFERRED = "deferred"       # once per batch / sweep step, see check_error_now() and deferred_errors()
+    OFF = "off"                 # never
+
+class ScpiError(RuntimeError):
+    """Severe error reported by Red Pitaya. Carries the error queue and the commands sent since the last check."""
+
+    def __init__(self, errors: List[str], commands: List[str], host: str = ""):
+        self.errors = errors
+        self.commands = commands
+        self.host = host
+        self.code = int(errors[0].split(",")[0]) if errors else None
+        context = f" after {commands}" if commands else ""
+        super().__init__(f"SCPI >> {host}: {'; '.join(errors)}{context}")
+
+class BatchReply(object):
+    """Placeholder for the answer to a query queued with ``scpi.batch()``.
+    The answer is filled in when the batch is flushed."""
+
+    def __init__(self, msg: str):
+        self.msg = msg
+        self._value = None
+        self._done = False
+
+    def done(self) -> bool:
+        """Return True once the answer has been received."""
+        return self._done
+
+    def result(self) -> str:
+        """Return the answer of the query."""
+        if not self._done:
+            raise RuntimeError(f"SCPI >> '{self.msg}' has not been flushed yet")
+        return self._value
+
+    def _set(self, value: str) -> None:
+        self._value = value
+        self._done = True
+
+    def __repr__(self):
+        return f"BatchReply({self.msg!r}, {self._value!r})" if self._done else f"BatchReply({self.msg!r}, pending)"
+
+class ScpiStats(object):
+    """Per-command latency and throughput statistics of one ``scpi`` connection.
+    Created by ``scpi.enable_stats()``.
+
+    Every sent command is one event with its SCPI mnemonic, send time, bytes on the wire
+    and, for queries, the time to the first response byte (``ttfb``) and to the complete
+    answer (``latency``). Times are in seconds since the statistics were enabled.
+    ``scpi.timed()`` adds named sections such as settling waits or data parsing.
+    """
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.events: List[dict] = []
+        self.sections: Dict[str, List[float]] = {}
+        self._pending = deque()     # queries waiting for their answer, in send order
+
+    def _on_send(self, msgs: List[str]) -> None:
+        t = time.perf_counter() - self.t0
+        for msg in msgs:
+            cmd = msg.split(' ', 1)[0].upper()
+            event = {'cmd': cmd, 't_send': t, 'bytes_tx': len(msg) + 2, 'bytes_rx': 0,
+                     'ttfb': float('nan'), 'latency': float('nan')}
+            self.events.append(event)
+            if cmd.endswith('?'):
+                self._pending.append(event)
+
+    def _on_receive(self, nbytes: int, t_first: float) -> None:
+        t = time.perf_counter() - self.t0
+        if self._pending:
+            event = self._pending.popleft()
+        else:
+            event = {'cmd': '(unrequested)', 't_send': t, 'bytes_tx': 0}
+            self.events.append(event)
+        event['bytes_rx'] = nbytes
+        event['ttfb'] = t_first - self.t0 - event['t_send']
+        event['latency'] = t - event['t_send']
+
+    def _on_section(self, name: str, duration: float) -> None:
+        self.sections.setdefault(name, []).append(duration)
+
+    def summary(self) -> Dict[str, dict]:
+        """Return call count, bytes and latency statistics per SCPI mnemonic and per section."""
+        result = {}
+        for cmd in sorted({e['cmd'] for e in self.events}):
+            events = [e for e in self.events if e['cmd'] == cmd]
+            latency = np.array([e['latency'] for e in events])
+            latency = latency[~np.isnan(latency)]
+            ttfb = np.array([e['ttfb'] for e in events])
+            ttfb = ttfb[~np.isnan(ttfb)]
+            result[cmd] = {
+                'count': len(events),
+                'bytes_tx': sum(e['bytes_tx'] for e in events),
+                'bytes_rx': sum(e['bytes_rx'] for e in events),
+                'latency_mean': float(latency.mean()) if latency.size else None,
+                'latency_p50': float(np.percentile(latency, 50)) if latency.size else None,
+                'latency_p95': float(np.percentile(latency, 95)) if latency.size else None,
+                'latency_max': float(latency.max()) if latency.size else None,
+                'ttfb_mean': float(ttfb.mean()) if ttfb.size else None,
+            }
+        for name, durations in self.sections.items():
+            result[f"[{name}]"] = {'count': len(durations), 'total': float(np.sum(durations)),
+                                   'mean': float(np.mean(durations)), 'max': float(np.max(durations))}
+        return result
+
+    def histogram(self, cmd: Optional[str] = None, bins: Optional[np.ndarray] = None):
+        """Return ``np.histogram`` of the query latencies, for one mnemonic or for all.
+        Default bins are logarithmic from 10 µs to 10 s."""
+        if bins is None:
+            bins = np.logspace(-5, 1, 31)
+        latency = np.array([e['latency'] for e in self.events if cmd is None or e['cmd'] == cmd.upper()])
+        return np.histogram(latency[~np.isnan(latency)], bins=bins)
+
+    def to_json(self, path: Optional[str] = None) -> str:
+        """Return events, sections and summary as JSON and optionally write them to ``path``."""
+        def clean(value):
+            return None if isinstance(value, float) and np.isnan(value) else value
+
+        text = json.dumps({
+            'events': [{k: clean(v) for k, v in e.items()} for e in self.events],
+            'sections': self.sections,
+            'summary': self.summary(),
+        }, indent=1)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def to_dataframe(self):
+        """Return the events as pandas DataFrame (one row per command)."""
+        import pandas as pd
+        return pd.DataFrame(self.events, columns=['cmd', 't_send', 'bytes_tx', 'bytes_rx', 'ttfb', 'latency'])
+
 class scpi (object):
     """SCPI class used to access Red Pitaya over an IP network."""
     delimiter = '\r\n'
+    max_recoveries = 2      # reconnects per send or receive before ConnectionError is raised
 
 
     ####################################################
@@ -146,44 +290,233 @@ class scpi (object):
     #! Functions in this section should not be modified as they take care of the communication between Red Pitaya and the computer
     #
 
-    def __init__(self, host: str, timeout: Optional[float]=None, port: int=5000):
+    def __init__(self, host: str, timeout: Optional[float]=None, port: int=5000, error_policy: ErrorPolicy=ErrorPolicy.IMMEDIATE,
+                 reconnect: int=3, rcvbuf: int=4 * 1024 * 1024):
         """Initialize object and open IP connection.
         Host IP should be a string in parentheses, like '192.168.1.100' or 'rp-xxxxxx.local'.
+        ``error_policy`` selects when ``check_error()`` asks Red Pitaya for errors (see ``ErrorPolicy``).
+        ``reconnect`` is the number of attempts to reopen a broken connection (0 = off), after which
+        the generator and acquisition configuration is sent again and unanswered queries are repeated.
+        A ``timeout`` while waiting for an answer is raised as ``socket.timeout``, it is not a broken connection.
+        ``rcvbuf`` is the socket receive buffer size in bytes.
+        Raises ``ConnectionError`` if the connection can not be opened.
         """
         self.host    = host
         self.port    = port
         self.timeout = timeout
+        self.error_policy = error_policy
+        self.reconnect = reconnect
+        self.rcvbuf  = rcvbuf
+        self._rx_buf = bytearray()   # bytes received but not yet consumed
+        self._socket = None
 
-        try:
-            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-            if timeout is not None:
-                self._socket.settimeout(timeout)
-
-            self._socket.connect((host, port))
+        # Reconnect (see _recover())
+        self._config: Dict[str, str] = {}   # last generator/acquisition setting per command header
+        self._unanswered = deque()           # queries sent whose answers were not read yet
+        self._stale = deque()                # answers of timed-out reads, dropped before the next read (see _drain())
+        self._pending = 0                    # bytes of the binary block being read that are still due
+        self.connect_time: Optional[float] = None
+
+        # Error checks (see check_error())
+        self._sent = deque(maxlen=32)   # commands sent since the last error check
+        self._error_pending = False
+        self._error_stop = False
+
+        # Batch (see batch())
+        self._batch_depth = 0
+        self._batch_cmds: List[str] = []
+        self._batch_replies: List[Optional[BatchReply]] = []
+        self._batch_check = False
+        self._batch_stop = False
+
+        # Shadow copy of the acquisition data settings (None = unknown, see refresh())
+        self._acq_state = {'units': None, 'data_format': None}
+        # Decimation and trigger delays (samples) as last sent, only used to plan polling (see wait_until())
+        self._acq_timing = {'dec': 1, 'trig_delay': 0, 'axi_delay': 0}
+
+        # Instrumentation (see enable_stats()), None = disabled
+        self.stats: Optional[ScpiStats] = None
 
+        try:
+            self._connect()
         except socket.error as e:
-            print('SCPI >> connect({!s:s}:{:d}) failed: {!s:s}'.format(host, port, e))
+            raise ConnectionError(f"SCPI >> connect({host}:{port}) failed: {e}") from e
 
-    def __del__(self):
+    def _connect(self) -> None:
+        """Open the socket with options for small commands and large answers:
+        no Nagle delay, a large receive buffer and keepalive probes to notice dead links."""
+        t = time.perf_counter()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)    # before connect, for the window scale
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, 'TCP_KEEPIDLE'):            # Linux
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 10)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 5)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+            elif hasattr(socket, 'SIO_KEEPALIVE_VALS'):    # Windows
+                sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, 10000, 5000))
+
+            if self.timeout is not None:
+                sock.settimeout(self.timeout)
+
+            sock.connect((self.host, self.port))
+        except BaseException:
+            sock.close()
+            raise
+
+        self._socket = sock
+        self._rx_buf.clear()
+        # Unanswered queries are sent again after a reconnect, partly read blocks arrive complete
+        self._stale = deque('arb' if isinstance(stale, int) else stale for stale in self._stale)
+        self._pending = 0
+        self.connect_time = time.perf_counter() - t
+        if self.stats is not None:
+            self.stats._on_section('connect', self.connect_time)
+
+    @staticmethod
+    def _connection_lost(error: Exception) -> bool:
+        """True for a broken connection (reset, broken pipe, closed by peer, dead link),
+        False for a socket timeout and other errors, which are raised unchanged."""
+        if isinstance(error, ConnectionError):
+            return True
+        return isinstance(error, OSError) and error.errno in (errno.ETIMEDOUT, errno.EHOSTUNREACH,
+                                                              errno.ENETUNREACH, errno.ENETDOWN)
+
+    def _recover(self, error: Exception, count: int = 0) -> None:
+        """Reopen a broken connection, send the recorded configuration again and repeat
+        the queries whose answers were not read yet. ``count`` is the number of recoveries
+        the current operation has already made. Raises ``error`` unchanged if it is not a
+        broken connection (e.g. ``socket.timeout``) and ``ConnectionError`` if all
+        ``reconnect`` attempts fail or the operation exceeded ``max_recoveries``."""
+        if not self.reconnect or not self._connection_lost(error):
+            raise error
+        if count >= self.max_recoveries:
+            raise ConnectionError(f"SCPI >> {self.host}: connection lost {count + 1} times in one operation: {error!s}") from error
+        print(f"SCPI >> {self.host}: connection lost ({error!s}), reconnecting")
         if self._socket is not None:
             self._socket.close()
+            self._socket = None
+
+        for attempt in range(self.reconnect):
+            time.sleep(0.5 * 2**attempt)
+            try:
+                self._connect()
+                replay = list(self._config.values()) + list(self._unanswered)
+                if replay:
+                    self._socket.sendall(''.join(msg + self.delimiter for msg in replay).encode('utf-8'))
+                return
+            except socket.error as e:
+                error = e
+                if self._socket is not None:
+                    self._socket.close()
+                    self._socket = None
+        raise ConnectionError(f"SCPI >> {self.host}: reconnect failed after {self.reconnect} attempts: {error!s}") from error
+
+    def _record_config(self, msg: str) -> None:
+        """Keep the last generator and acquisition setting per command header for _recover().
+        Resets drop the settings they clear, actions (start, trigger, ...) are not recorded."""
+        header = msg.split(' ', 1)[0].upper()
+        if header.endswith('?') or header.startswith(('*', 'SYST')):
+            if header == '*RST':
+                self._config.clear()
+            return
+        if header in ('GEN:RST', 'ACQ:RST'):
+            prefixes = ('SOUR', 'OUTPUT') if header == 'GEN:RST' else ('ACQ:',)
+            for key in [k for k in self._config if k.startswith(prefixes)]:
+                del self._config[key]
+            return
+        if header in ('ACQ:START', 'ACQ:STOP', 'ACQ:TRIG', 'PHAS:ALIGN', 'ANALOG:RST') or header.endswith(':TRIG:INT'):
+            return
+        if header.startswith(('SOUR', 'OUTPUT', 'ACQ:', 'GEN:')):
+            self._config.pop(header, None)      # keep the order in which settings were made last
+            self._config[header] = msg
+
+    def __del__(self):
+        if getattr(self, '_socket', None) is not None:
+            self._socket.close()
         self._socket = None
 
     def close(self):
         """Close IP connection."""
         self.__del__()
 
-    def rx_txt(self, chunksize: int = 4096):
-        """Receive text string and return it after removing the delimiter."""
-        msg = ''
-        while 1:
-            chunk = self._socket.recv(chunksize).decode('utf-8')        # Receive chunk size of 2^n preferably
-            msg += chunk
-            if (len(msg) >= 2 and msg[-2:] == self.delimiter):
-                return msg[:-2]
+    def rx_txt(self, chunksize: int = 65536, deadline: Optional[float] = None):
+        """Receive text string and return it after removing the delimiter.
 
-    def rx_txt_check_error(self, chunksize: int = 4096, stop: bool = True):
+        Received bytes are collected in a per-connection buffer which is searched
+        for the delimiter incrementally and decoded once per message. Bytes that
+        follow the delimiter stay buffered for the next reply, so several queries
+        can be sent back to back and their answers read in order.
+
+        ``deadline`` (``time.monotonic()`` value) limits the whole read, not only each
+        ``recv``. If the read times out, its answer is still due; it is dropped before
+        the next read, so later queries get their own answers.
+        """
+        self._drain()
+        return self._rx_txt(chunksize, deadline)
+
+    def _drain(self) -> None:
+        """Read and drop the answers of reads that timed out: ``'txt'`` for a text answer,
+        ``'arb'`` for a binary block and a byte count for the rest of a partly read block."""
+        while self._stale:
+            stale = self._stale.popleft()
+            if stale == 'txt':
+                self._rx_txt()
+                continue
+            try:
+                self._skip(max(self._rx_arb_header(), 0) + 2 if stale == 'arb' else stale)
+            except socket.timeout:
+                self._stale.appendleft(self._pending or stale)
+                raise
+            self._answered()
+
+    def _skip(self, size: int) -> None:
+        """Receive and drop ``size`` bytes."""
+        self._pending = size
+        scratch = memoryview(bytearray(min(size, 1 << 20)))
+        while self._pending:
+            self._recv_into_exact(scratch[:min(self._pending, len(scratch))])
+
+    def _rx_txt(self, chunksize: int = 65536, deadline: Optional[float] = None) -> str:
+        """Receive one text answer, see ``rx_txt()``."""
+        delimiter = self.delimiter.encode('utf-8')
+        t_first = time.perf_counter() if self.stats is not None and self._rx_buf else None
+        start = 0
+        recoveries = 0
+        while 1:
+            end = self._rx_buf.find(delimiter, start)
+            if end >= 0:
+                msg = self._rx_buf[:end].decode('utf-8')
+                del self._rx_buf[:end + len(delimiter)]
+                self._answered()
+                if self.stats is not None:
+                    self.stats._on_receive(end + len(delimiter), t_first)
+                return msg
+            start = max(0, len(self._rx_buf) - len(delimiter) + 1)    # delimiter may be split between chunks
+            try:
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise socket.timeout('timed out')
+                    self._socket.settimeout(remaining)
+                chunk = self._socket.recv(chunksize)                    # Receive chunk size of 2^n preferably
+                if not chunk:
+                    raise ConnectionError(f"SCPI >> connection to {self.host}:{self.port} closed by peer")
+            except socket.timeout:
+                self._stale.appendleft('txt')   # partial bytes stay buffered, the answer is dropped later
+                raise
+            except socket.error as e:
+                self._recover(e, recoveries)        # the answer is requested again
+                recoveries += 1
+                start = 0
+                continue
+            if t_first is None and self.stats is not None:
+                t_first = time.perf_counter()
+            self._rx_buf += chunk
+
+    def rx_txt_check_error(self, chunksize: int = 65536, stop: bool = True):
         """Receive text string and return it after removing the delimiter.
         Check for error."""
         msg = self.rx_txt(chunksize)
@@ -191,35 +524,135 @@ class scpi (object):
         return msg
 
     def rx_arb(self):
-        """ Recieve binary data from scpi server"""
-        numOfBytes = 0
-        data=b''
-        while len(data) != 1:
-            data = self._socket.recv(1)
-        if data != b'#':
-            return False
-        data=b''
-
-        while len(data) != 1:
-            data = self._socket.recv(1)
-        numOfNumBytes = int(data)
-        if numOfNumBytes <= 0:
-            return False
-        data=b''
+        """ Recieve binary data from scpi server.
 
-        while len(data) != numOfNumBytes:
-            data += (self._socket.recv(1))
-        numOfBytes = int(data)
-        data=b''
+        The ``#<n><len>`` block header is parsed from the receive buffer and the
+        payload is read with ``recv_into`` straight into one preallocated
+        ``bytearray``, so ``np.frombuffer`` can use the result without a copy.
+        If the read times out, the rest of the block is dropped before the next read.
+        """
+        self._drain()
+        t_first = time.perf_counter()
+        recoveries = 0
+        while 1:
+            try:
+                numOfBytes = self._rx_arb_header()
+                if numOfBytes < 0:
+                    return False
+
+                self._pending = numOfBytes + 2
+                data = bytearray(numOfBytes)
+                self._recv_into_exact(memoryview(data))
+
+                self._recv_exact(2)         # recive \r\n
+                break
+            except socket.timeout:
+                self._stale.appendleft(self._pending or 'arb')     # the rest of the block is dropped later
+                raise
+            except socket.error as e:
+                self._recover(e, recoveries)        # the block is requested again
+                recoveries += 1
+
+        self._answered()
+        if self.stats is not None:
+            self.stats._on_receive(numOfBytes + len(str(numOfBytes)) + 4, t_first)
 
-        while len(data) < numOfBytes:
-            r_size = min(numOfBytes - len(data),4096)
-            data += (self._socket.recv(r_size))
+        return data
 
-        self._socket.recv(2)        # recive \r\n
+    def _rx_arb_header(self) -> int:
+        """Parse a ``#<n><len>`` block header and return the payload length, -1 if there is no block.
+        The header is consumed only when it is complete, after a timeout it stays buffered."""
+        self._fill_rx_buf(1)
+        if self._rx_buf[:1] != b'#':
+            del self._rx_buf[:1]
+            return -1
 
+        self._fill_rx_buf(2)
+        numOfNumBytes = int(self._rx_buf[1:2])
+        if numOfNumBytes <= 0:
+            del self._rx_buf[:2]
+            return -1
+
+        self._fill_rx_buf(2 + numOfNumBytes)
+        numOfBytes = int(self._rx_buf[2:2 + numOfNumBytes])
+        del self._rx_buf[:2 + numOfNumBytes]
+        return numOfBytes
+
+    def _fill_rx_buf(self, size: int) -> None:
+        """Receive until at least ``size`` bytes are buffered."""
+        while len(self._rx_buf) < size:
+            chunk = self._socket.recv(size - len(self._rx_buf))
+            if not chunk:
+                raise ConnectionError(f"SCPI >> connection to {self.host}:{self.port} closed by peer")
+            self._rx_buf += chunk
+
+    def _rx_arb_rows(self, rows: int, dtype: str, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Receive ``rows`` binary blocks of equal length into one (rows, n) array with native
+        byte order. The payloads are read with ``recv_into`` straight into the rows of ``out``
+        (e.g. a slice of a memory-mapped file) or of a newly allocated array."""
+        self._drain()
+        wire = np.dtype(dtype)
+        recoveries = 0
+        for i in range(rows):
+            t_first = time.perf_counter()
+            while 1:
+                try:
+                    numOfBytes = self._rx_arb_header()
+                    if numOfBytes < 0:
+                        raise ValueError(f"SCPI >> {self.host}: expected a binary block")
+                    if out is None:
+                        out = np.empty((rows, numOfBytes // wire.itemsize), dtype=wire.newbyteorder('='))
+                    if numOfBytes != out[i].nbytes:
+                        raise ValueError(f"SCPI >> {self.host}: blocks of different length ({numOfBytes} != {out[i].nbytes} bytes)")
+
+                    self._pending = numOfBytes + 2
+                    self._recv_into_exact(memoryview(out[i].view(np.uint8)))
+                    self._recv_exact(2)     # recive \r\n
+                    break
+                except socket.timeout:
+                    # The rest of this block and the following blocks are dropped before the next read
+                    self._stale.extendleft(['arb'] * (rows - i - 1))
+                    self._stale.appendleft(self._pending or 'arb')
+                    raise
+                except socket.error as e:
+                    self._recover(e, recoveries)    # the remaining blocks are requested again
+                    recoveries += 1
+
+            self._answered()
+            if self.stats is not None:
+                self.stats._on_receive(numOfBytes + len(str(numOfBytes)) + 4, t_first)
+
+        if not wire.isnative:
+            out.byteswap(inplace=True)
+        return out
+
+    def _recv_exact(self, size: int) -> bytearray:
+        """Receive exactly ``size`` bytes."""
+        data = bytearray(size)
+        self._recv_into_exact(memoryview(data))
         return data
 
+    def _recv_into_exact(self, view: memoryview) -> None:
+        """Fill ``view`` completely, using buffered bytes before reading from the socket."""
+        size = len(view)
+        pos = min(len(self._rx_buf), size)
+        if pos:
+            view[:pos] = self._rx_buf[:pos]
+            del self._rx_buf[:pos]
+            self._pending = max(self._pending - pos, 0)
+
+        while pos < size:
+            n = self._socket.recv_into(view[pos:])
+            if n == 0:
+                raise ConnectionError(f"SCPI >> connection to {self.host}:{self.port} closed by peer")
+            pos += n
+            self._pending = max(self._pending - n, 0)
+
+    def _answered(self) -> None:
+        """One answer was read completely."""
+        if self._unanswered:
+            self._unanswered.popleft()
+
     def rx_arb_check_error(self, stop: bool = True):
         """ Recieve binary data from scpi server. Check for error."""
         data = self.rx_arb()
@@ -227,8 +660,31 @@ class scpi (object):
         return data
 
     def tx_txt(self, msg: str):
-        """Send text string ending and append delimiter."""
-        return self._socket.sendall((msg + self.delimiter).encode('utf-8'))     # was send(().encode('utf-8'))
+        """Send text string ending and append delimiter.
+        Inside a batch the command is queued and sent when the batch is flushed."""
+        self._update_acq_state(msg)
+        self._record_config(msg)
+        self._sent.append(msg if len(msg) <= 80 else msg[:77] + '...')
+        if self._batch_depth:
+            self._batch_cmds.append(msg)
+            self._batch_replies.append(None)
+            return None
+        return self._send([msg])
+
+    def _send(self, msgs: List[str]) -> None:
+        """Send one or more text strings, each followed by the delimiter, with one sendall."""
+        if self.stats is not None:
+            self.stats._on_send(msgs)
+        data = ''.join(msg + self.delimiter for msg in msgs).encode('utf-8')
+        recoveries = 0
+        while 1:
+            try:
+                self._socket.sendall(data)     # was send(().encode('utf-8'))
+                break
+            except socket.error as e:
+                self._recover(e, recoveries)
+                recoveries += 1
+        self._unanswered.extend(msg for msg in msgs if msg.split(' ', 1)[0].endswith('?'))
 
     def tx_txt_check_error(self, msg: str, stop: bool= True):
         """Send text string ending and append delimiter. Check for error."""
@@ -236,22 +692,169 @@ class scpi (object):
         self.check_error(stop)
 
     def txrx_txt(self, msg: str):
-        """Send/receive text string."""
+        """Send/receive text string.
+        Inside a batch the query is queued and a ``BatchReply`` is returned instead of the answer."""
+        if self._batch_depth:
+            reply = BatchReply(msg)
+            self._batch_cmds.append(msg)
+            self._batch_replies.append(reply)
+            return reply
         self.tx_txt(msg)
         return self.rx_txt()
 
+    def _txrx_now(self, msg: str) -> str:
+        """Send/receive text string right away, also inside a batch.
+        Commands queued so far are sent first to keep the order."""
+        self.flush()
+        self._send([msg])
+        return self.rx_txt()
+
     def check_error(self, stop = True):
-        """Read error from Red Pitaya and print it."""
-        res = int(self.stb_q())
-        if (res & 0x4):
+        """Read error from Red Pitaya and print it, depending on ``error_policy``:
+            - IMMEDIATE: check right away (inside a batch the status query is sent with the batch)
+            - DEFERRED:  only remember that a check is due, see ``check_error_now()``
+            - OFF:       no check
+        A severe error (code > 9500) raises ``ScpiError`` if ``stop`` is True."""
+        if self.error_policy == ErrorPolicy.OFF:
+            self._sent.clear()
+        elif self.error_policy == ErrorPolicy.DEFERRED:
+            self._error_pending = True
+            self._error_stop = self._error_stop or stop
+        else:
+            self.check_error_now(stop)
+
+    def check_error_now(self, stop = True):
+        """Read error from Red Pitaya regardless of ``error_policy``.
+        Inside a batch the status query is deferred and sent with the batch."""
+        stop = stop or self._error_stop
+        self._error_pending = self._error_stop = False
+        if self._batch_depth:
+            self._batch_check = True
+            self._batch_stop = self._batch_stop or stop
+            return
+        self._read_errors(int(self._txrx_now('*STB?')), stop)
+
+    @contextmanager
+    def deferred_errors(self, stop: bool = True):
+        """Check errors once at the end of the block instead of after every command function.
+
+        Example:
+            for freq in freqs:
+                with rp.deferred_errors():
+                    rp.gen_set(1, freq=freq)
+                    rp.acq_set(dec=64)
+        """
+        policy = self.error_policy
+        if policy == ErrorPolicy.IMMEDIATE:
+            self.error_policy = ErrorPolicy.DEFERRED
+        try:
+            yield self
+        finally:
+            self.error_policy = policy
+        if policy != ErrorPolicy.OFF:
+            self.check_error_now(stop)
+
+    def _read_errors(self, stb: int, stop: bool) -> None:
+        """Print the error queue if the status byte reports errors."""
+        commands = list(self._sent)
+        self._sent.clear()
+        if (stb & 0x4):
+            errors = []
+            severe = False
             while 1:
-                err = self.err_n()
+                err = self._txrx_now('SYST:ERR:NEXT?')
                 if (err.startswith('0,')):
                     break
                 print(err)
+                errors.append(err)
                 n = err.split(",")
-                if (len(n) > 0 and stop and int(n[0]) > 9500):
-                    exit(1)
+                if (len(n) > 0 and int(n[0]) > 9500):
+                    severe = True
+            if severe and stop:
+                raise ScpiError(errors, commands, self.host)
+
+    @contextmanager
+    def batch(self):
+        """Queue commands and queries and send them with a single ``sendall``.
+
+        Inside the ``with`` block ``tx_txt`` only queues the command and ``txrx_txt``
+        returns a ``BatchReply`` whose ``result()`` is available after the block.
+        Error checks requested inside the block are merged into one ``*STB?`` sent
+        with the batch. Batches can be nested, only the outermost one is flushed.
+        Binary reads (``rx_arb``, ``acq_data``) have to be done outside of a batch.
+
+        Example:
+            with rp.batch():
+                rp.gen_set(1, freq=1000)
+                func = rp.txrx_txt("SOUR1:FUNC?")
+            print(func.result())
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self._batch_cmds.clear()
+                self._batch_replies.clear()
+                self._batch_check = self._batch_stop = False
+            raise
+        self._batch_depth -= 1
+        if not self._batch_depth:
+            self.flush()
+
+    def flush(self) -> None:
+        """Send all queued commands in one message and fill the answers of queued queries in order."""
+        check, stop = self._batch_check, self._batch_stop
+        if check:
+            self._batch_cmds.append('*STB?')
+            self._batch_replies.append(BatchReply('*STB?'))
+        if not self._batch_cmds:
+            return
+
+        cmds, replies = self._batch_cmds, self._batch_replies
+        self._batch_cmds, self._batch_replies = [], []
+        self._batch_check = self._batch_stop = False
+
+        self._send(cmds)
+        for reply in replies:
+            if reply is not None:
+                reply._set(self.rx_txt())
+
+        if check:
+            self._read_errors(int(replies[-1].result()), stop)
+
+    def enable_stats(self) -> ScpiStats:
+        """Start recording per-command latency and throughput statistics and return them.
+        The time to open the connection is recorded as section 'connect', also for reconnects."""
+        self.stats = ScpiStats()
+        if self.connect_time is not None:
+            self.stats._on_section('connect', self.connect_time)
+        return self.stats
+
+    def disable_stats(self) -> Optional[ScpiStats]:
+        """Stop recording statistics and return the recorded ones."""
+        stats, self.stats = self.stats, None
+        return stats
+
+    @contextmanager
+    def timed(self, name: str):
+        """Record the duration of the block as section ``name`` in the statistics.
+        Does nothing while statistics are disabled.
+
+        Example:
+            with rp.timed('settle'):
+                time.sleep(1)
+        """
+        if self.stats is None:
+            yield
+            return
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.stats is not None:
+                self.stats._on_section(name, time.perf_counter() - t)
 
 
     ###########################################
@@ -337,11 +940,14 @@ class scpi (object):
     ) -> np.ndarray:
         """
         Return data from all 4 slow analog inputs as a numpy array.
+        The four queries and the error check are sent together (one round trip).
         """
-        data = np.array([self.txrx_txt(f"ANALOG:PIN? AIN{i}") for i in range(4)], dtype=float)
-        self.check_error()
+        assert not self._batch_depth, "analog_get_data() can not be used inside a batch"
+        with self.batch():
+            replies = [self.txrx_txt(f"ANALOG:PIN? AIN{i}") for i in range(4)]
+            self.check_error()
 
-        return data
+        return np.array([reply.result() for reply in replies], dtype=float)
 
     ### DAISY CHAIN ###
 
@@ -551,34 +1157,10 @@ class scpi (object):
         """
         self._validate_gen_set_params(chan, func, volt, freq, offset, phase, dcyc, data, trig_sour, ext_trig_deb_us, ext_trig_lev, load, sdrlab, siglab)
 
-        # Load needs to be set before the amplitude
-        if siglab:
-            if ext_trig_lev is not None:
-                self.tx_txt(f"TRig:EXT:LEV {ext_trig_lev}")
-            if load is not None:
-                self.tx_txt(f"SOUR{chan}:LOAD {load.value}")
-
-        self.tx_txt(f"SOUR{chan}:FUNC {func.value}")
-        self.tx_txt(f"SOUR{chan}:VOLT {volt}")
-
-        if func not in {Waveform.DC, Waveform.DC_NEG}:
-            self.tx_txt(f"SOUR{chan}:FREQ:FIX {freq}")
-
-        if offset is not None:
-            self.tx_txt(f"SOUR{chan}:VOLT:OFFS {offset}")
-        if phase is not None:
-            self.tx_txt(f"SOUR{chan}:PHAS {phase}")
-        if func == Waveform.PWM and dcyc is not None:
-            self.tx_txt(f"SOUR{chan}:DCYC {dcyc}")
-        if data is not None and func == Waveform.ARBITRARY:
-            cust_wf = ",".join(map(str, data))
-            self.tx_txt(f"SOUR{chan}:TRAC:DATA:DATA {cust_wf}")
-        if trig_sour is not None:
-            self.tx_txt(f"SOUR{chan}:TRig:SOUR {trig_sour.value}")
-        if ext_trig_deb_us is not None:
-            self.tx_txt(f"SOUR:TRig:EXT:DEBouncer:US {ext_trig_deb_us}")
-
-        self.check_error()
+        with self.batch():
+            for cmd in self._gen_set_cmds(chan, func, volt, freq, offset, phase, dcyc, data, trig_sour, ext_trig_deb_us, ext_trig_lev, load, siglab):
+                self.tx_txt(cmd)
+            self.check_error()
 
     def gen_get_settings(self, chan: int, siglab: bool = False) -> List[str | None]:
         """
@@ -798,14 +1380,15 @@ class scpi (object):
 
         self._validate_sweep_params(chan, start_freq, stop_freq, time_us, mode, direction, sdrlab)
 
-        self.tx_txt(f"SOUR{chan}:SWeep:STATE ON")
-        self.tx_txt(f"SOUR{chan}:SWeep:FREQ:START {start_freq}")
-        self.tx_txt(f"SOUR{chan}:SWeep:FREQ:STOP {stop_freq}")
-        self.tx_txt(f"SOUR{chan}:SWeep:TIME {time_us}")
-        self.tx_txt(f"SOUR{chan}:SWeep:MODE {mode.value}")
-        self.tx_txt(f"SOUR{chan}:SWeep:DIR {direction.value}")
+        with self.batch():
+            self.tx_txt(f"SOUR{chan}:SWeep:STATE ON")
+            self.tx_txt(f"SOUR{chan}:SWeep:FREQ:START {start_freq}")
+            self.tx_txt(f"SOUR{chan}:SWeep:FREQ:STOP {stop_freq}")
+            self.tx_txt(f"SOUR{chan}:SWeep:TIME {time_us}")
+            self.tx_txt(f"SOUR{chan}:SWeep:MODE {mode.value}")
+            self.tx_txt(f"SOUR{chan}:SWeep:DIR {direction.value}")
 
-        self.check_error()
+            self.check_error()
 
     def gen_get_sweep_settings(self, chan: int) -> List[str | None]:
         """
@@ -880,6 +1463,57 @@ class scpi (object):
         self.check_error()
 
 
+    # Commands
+    def _gen_set_cmds(
+        self,
+        chan: int,
+        func: Waveform,
+        volt: float,
+        freq: float,
+        offset: Optional[float],
+        phase: Optional[float],
+        dcyc: Optional[float],
+        data: Optional[np.ndarray],
+        trig_sour: Optional[TriggerSource],
+        ext_trig_deb_us: Optional[int],
+        ext_trig_lev: Optional[float],
+        load: Optional[Load],
+        siglab: bool
+    ) -> List[str]:
+        """
+        Return the SCPI commands sent by gen_set function.
+        """
+        cmds = []
+
+        # Load needs to be set before the amplitude
+        if siglab:
+            if ext_trig_lev is not None:
+                cmds.append(f"TRig:EXT:LEV {ext_trig_lev}")
+            if load is not None:
+                cmds.append(f"SOUR{chan}:LOAD {load.value}")
+
+        cmds.append(f"SOUR{chan}:FUNC {func.value}")
+        cmds.append(f"SOUR{chan}:VOLT {volt}")
+
+        if func not in {Waveform.DC, Waveform.DC_NEG}:
+            cmds.append(f"SOUR{chan}:FREQ:FIX {freq}")
+
+        if offset is not None:
+            cmds.append(f"SOUR{chan}:VOLT:OFFS {offset}")
+        if phase is not None:
+            cmds.append(f"SOUR{chan}:PHAS {phase}")
+        if func == Waveform.PWM and dcyc is not None:
+            cmds.append(f"SOUR{chan}:DCYC {dcyc}")
+        if data is not None and func == Waveform.ARBITRARY:
+            cust_wf = ",".join(map(str, data))
+            cmds.append(f"SOUR{chan}:TRAC:DATA:DATA {cust_wf}")
+        if trig_sour is not None:
+            cmds.append(f"SOUR{chan}:TRig:SOUR {trig_sour.value}")
+        if ext_trig_deb_us is not None:
+            cmds.append(f"SOUR:TRig:EXT:DEBouncer:US {ext_trig_deb_us}")
+
+        return cmds
+
     # Validations
     def _validate_gen_set_params(
         self,
@@ -1048,21 +1682,10 @@ class scpi (object):
 
         #!!!!! n = 4 if input4 else 2
 
-        self.tx_txt(f"ACQ:DEC:Factor {dec}")
-        self.tx_txt(f"ACQ:AVG {'ON' if averaging else 'OFF'}")
-        if units is not None:
-            self.tx_txt(f"ACQ:DATA:Units {units.value}")
-        if data_format is not None:
-            self.tx_txt(f"ACQ:DATA:FORMAT {data_format.value}")
-
-        if gain is not None:
-            for i, g in enumerate(gain, start=1):
-                self.tx_txt(f"ACQ:SOUR{i}:GAIN {g.value}")
-        if coupling is not None and siglab:
-            for i, c in enumerate(coupling, start=1):
-                self.tx_txt(f"ACQ:SOUR{i}:COUP {c.value}")
-
-        self.check_error()
+        with self.batch():
+            for cmd in self._acq_set_cmds(dec, units, data_format, averaging, gain, coupling, siglab):
+                self.tx_txt(cmd)
+            self.check_error()
 
     def acq_get_settings(self, siglab: bool = False, input4: bool = False) -> List[str | None]:
         """
@@ -1142,6 +1765,168 @@ class scpi (object):
         self.tx_txt("ACQ:STOP")
         self.check_error()
 
+    def acq_reset(self) -> None:
+        """
+        Stops the acquisition and sets all acquisition parameters to their default values.
+        """
+        self.tx_txt("ACQ:RST")
+        self.check_error()
+
+    def refresh(self) -> None:
+        """
+        Reads the acquisition units and data format from Red Pitaya into the shadow copy
+        used by ``acq_data()``. Only needed if the settings were changed by another client.
+        """
+        with self.batch():
+            units = self.txrx_txt("ACQ:DATA:Units?")
+            data_format = self.txrx_txt("ACQ:DATA:FORMAT?")
+        self._acq_state['units'] = units.result().upper()
+        self._acq_state['data_format'] = data_format.result().upper()
+
+    @property
+    def data_format(self) -> Optional[str]:
+        """
+        Acquisition data format ('ASCII' or 'BIN') from the shadow copy, None if unknown (see ``refresh()``).
+        """
+        return self._acq_state['data_format']
+
+    def _update_acq_state(self, msg: str) -> None:
+        """
+        Keep the acquisition shadow copy in line with a command sent to Red Pitaya.
+        """
+        head = msg[:32].upper()
+        if head.startswith('ACQ:RST'):
+            self._acq_state.update(units='VOLTS', data_format='ASCII')
+            self._acq_timing.update(dec=1, trig_delay=0)
+        elif head.startswith('ACQ:DATA:UNITS '):
+            self._acq_state['units'] = msg.split()[1].upper()
+        elif head.startswith('ACQ:DATA:FORMAT '):
+            self._acq_state['data_format'] = msg.split()[1].upper()
+        elif head.startswith('*RST'):
+            self._acq_state.update(units=None, data_format=None)
+        elif head.startswith(('ACQ:DEC ', 'ACQ:DEC:FACTOR ', 'ACQ:AXI:DEC ')):
+            self._acq_timing['dec'] = int(msg.split()[1])
+        elif head.startswith('ACQ:TRIG:DLY '):
+            self._acq_timing['trig_delay'] = int(msg.split()[1])
+        elif head.startswith('ACQ:TRIG:DLY:NS '):
+            self._acq_timing['trig_delay'] = round(float(msg.split()[1]) * 1e-9 * ADC_RATE / self._acq_timing['dec'])
+        elif head.startswith('ACQ:AXI:SOUR') and head.split()[0].endswith(':TRIG:DLY'):
+            self._acq_timing['axi_delay'] = int(msg.split()[1])
+
+    # Acq wait
+    def capture_time(self, samples: Optional[int] = None, dec: Optional[int] = None) -> float:
+        """
+        Returns the time in seconds to record ``samples`` samples (default: the whole buffer)
+        at decimation ``dec`` (default: the last decimation sent).
+        """
+        if samples is None:
+            samples = BUFFER_SIZE
+        if dec is None:
+            dec = self._acq_timing['dec']
+        return samples * dec / ADC_RATE
+
+    def wait_until(
+        self,
+        predicate,
+        timeout: Optional[float] = None,
+        expected: float = 0.0,
+        name: str = 'wait'
+    ) -> float:
+        """
+        Polls ``predicate()`` until it returns True and returns the time waited in seconds.
+
+        The first poll is sent right away. Within the ``expected`` time the next poll is
+        scheduled at the expected end, afterwards the interval starts at a tenth of the
+        expected time and grows by 1.5 up to 100 ms, so short captures are picked up within
+        about a millisecond without flooding Red Pitaya with queries during long ones.
+        The time waited is recorded as section ``name`` in the statistics.
+
+        Parameters
+        ----------
+            predicate (callable) :
+                Function without arguments, usually sending a query, that returns True when done.
+            timeout (float, optional) :
+                Raise ``TimeoutError`` after this many seconds.
+                Defaults to None (wait forever).
+            expected (float, optional) :
+                Expected waiting time in seconds, e.g. from ``capture_time()``.
+                Defaults to 0.
+            name (str, optional) :
+                Name used in the statistics and error message.
+                Defaults to 'wait'.
+        """
+        t0 = time.perf_counter()
+        interval = min(max(expected / 10, 0.001), 0.1)
+        while not predicate():
+            elapsed = time.perf_counter() - t0
+            if timeout is not None and elapsed >= timeout:
+                raise TimeoutError(f"SCPI >> {self.host}: {name} timed out after {elapsed:.3f} s")
+            if elapsed < expected:
+                delay = max(expected - elapsed, 0.001)
+            else:
+                delay = interval
+                interval = min(interval * 1.5, 0.1)
+            if timeout is not None:
+                delay = min(delay, timeout - elapsed)
+            time.sleep(delay)
+
+        waited = time.perf_counter() - t0
+        if self.stats is not None:
+            self.stats._on_section(name, waited)
+        return waited
+
+    def _post_trigger(self) -> int:
+        # ACQ:TRig:DLY counts from the middle of the buffer, DLY 0 records 8192 samples after the trigger.
+        return max(self._acq_timing['trig_delay'] + BUFFER_SIZE // 2, 0)
+
+    def wait_triggered(self, timeout: Optional[float] = None) -> float:
+        """
+        Waits until the acquisition has triggered (``ACQ:TRig:STAT?`` returns TD) and returns
+        the time waited. The trigger is expected once the samples before the trigger position
+        are recorded, an edge trigger may take longer depending on the signal.
+        """
+        pre = max(BUFFER_SIZE - self._post_trigger(), 0)
+        return self.wait_until(lambda: self._txrx_now('ACQ:TRig:STAT?') == 'TD', timeout,
+                               self.capture_time(pre), 'wait_triggered')
+
+    def wait_filled(self, timeout: Optional[float] = None, axi: bool = False, chan: int = 1) -> float:
+        """
+        Waits until the buffer is filled after the trigger (``ACQ:TRig:FILL?``, or
+        ``ACQ:AXI:SOUR<chan>:TRig:FILL?`` with ``axi``) and returns the time waited.
+        """
+        if axi:
+            query = f'ACQ:AXI:SOUR{chan}:TRig:FILL?'
+            post = self._acq_timing['axi_delay']
+        else:
+            query = 'ACQ:TRig:FILL?'
+            post = self._post_trigger()
+        return self.wait_until(lambda: self._txrx_now(query) == '1', timeout,
+                               self.capture_time(post), 'wait_filled')
+
+    def wait_opc(self, timeout: Optional[float] = None) -> float:
+        """
+        Waits until Red Pitaya has completed all pending operations (``*OPC?``)
+        and returns the time waited. Raises ``TimeoutError`` after ``timeout`` seconds,
+        the late answer is dropped before the next read.
+        """
+        assert not self._batch_depth, "wait_opc() can not be used inside a batch"
+        t0 = time.perf_counter()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        previous = self._socket.gettimeout()
+        self.tx_txt('*OPC?')
+        try:
+            self.rx_txt(deadline=deadline)
+        except socket.timeout:
+            raise TimeoutError(f"SCPI >> {self.host}: wait_opc timed out after {time.perf_counter() - t0:.3f} s") from None
+        finally:
+            if self._socket is not None:
+                self._socket.settimeout(previous)
+
+        waited = time.perf_counter() - t0
+        if self.stats is not None:
+            self.stats._on_section('wait_opc', waited)
+        return waited
+
     # Acq trigger
     def acq_trig_set(
         self,
@@ -1194,23 +1979,10 @@ class scpi (object):
         """
         self._validate_acq_trig_params(trig_lvl, trig_delay, trig_hyst, ext_trig_deb_us, ext_trig_lvl, siglab, input4)
 
-        if trig_delay_ns:
-            self.tx_txt(f"ACQ:TRig:DLY:NS {trig_delay}")
-        else:
-            self.tx_txt(f"ACQ:TRig:DLY {trig_delay}")
-
-        if trig_hyst is not None:
-            self.tx_txt(f"ACQ:TRig:HYST {trig_hyst}")
-
-        if ext_trig_deb_us is not None:
-            self.tx_txt(f"ACQ:TRig:EXT:DEBouncer:US {ext_trig_deb_us}")
-
-        self.tx_txt(f"ACQ:TRig:LEV {trig_lvl}")
-
-        if siglab and ext_trig_lvl is not None:
-            self.tx_txt(f"TRig:EXT:LEV {ext_trig_lvl}")
-
-        self.check_error()
+        with self.batch():
+            for cmd in self._acq_trig_set_cmds(trig_lvl, trig_delay, trig_delay_ns, trig_hyst, ext_trig_deb_us, ext_trig_lvl, siglab):
+                self.tx_txt(cmd)
+            self.check_error()
 
     def acq_get_trig_settings(self, siglab: bool = False) -> List[str | None]:
         """
@@ -1471,6 +2243,10 @@ class scpi (object):
             - lat and n          => returns 'n' latest samples in the buffer
             - trig_pos and n     => returns 'n' samples around trigger position (depends on setting)
 
+        Units and data format are taken from the shadow copy kept up to date by ``acq_set()``,
+        ``acq_set_units_format()`` and ``acq_reset()``, so no extra queries are sent.
+        Call ``refresh()`` if another client changed these settings.
+
         Parameters
         ----------
             chan (int) :
@@ -1507,43 +2283,327 @@ class scpi (object):
             np.ndarray:
                 Numpy array with captured data.
         """
+        assert not self._batch_depth, "acq_data() reads the answer right away and can not be used inside a batch"
         self._validate_acq_data_params(chan, start, end, num_samples, old, last, trig_pos, input4)
 
+        # Data type from the shadow copy, asked from Red Pitaya only if unknown
+        if None in self._acq_state.values():
+            self.refresh()
+        units = self._acq_state['units']
+        data_format = self._acq_state['data_format']
+
+        self.tx_txt(self._acq_data_query(chan, start, end, num_samples, old, last, trig_pos))
+
+        # Convert data
+        data = self.rx_arb() if data_format == "BIN" else self.rx_txt()
+        with self.timed('parse'):
+            buff = self._acq_data_convert(units, data_format, data)
+
+        return buff
+
+    def acq_data_multi(
+        self,
+        chans: Sequence[int] = (1, 2),
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        num_samples: Optional[int] = None,
+        old: bool = False,
+        last: bool = False,
+        trig_pos: Optional[DataTriggerPosition] = None,
+        axi: bool = False,
+        units: Optional[Units] = None,
+        input4: bool = False
+    ) -> np.ndarray:
+        """
+        Returns the acquired data of several channels. The data queries of all channels are
+        sent in one message and the answers are read into one preallocated array, so reading
+        both inputs costs one round trip instead of one per channel.
+
+        The buffer selection is the same as for ``acq_data()`` and applies to every channel.
+        With ``axi`` the deep memory (DMA) buffers ``ACQ:AXI:SOUR<n>`` are read instead:
+        ``num_samples`` samples from ``start``, or from the trigger position of every channel
+        if ``start`` is None (one extra round trip for all ``Trig:Pos?`` queries).
+
+        Parameters
+        ----------
+            chans (Sequence[int], optional) :
+                Input acquisition channels.
+                (1,2,3, or 4 for STEMlab 125-14 4-Input).
+                Defaults to (1, 2).
+            start, end, num_samples, old, last, trig_pos :
+                Buffer selection, see ``acq_data()``.
+            axi (bool, optional) :
+                Read the deep memory buffers. Requires `num_samples`.
+                Defaults to False.
+            units (Units, optional) :
+                Units of the returned data. Defaults to the shadow copy for the standard
+                buffer and to VOLTS (as set with ACQ:AXI:DATA:Units) for the deep memory.
+            input4 (bool, optional) :
+                Set to True if operating with STEMlab 125-14 4-Input.
+                Defaults to False.
+
+        Returns
+        -------
+            np.ndarray:
+                (len(chans), n_samples) array in native byte order, one row per channel
+                (float32 for binary VOLTS, int16 for binary RAW, float64 for ASCII).
+        """
+        assert not self._batch_depth, "acq_data_multi() reads the answers right away and can not be used inside a batch"
+        self._validate_acq_data_multi_params(chans, start, end, num_samples, old, last, trig_pos, axi, input4)
+
+        # Data type from the shadow copy, asked from Red Pitaya only if unknown
+        if None in self._acq_state.values():
+            self.refresh()
+        data_format = self._acq_state['data_format']
+        if units is not None:
+            units = units.value
+        else:
+            units = "VOLTS" if axi else self._acq_state['units']
+
+        if axi:
+            starts = [start] * len(chans)
+            if start is None:
+                with self.batch():
+                    pos = [self.txrx_txt(f"ACQ:AXI:SOUR{chan}:Trig:Pos?") for chan in chans]
+                starts = [int(p.result()) for p in pos]
+            queries = [f"ACQ:AXI:SOUR{chan}:DATA:Start:N? {s},{num_samples}" for chan, s in zip(chans, starts)]
+        else:
+            queries = [self._acq_data_query(chan, start, end, num_samples, old, last, trig_pos) for chan in chans]
+
+        with self.batch():
+            for query in queries:
+                self.tx_txt(query)
+
+        # Convert data
+        if data_format == "BIN":
+            return self._rx_arb_rows(len(chans), '>f4' if units == "VOLTS" else '>i2')
+
+        buff = None
+        for i in range(len(chans)):
+            data = self.rx_txt()
+            with self.timed('parse'):
+                row = self._acq_data_convert(units, data_format, data)
+            if buff is None:
+                buff = np.empty((len(chans), row.size))
+            buff[i] = row
+        return buff
+
+    # Deep memory streaming
+    def acq_axi_stream(
+        self,
+        chans: Sequence[int] = (1, 2),
+        num_samples: int = BUFFER_SIZE,
+        start: Optional[int] = None,
+        block_size: int = 1024 * 1024,
+        readahead: int = 4,
+        units: Units = Units.VOLTS,
+        buffer_samples: Optional[int] = None,
+        out: Optional[np.ndarray] = None
+    ):
+        """
+        Reads a long capture from the deep memory (DMA) buffers ``ACQ:AXI:SOUR<n>`` in binary
+        blocks and yields them as ``(offset, block)`` with ``block`` of shape (len(chans), n).
+
+        Up to ``readahead`` block requests are kept in flight: the next request is sent
+        before a block is handed to the caller, so the transfer continues while the caller
+        processes the data. Host memory stays bounded to about ``readahead`` blocks.
+        Switches the data format to binary.
+
+        Parameters
+        ----------
+            chans (Sequence[int], optional) :
+                Input channels (1 and/or 2). Defaults to (1, 2).
+            num_samples (int, optional) :
+                Samples per channel. Defaults to 16384.
+            start (int, optional) :
+                First sample in the buffers. Defaults to the trigger position of every channel.
+            block_size (int, optional) :
+                Samples per channel and block. Defaults to 1 Mi.
+            readahead (int, optional) :
+                Number of block requests in flight. Defaults to 4.
+            units (Units, optional) :
+                Units set with ACQ:AXI:DATA:Units. Defaults to VOLTS.
+            buffer_samples (int, optional) :
+                Size of the channel buffers in samples (SET:Buffer size / 2).
+                If given, positions wrap around at the end of the buffer.
+            out (np.ndarray, optional) :
+                (len(chans), num_samples) array, e.g. a memory-mapped ``.npy`` file.
+                The blocks are received straight into it and yielded as views.
+        """
+        assert not self._batch_depth, "acq_axi_stream() reads the answers right away and can not be used inside a batch"
+        self._validate_acq_data_multi_params(chans, start, None, num_samples, False, False, None, True, False)
+        assert block_size > 0 and readahead > 0, "block_size and readahead have to be positive"
+        if out is not None:
+            assert out.shape == (len(chans), num_samples), f"out has to have the shape {(len(chans), num_samples)}"
+
+        if self._acq_state['data_format'] != "BIN":
+            self.tx_txt("ACQ:DATA:FORMAT BIN")
+        if start is None:
+            with self.batch():
+                pos = [self.txrx_txt(f"ACQ:AXI:SOUR{chan}:Trig:Pos?") for chan in chans]
+            starts = [int(p.result()) for p in pos]
+        else:
+            starts = [start] * len(chans)
+        wire = '>f4' if units == Units.VOLTS else '>i2'
+
+        blocks = [(offset, min(block_size, num_samples - offset)) for offset in range(0, num_samples, block_size)]
+
+        def request(k):
+            offset, n = blocks[k]
+            with self.batch():
+                for chan, s in zip(chans, starts):
+                    position = s + offset if buffer_samples is None else (s + offset) % buffer_samples
+                    self.tx_txt(f"ACQ:AXI:SOUR{chan}:DATA:Start:N? {position},{n}")
+
+        sent = received = 0
+        try:
+            while sent < min(readahead, len(blocks)):
+                request(sent)
+                sent += 1
+            for offset, n in blocks:
+                block = self._rx_arb_rows(len(chans), wire, None if out is None else out[:, offset:offset + n])
+                received += 1
+                if sent < len(blocks):
+                    request(sent)
+                    sent += 1
+                yield offset, block
+        finally:
+            # Read the answers still in flight if the caller stopped early
+            for _ in range(sent - received):
+                self._rx_arb_rows(len(chans), wire)
+
+    def acq_axi_save(
+        self,
+        path: str,
+        chans: Sequence[int] = (1, 2),
+        num_samples: int = BUFFER_SIZE,
+        **kwargs
+    ) -> np.ndarray:
+        """
+        Streams a deep memory capture straight into a memory-mapped ``.npy`` file of shape
+        (len(chans), num_samples) and returns the memory map. The capture never has to fit
+        into host memory. Further arguments as for ``acq_axi_stream()``.
+
+        Example:
+            IN = rp.acq_axi_save('data/IN_AXI.npy', num_samples=32 * 1024 * 1024)
+            IN = np.load('data/IN_AXI.npy', mmap_mode='r')      # later
+        """
+        units = kwargs.get('units', Units.VOLTS)
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32 if units == Units.VOLTS else np.int16,
+                                        shape=(len(chans), num_samples))
+        for _ in self.acq_axi_stream(chans, num_samples, out=out, **kwargs):
+            pass
+        out.flush()
+        return out
+
+    # Commands
+    def _acq_set_cmds(
+        self,
+        dec: int,
+        units: Optional[Units],
+        data_format: Optional[DataFormat],
+        averaging: bool,
+        gain: Optional[List[Gain]],
+        coupling: Optional[List[Coupling]],
+        siglab: bool
+    ) -> List[str]:
+        """
+        Return the SCPI commands sent by acq_set function.
+        """
+        cmds = []
+
+        cmds.append(f"ACQ:DEC:Factor {dec}")
+        cmds.append(f"ACQ:AVG {'ON' if averaging else 'OFF'}")
+        if units is not None:
+            cmds.append(f"ACQ:DATA:Units {units.value}")
+        if data_format is not None:
+            cmds.append(f"ACQ:DATA:FORMAT {data_format.value}")
+
+        if gain is not None:
+            for i, g in enumerate(gain, start=1):
+                cmds.append(f"ACQ:SOUR{i}:GAIN {g.value}")
+        if coupling is not None and siglab:
+            for i, c in enumerate(coupling, start=1):
+                cmds.append(f"ACQ:SOUR{i}:COUP {c.value}")
+
+        return cmds
+
+    def _acq_trig_set_cmds(
+        self,
+        trig_lvl: float,
+        trig_delay: int,
+        trig_delay_ns: bool,
+        trig_hyst: Optional[float],
+        ext_trig_deb_us: Optional[int],
+        ext_trig_lvl: Optional[float],
+        siglab: bool
+    ) -> List[str]:
+        """
+        Return the SCPI commands sent by acq_trig_set function.
+        """
+        cmds = []
+
+        if trig_delay_ns:
+            cmds.append(f"ACQ:TRig:DLY:NS {trig_delay}")
+        else:
+            cmds.append(f"ACQ:TRig:DLY {trig_delay}")
+
+        if trig_hyst is not None:
+            cmds.append(f"ACQ:TRig:HYST {trig_hyst}")
+
+        if ext_trig_deb_us is not None:
+            cmds.append(f"ACQ:TRig:EXT:DEBouncer:US {ext_trig_deb_us}")
+
+        cmds.append(f"ACQ:TRig:LEV {trig_lvl}")
+
+        if siglab and ext_trig_lvl is not None:
+            cmds.append(f"TRig:EXT:LEV {ext_trig_lvl}")
+
+        return cmds
+
+    def _acq_data_query(
+        self,
+        chan: int,
+        start: Optional[int],
+        end: Optional[int],
+        num_samples: Optional[int],
+        old: bool,
+        last: bool,
+        trig_pos: Optional[DataTriggerPosition]
+    ) -> str:
+        """
+        Return the data query sent by acq_data function.
+        """
         # Determine the output data
         if start is not None and end is not None:
-            self.tx_txt(f"ACQ:SOUR{chan}:DATA:STArt:End? {start},{end}")
+            return f"ACQ:SOUR{chan}:DATA:STArt:End? {start},{end}"
         elif start is not None and num_samples is not None:
-            self.tx_txt(f"ACQ:SOUR{chan}:DATA:STArt:N? {start},{num_samples}")
+            return f"ACQ:SOUR{chan}:DATA:STArt:N? {start},{num_samples}"
         elif old and num_samples is not None:
-            self.tx_txt(f"ACQ:SOUR{chan}:DATA:Old:N? {num_samples}")
+            return f"ACQ:SOUR{chan}:DATA:Old:N? {num_samples}"
         elif last and num_samples is not None:
-            self.tx_txt(f"ACQ:SOUR{chan}:DATA:LATest:N? {num_samples}")
+            return f"ACQ:SOUR{chan}:DATA:LATest:N? {num_samples}"
         elif trig_pos is not None and num_samples is not None:
-            self.tx_txt(f"ACQ:SOUR{chan}:DATA:TRig? {num_samples},{trig_pos.value}")
+            return f"ACQ:SOUR{chan}:DATA:TRig? {num_samples},{trig_pos.value}"
         else:
-            self.tx_txt(f"ACQ:SOUR{chan}:DATA?")
-
-        # Get data type from Red Pitaya
-        units = self.txrx_txt('ACQ:DATA:Units?')
-        data_format = self.txrx_txt("ACQ:DATA:FORMAT?")
-        self.check_error()
+            return f"ACQ:SOUR{chan}:DATA?"
 
-        #! Check if data_format is correct
-        # Convert data
+    def _acq_data_convert(
+        self,
+        units: str,
+        data_format: str,
+        data: Union[str, bytearray]
+    ) -> np.ndarray:
+        """
+        Convert the answer of a data query to a numpy array.
+        """
         if data_format == "BIN":
-            buff_byte = self.rx_arb()
             if units == "VOLTS":
-                buff = np.frombuffer(buff_byte, dtype='>f4')
-                #buff = [struct.unpack('!f',bytearray(buff_byte[i:i+4]))[0] for i in range(0, len(buff_byte), 4)]
+                return np.frombuffer(data, dtype='>f4')
             elif units == "RAW":
-                buff = np.frombuffer(buff_byte, dtype='>i2')
-                #buff = [struct.unpack('!h',bytearray(buff_byte[i:i+2]))[0] for i in range(0, len(buff_byte), 2)]
-        else:
-            buff_string = self.rx_txt().strip('{}\n\r').replace("  ", "").split(',')
-            buff = np.array(buff_string).astype(np.float64)
-        self.check_error()
-
-        return buff
+                return np.frombuffer(data, dtype='>i2')
+        buff_string = data.strip('{}\n\r').replace("  ", "").split(',')
+        return np.array(buff_string).astype(np.float64)
 
     # Validations
     def _validate_acq_set_params(
@@ -1565,7 +2625,7 @@ class scpi (object):
         units_list = [e.value for e in Units]
         format_list = [e.value for e in DataFormat]
 
-        assert (dec not in dec_fact_list) and (16 <= dec <= 65536), "Decimation factor out of range [1,2,4,8,16,17,18,...,65536]"
+        assert (dec not in dec_fact_list) and (1 <= dec <= 65536), "Decimation factor out of range [1,2,4,8,16,17,18,...,65536]"
         if units is not None:
             assert units.value in units_list, f"{units.value} is not a defined unit"
         if data_format is not None:
@@ -1607,7 +2667,7 @@ class scpi (object):
         """
         Validate parameters for acq_trig_set function.
         """
-        trig_lvl_lim = 20.0 if any(self.txrx_txt(f"ACQ:SOUR{i+1}:GAIN?").upper() == "HV" for i in range(4 if input4 else 2)) else 1.0
+        trig_lvl_lim = 20.0 if any(self._txrx_now(f"ACQ:SOUR{i+1}:GAIN?").upper() == "HV" for i in range(4 if input4 else 2)) else 1.0
         ext_trig_lvl_limit = 5.0
 
         assert abs(trig_lvl) <= trig_lvl_lim, f"Trigger level out of range {-trig_lvl_lim, trig_lvl_lim} V"
@@ -1659,7 +2719,7 @@ class scpi (object):
         n = 4 if input4 else 2
 
         assert chan <= n, f"Channel {chan} out of range for the current Red Pitaya board"
-        assert (dec not in dec_fact_list) and (16 <= dec <= 65536), "Decimation factor out of range [1,2,4,8,16,17,18,...,65536]"
+        assert (dec not in dec_fact_list) and (1 <= dec <= 65536), "Decimation factor out of range [1,2,4,8,16,17,18,...,65536]"
         if gain is not None:
             assert gain.value in gain_list, f"{gain.value} is not a defined gain"
         if siglab and coupling is not None:
@@ -1682,7 +2742,7 @@ class scpi (object):
 
         assert chan <= n, f"Channel {chan} out of range for the current Red Pitaya board"
 
-        gain = self.txrx_txt(f"ACQ:SOUR{chan}:GAIN?")
+        gain = self._txrx_now(f"ACQ:SOUR{chan}:GAIN?")
         if gain.upper() == "HV":
             trig_lvl_lim = 20.0
             gain_lvl = "HV"
@@ -1721,6 +2781,30 @@ class scpi (object):
                 if trig_pos == DataTriggerPosition.PRE_POST_TRIG:
                     assert num_samples * 2 + 1 <= up_lim, f"Sample number is too big for {trig_pos.value} setting. This mode returns num_samples*2 +1 data samples."
 
+    def _validate_acq_data_multi_params(
+        self,
+        chans: Sequence[int],
+        start: Optional[int],
+        end: Optional[int],
+        num_samples: Optional[int],
+        old: bool,
+        last: bool,
+        trig_pos: Optional[DataTriggerPosition],
+        axi: bool,
+        input4: bool
+    ) -> None:
+        """
+        Validate parameters for acq_data_multi function.
+        """
+        assert len(chans) > 0, "Select at least one channel"
+        if axi:
+            assert num_samples is not None and num_samples > 0, "Reading the deep memory buffers requires num_samples"
+            for chan in chans:
+                assert chan in (1, 2), f"Channel {chan} has no deep memory buffer"
+        else:
+            for chan in chans:
+                self._validate_acq_data_params(chan, start, end, num_samples, old, last, trig_pos, input4)
+
     def _validate_board(self, siglab: bool, input4: bool) -> None:
         """
         Validate board model.
@@ -0,0 +1,291 @@
+"""
+Provides asyncio SCPI access to Red Pitaya from host computer.
+
+Several boards can be driven from one event loop, for example:
+
+    async def measure(ip):
+        async with AsyncScpi(ip) as rp:
+            await rp.gen_set(1, freq=1000, volt=0.5)
+            await rp.tx_txt('OUTPUT1:STATE ON')
+            await rp.acq_start()
+            await rp.wait_triggered(timeout=5)
+            return await rp.acq_data(1)
+
+    data = await asyncio.gather(*(measure(ip) for ip in LABDESK.values()))
+"""
+
+import asyncio
+from collections import deque
+from typing import List, Optional, Sequence
+import numpy as np
+
+from redpitaya_scpi import (scpi, ScpiError, Waveform, TriggerSource, Load, Units, DataFormat, Gain, Coupling,
+                            DataTriggerPosition)
+
+
+class AsyncScpi (object):
+    """asyncio variant of the ``scpi`` class. Uses one stream connection per board."""
+    delimiter = '\r\n'
+
+    # Parameter validation and command composition are shared with the blocking class
+    _validate_gen_set_params = scpi._validate_gen_set_params
+    _validate_acq_set_params = scpi._validate_acq_set_params
+    _validate_acq_data_params = scpi._validate_acq_data_params
+    _validate_board = scpi._validate_board
+    _gen_set_cmds = scpi._gen_set_cmds
+    _acq_set_cmds = scpi._acq_set_cmds
+    _acq_data_query = scpi._acq_data_query
+    _acq_data_convert = scpi._acq_data_convert
+    _update_acq_state = scpi._update_acq_state
+
+
+    ####################################################
+    ###    Functions for establishing connection     ###
+    ####################################################
+
+    def __init__(self, host: str, timeout: Optional[float]=None, port: int=5000):
+        """Initialize object. The connection is opened with ``connect()`` or ``async with``.
+        Host IP should be a string in parentheses, like '192.168.1.100' or 'rp-xxxxxx.local'.
+        """
+        self.host    = host
+        self.port    = port
+        self.timeout = timeout
+
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()     # keeps command/answer pairs of concurrent tasks together
+        self._sent = deque(maxlen=32)   # commands sent since the last error check (see check_error())
+
+        # Shadow copy of the acquisition data settings (None = unknown, see refresh())
+        self._acq_state = {'units': None, 'data_format': None}
+        self._acq_timing = {'dec': 1, 'trig_delay': 0, 'axi_delay': 0}
+
+    async def connect(self) -> None:
+        """Open IP connection."""
+        # The limit has to hold a complete ASCII capture (~200 KB) for readuntil()
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, limit=2**24), self.timeout)
+
+    async def close(self) -> None:
+        """Close IP connection."""
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+        self._reader = self._writer = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def tx_txt(self, msg: str) -> None:
+        """Send text string ending and append delimiter."""
+        self._update_acq_state(msg)
+        self._record_sent(msg)
+        self._writer.write((msg + self.delimiter).encode('utf-8'))
+        await self._writer.drain()
+
+    async def tx_txt_many(self, msgs: Sequence[str]) -> None:
+        """Send several text strings in one write."""
+        for msg in msgs:
+            self._update_acq_state(msg)
+            self._record_sent(msg)
+        self._writer.write(''.join(msg + self.delimiter for msg in msgs).encode('utf-8'))
+        await self._writer.drain()
+
+    def _record_sent(self, msg: str) -> None:
+        self._sent.append(msg if len(msg) <= 80 else msg[:77] + '...')
+
+    async def rx_txt(self) -> str:
+        """Receive text string and return it after removing the delimiter."""
+        msg = await asyncio.wait_for(self._reader.readuntil(self.delimiter.encode('utf-8')), self.timeout)
+        return msg[:-len(self.delimiter)].decode('utf-8')
+
+    async def rx_arb(self):
+        """Receive binary data from scpi server."""
+        if await self._readexactly(1) != b'#':
+            return False
+        numOfNumBytes = int(await self._readexactly(1))
+        if numOfNumBytes <= 0:
+            return False
+        numOfBytes = int(await self._readexactly(numOfNumBytes))
+        data = await self._readexactly(numOfBytes)
+        await self._readexactly(2)      # recive \r\n
+        return data
+
+    async def _readexactly(self, n: int) -> bytes:
+        return await asyncio.wait_for(self._reader.readexactly(n), self.timeout)
+
+    async def txrx_txt(self, msg: str) -> str:
+        """Send/receive text string."""
+        async with self._lock:
+            await self.tx_txt(msg)
+            return await self.rx_txt()
+
+    async def txrx_txt_many(self, msgs: Sequence[str]) -> List[str]:
+        """Send several queries in one write and return the answers in order."""
+        async with self._lock:
+            await self.tx_txt_many(msgs)
+            return [await self.rx_txt() for _ in msgs]
+
+    async def check_error(self, stop: bool = True) -> None:
+        """Read error from Red Pitaya and print it. Raises ScpiError on severe errors if stop is set,
+        with the commands sent since the last check."""
+        commands = list(self._sent)
+        try:
+            await self._read_errors(commands, stop)
+        finally:
+            self._sent.clear()      # also drops the status queries of this check
+
+    async def _read_errors(self, commands: List[str], stop: bool) -> None:
+        res = int(await self.txrx_txt('*STB?'))
+        if (res & 0x4):
+            errors = []
+            severe = False
+            while 1:
+                err = await self.txrx_txt('SYST:ERR:NEXT?')
+                if (err.startswith('0,')):
+                    break
+                print(err)
+                errors.append(err)
+                n = err.split(",")
+                if (len(n) > 0 and int(n[0]) > 9500):
+                    severe = True
+            if severe and stop:
+                raise ScpiError(errors, commands, self.host)
+
+
+    ###########################################
+    ###       SCPI command functions        ###
+    ###########################################
+
+    ### GENERATOR ###
+
+    async def gen_set(
+        self,
+        chan: int,
+        func: Waveform = Waveform.SINE,
+        volt: float = 1,
+        freq: float = 1000,
+        offset: Optional[float] = None,
+        phase: Optional[float] = None,
+        dcyc: Optional[float] = None,
+        data: Optional[np.ndarray] = None,
+        trig_sour: Optional[TriggerSource] = None,
+        ext_trig_deb_us: Optional[int] = None,
+        ext_trig_lev: Optional[float] = None,
+        load: Optional[Load] = None,
+        sdrlab: bool = False,
+        siglab: bool = False
+    ) -> None:
+        """
+        Set the parameters for signal generator on one channel.
+        Same arguments as ``scpi.gen_set()``, all commands are sent in one write.
+        """
+        self._validate_gen_set_params(chan, func, volt, freq, offset, phase, dcyc, data, trig_sour, ext_trig_deb_us, ext_trig_lev, load, sdrlab, siglab)
+
+        async with self._lock:
+            await self.tx_txt_many(self._gen_set_cmds(chan, func, volt, freq, offset, phase, dcyc, data, trig_sour, ext_trig_deb_us, ext_trig_lev, load, siglab))
+        await self.check_error()
+
+    ### ACQUISITION ###
+
+    async def acq_set(
+        self,
+        dec: int = 1,
+        units: Optional[Units] = None,
+        data_format: Optional[DataFormat] = None,
+        averaging: bool = True,
+        gain: Optional[List[Gain]] = None,
+        coupling: Optional[List[Coupling]] = None,
+        siglab: bool = False,
+        input4: bool = False
+    ) -> None:
+        """
+        Set the parameters for the standard signal acquisition.
+        Same arguments as ``scpi.acq_set()``, all commands are sent in one write.
+        """
+        self._validate_acq_set_params(dec, units, data_format, gain, coupling, siglab, input4)
+
+        async with self._lock:
+            await self.tx_txt_many(self._acq_set_cmds(dec, units, data_format, averaging, gain, coupling, siglab))
+        await self.check_error()
+
+    async def acq_start(self) -> None:
+        """
+        Starts the acquisition.
+        """
+        await self.tx_txt("ACQ:START")
+        await self.check_error()
+
+    async def acq_stop(self) -> None:
+        """
+        Stops the acquisition.
+        """
+        await self.tx_txt("ACQ:STOP")
+        await self.check_error()
+
+    async def acq_reset(self) -> None:
+        """
+        Stops the acquisition and sets all acquisition parameters to their default values.
+        """
+        await self.tx_txt("ACQ:RST")
+        await self.check_error()
+
+    async def refresh(self) -> None:
+        """
+        Reads the acquisition units and data format from Red Pitaya into the shadow copy used by ``acq_data()``.
+        """
+        units, data_format = await self.txrx_txt_many(["ACQ:DATA:Units?", "ACQ:DATA:FORMAT?"])
+        self._acq_state['units'] = units.upper()
+        self._acq_state['data_format'] = data_format.upper()
+
+    async def wait_triggered(self, timeout: Optional[float] = None, interval: float = 0.01) -> None:
+        """
+        Wait until the acquisition has triggered (``ACQ:TRig:STAT?`` returns TD).
+        Other tasks keep running while waiting. Raises ``asyncio.TimeoutError`` after ``timeout`` seconds.
+        """
+        await asyncio.wait_for(self._poll('ACQ:TRig:STAT?', 'TD', interval), timeout)
+
+    async def wait_filled(self, timeout: Optional[float] = None, interval: float = 0.01) -> None:
+        """
+        Wait until the acquisition buffer is filled after the trigger (``ACQ:TRig:FILL?`` returns 1).
+        """
+        await asyncio.wait_for(self._poll('ACQ:TRig:FILL?', '1', interval), timeout)
+
+    async def _poll(self, query: str, expected: str, interval: float) -> None:
+        while await self.txrx_txt(query) != expected:
+            await asyncio.sleep(interval)
+
+    async def acq_data(
+        self,
+        chan: int,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        num_samples: Optional[int] = None,
+        old: bool = False,
+        last: bool = False,
+        trig_pos: Optional[DataTriggerPosition] = None,
+        input4: bool = False
+    ) -> np.ndarray:
+        """
+        Returns the acquired data on a channel from the Red Pitaya.
+        Same arguments as ``scpi.acq_data()``. Units and data format come from the shadow copy.
+        """
+        self._validate_acq_data_params(chan, start, end, num_samples, old, last, trig_pos, input4)
+
+        if None in self._acq_state.values():
+            await self.refresh()
+        units = self._acq_state['units']
+        data_format = self._acq_state['data_format']
+
+        async with self._lock:
+            await self.tx_txt(self._acq_data_query(chan, start, end, num_samples, old, last, trig_pos))
+            if data_format == "BIN":
+                buff = self._acq_data_convert(units, data_format, await self.rx_arb())
+            else:
+                buff = self._acq_data_convert(units, data_format, await self.rx_txt())
+
+        return buff
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmark for binary block transfers (scpi.rx_arb)
+
+A local TCP server answers every query with a '#<n><len>' block of float32
+samples. The legacy receive loop (byte-wise header, 4 KiB bytes concatenation)
+is compared with the buffered recv_into path of scpi.rx_arb.
+
+The legacy loop only runs up to LEGACY_MAX_SAMPLES (1 Mi samples, 4 MiB), the
+64 Mi row shows rx_arb alone. Every 4 KiB chunk copies all bytes received so
+far, so the legacy time grows with the square of the block size: 0.26 s at
+1 Mi and 6.2 s at 4 Mi samples here, a single 256 MiB block did not finish
+within an hour.
+"""
+
+# %% Init
+import socket
+import threading
+import time
+import numpy as np
+import redpitaya_scpi as scpi
+
+SAMPLES = [1024 * 16, 1024 * 1024, 1024 * 1024 * 64]  # 16 Ki, 1 Mi, 64 Mi
+REPEAT = 3
+LEGACY_MAX_SAMPLES = 1024 * 1024  # legacy loop skipped above, see the module docstring
+
+
+# %% Block server
+def serve_blocks(server, payloads):
+    '''Answer each received line with the next binary block.'''
+    conn, _ = server.accept()
+    with conn:
+        reader = conn.makefile('rb')
+        for payload in payloads:
+            if not reader.readline():
+                break
+            size = str(len(payload)).encode()
+            conn.sendall(b'#' + str(len(size)).encode() + size)
+            conn.sendall(payload)
+            conn.sendall(b'\r\n')
+
+
+def legacy_rx_arb(sock):
+    '''Receive loop of rx_arb before the buffered implementation.'''
+    data = b''
+    while len(data) != 1:
+        data = sock.recv(1)
+    if data != b'#':
+        return False
+    data = b''
+
+    while len(data) != 1:
+        data = sock.recv(1)
+    numOfNumBytes = int(data)
+    data = b''
+
+    while len(data) != numOfNumBytes:
+        data += (sock.recv(1))
+    numOfBytes = int(data)
+    data = b''
+
+    while len(data) < numOfBytes:
+        r_size = min(numOfBytes - len(data), 4096)
+        data += (sock.recv(r_size))
+
+    sock.recv(2)
+    return data
+
+
+def run(n_samples, legacy):
+    '''Return the mean transfer time in seconds for one block size.'''
+    payload = np.arange(n_samples, dtype='>f4').tobytes()
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    worker = threading.Thread(target=serve_blocks, args=(server, [payload] * REPEAT), daemon=True)
+    worker.start()
+
+    rp = scpi.scpi('127.0.0.1', port=server.getsockname()[1])
+    times = []
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        rp.tx_txt('ACQ:SOUR1:DATA?')
+        if legacy:
+            buff_byte = legacy_rx_arb(rp._socket)
+        else:
+            buff_byte = rp.rx_arb()
+        buff = np.frombuffer(buff_byte, dtype='>f4')
+        times.append(time.perf_counter() - t0)
+        assert buff.shape[0] == n_samples
+
+    rp.close()
+    worker.join()
+    server.close()
+    return np.mean(times)
+
+
+# %% Benchmark
+print(f"{'samples':>10} {'MiB':>8} {'legacy MiB/s':>14} {'rx_arb MiB/s':>14} {'speedup':>8}")
+for n_samples in SAMPLES:
+    mib = n_samples * 4 / 2**20
+    t_new = run(n_samples, legacy=False)
+    if n_samples <= LEGACY_MAX_SAMPLES:
+        t_old = run(n_samples, legacy=True)
+        print(f"{n_samples:>10} {mib:>8.1f} {mib / t_old:>14.1f} {mib / t_new:>14.1f} {t_old / t_new:>7.1f}x")
+    else:
+        print(f"{n_samples:>10} {mib:>8.1f} {'(skipped)':>14} {mib / t_new:>14.1f} {'-':>8}")
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Step response of the filter from one burst, with a second-order fit
+Input signal: IN1
+Output signal: IN2
+
+One square cycle is fired in burst mode (gen_burst_set): the output rests at
+-ampl, jumps to +ampl and returns after half a period, which is longer than the
+capture. The acquisition triggers on the rising edge at IN1 and records the
+ringdown of IN2 with some baseline before the edge.
+
+The second-order model (LP, HP, BP or BS with f0, Q, H0) is simulated with the
+measured IN1 as input and fitted to IN2 in the time domain. H0 and the DC offset
+enter linearly and are solved directly, f0 and Q by least squares, starting from
+the envelope decay and the zero crossings of the ringdown. One acquisition is
+enough to check that a new digipot setting took effect.
+
+Usage:
+    x, y, fs = step_response.measure(rp, f0=1000, Q=5)
+    fit = step_response.fit_second_order(x, y, fs, 'BP')
+    print(fit['f0'], fit['Q'], fit['H0'])
+"""
+
+# %% Init
+import time
+from typing import Optional, Tuple
+import numpy as np
+import scipy.signal as sig
+from scipy.optimize import least_squares
+import redpitaya_scpi as scpi
+import fast_acq
+from redpitaya_scpi import ADC_RATE, BUFFER_SIZE, Waveform
+
+PRE = BUFFER_SIZE // 8  # samples before the edge
+
+
+# %% Measurement
+def default_dec(f0: float, Q: float) -> int:
+    '''Power of two decimation so that the samples after the edge cover 10 envelope time constants Q / (pi f0).'''
+    tau = max(Q, 0.5) / (np.pi * f0)
+    dec = 2 ** int(np.ceil(np.log2(max(10 * tau * ADC_RATE / (BUFFER_SIZE - PRE), 1))))
+    return int(min(dec, 65536))
+
+
+def measure(
+    rp: scpi.scpi,
+    f0: float = 1000.0,
+    Q: float = 5.0,
+    ampl: float = 0.5,
+    dec: int = None,
+    timeout: float = 5.0
+) -> Tuple[np.ndarray, np.ndarray, float]:
+    '''
+    Fire one step from -ampl to +ampl on OUT1 and capture IN1 and IN2 around the edge.
+
+    Args:
+        rp (scpi): Connected board.
+        f0 (float, optional): Expected centre frequency in Hz (sets the time scale). Defaults to 1000.
+        Q (float, optional): Expected quality factor. Defaults to 5.
+        ampl (float, optional): Step height / 2 in Volts. Defaults to 0.5.
+        dec (int, optional): Decimation. Defaults to default_dec(f0, Q).
+        timeout (float, optional): Trigger timeout in seconds. Defaults to 5.
+
+    Returns:
+        x (IN1), y (IN2) with PRE samples before the edge, sampling rate fs in Hz.
+    '''
+    dec = default_dec(f0, Q) if dec is None else dec
+    fs = ADC_RATE / dec
+    half = 1.2 * BUFFER_SIZE / fs           # square half period longer than the capture
+
+    # One square cycle, resting at -ampl before and after
+    with rp.batch():
+        rp.tx_txt('GEN:RST')
+        rp.gen_set(1, func=Waveform.SQUARE, volt=ampl, freq=1 / (2 * half))
+        rp.gen_burst_set(1, ncyc=1, nor=1, init_val=-ampl, last_val=-ampl)
+        rp.tx_txt('OUTPUT1:STATE ON')
+    with rp.timed('settle'):
+        time.sleep(2 * half + 10 * max(Q, 0.5) / (np.pi * f0))
+
+    with rp.batch():
+        rp.tx_txt('ACQ:RST')
+        rp.tx_txt('ACQ:DATA:FORMAT BIN')
+        rp.tx_txt(f"ACQ:DEC:Factor {dec}")
+        rp.tx_txt('ACQ:TRig:LEV 0')
+        rp.tx_txt(f"ACQ:TRig:DLY {BUFFER_SIZE // 2 - PRE}")  # counted from mid-buffer: BUFFER_SIZE - PRE after the edge
+        rp.tx_txt('ACQ:START')
+        rp.tx_txt('ACQ:TRig CH1_PE')
+    # Pre-trigger samples have to be recorded before the edge
+    time.sleep(PRE / fs)
+    rp.tx_txt('SOUR1:TRig:INT')
+
+    rp.wait_triggered(timeout=timeout)
+    rp.wait_filled(timeout=timeout)
+    tpos = int(rp.txrx_txt('ACQ:TPOS?'))
+    x, y = fast_acq.read_multi(rp, start=(tpos - PRE) % BUFFER_SIZE, num_samples=BUFFER_SIZE)
+
+    with rp.batch():
+        rp.tx_txt('ACQ:STOP')
+        rp.tx_txt('OUTPUT1:STATE OFF')
+        rp.tx_txt('SOUR1:BURS:STAT CONTINUOUS')
+    return x.astype(float), y.astype(float), fs
+
+
+# %% Model
+def model_sos(f0: float, Q: float, fs: float, ftype: str = 'BP') -> np.ndarray:
+    '''Unit gain second-order section (bilinear transform, prewarped at f0).'''
+    w0 = 2 * fs * np.tan(np.pi * min(f0, 0.49 * fs) / fs)
+    a = [1, w0 / Q, w0**2]
+    b = {'LP': [0, 0, w0**2], 'HP': [1, 0, 0], 'BP': [0, w0 / Q, 0], 'BS': [1, 0, w0**2]}[ftype]
+    bz, az = sig.bilinear(b, a, fs)
+    return sig.tf2sos(bz, az)
+
+
+def _simulate(x: np.ndarray, f0: float, Q: float, fs: float, ftype: str) -> np.ndarray:
+    '''Response to x, starting in steady state for the constant input x[0].'''
+    sos = model_sos(f0, Q, fs, ftype)
+    zi = sig.sosfilt_zi(sos) * x[0]
+    return sig.sosfilt(sos, x, zi=zi)[0]
+
+
+def _linear(u: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''Least squares H0 and offset for y = H0 * u + offset.'''
+    A = np.column_stack((u, np.ones_like(u)))
+    coef = np.linalg.lstsq(A, y, rcond=None)[0]
+    return coef, y - A @ coef
+
+
+def initial_guess(x: np.ndarray, y: np.ndarray, fs: float) -> Tuple[Optional[float], Optional[float]]:
+    '''
+    f0 and Q from the ringdown after the edge: decay rate alpha of the Hilbert envelope
+    and damped frequency fd from the spectral peak of the ringdown, f0 = sqrt(fd^2 + (alpha / 2 pi)^2),
+    Q = pi f0 / alpha. None if the response does not ring (Q < ~1).
+    '''
+    edge = int(np.argmax(np.diff(x)))
+    ring = y[edge + 1:]
+    ring = ring - np.mean(ring[-len(ring) // 10:])
+    env = np.abs(sig.hilbert(ring))
+    peak = int(np.argmax(env))
+    decay = np.nonzero(env[peak:] < 0.05 * env[peak])[0]
+    stop = peak + (decay[0] if decay.size else len(env) - peak)
+    if stop - peak < 16:
+        return None, None
+
+    region = np.arange(peak, stop)
+    alpha = -np.polyfit(region / fs, np.log(env[region]), 1)[0]
+    n = 8 * len(region)
+    spec = np.abs(np.fft.rfft(ring[region] * np.hanning(len(region)), n))
+    k = int(np.argmax(spec[1:])) + 1
+    if alpha <= 0 or k < 2:
+        return None, None
+    fd = k * fs / n
+    f0 = np.sqrt(fd**2 + (alpha / (2 * np.pi))**2)
+    return f0, np.pi * f0 / alpha
+
+
+# %% Fit
+def fit_second_order(
+    x: np.ndarray,
+    y: np.ndarray,
+    fs: float,
+    ftype: str = 'BP',
+    f0: float = None,
+    Q: float = None
+) -> dict:
+    '''
+    Fit a second-order model to the step response.
+
+    Args:
+        x (ndarray): IN1 (measured excitation).
+        y (ndarray): IN2 (response).
+        fs (float): Sampling rate in Hz.
+        ftype (str, optional): Model type 'LP', 'HP', 'BP' or 'BS'. Defaults to 'BP'.
+        f0 (float, optional): Start value, estimated from the ringdown if not given.
+        Q (float, optional): Start value, estimated from the ringdown if not given.
+
+    Returns:
+        dict with f0, Q, H0, offset, rms (residual), nrmse (rms / std(y)) and fit (model output).
+    '''
+    assert ftype in ('LP', 'HP', 'BP', 'BS'), f"{ftype} is not a defined filter type"
+    g_f0, g_Q = initial_guess(x, y, fs)
+    f0 = f0 if f0 is not None else g_f0 if g_f0 is not None else fs / 50
+    Q = Q if Q is not None else g_Q if g_Q is not None else 0.7
+
+    lower, upper = np.log([fs / 1e5, 0.05]), np.log([0.45 * fs, 1e3])
+    start = np.clip(np.log([f0, Q]), lower + 1e-9, upper - 1e-9)
+
+    def residual(p):
+        u = _simulate(x, np.exp(p[0]), np.exp(p[1]), fs, ftype)
+        return _linear(u, y)[1]
+
+    res = least_squares(residual, start, x_scale=[0.1, 0.3], bounds=(lower, upper))
+    f0, Q = np.exp(res.x)
+    u = _simulate(x, f0, Q, fs, ftype)
+    (H0, offset), r = _linear(u, y)
+    if H0 < 0:      # sign convention: positive gain, 180 deg shows up as phase of the model
+        H0 = -H0
+    rms = np.sqrt(np.mean(r**2))
+    return {'f0': f0, 'Q': Q, 'H0': H0, 'offset': offset, 'rms': rms,
+            'nrmse': rms / np.std(y), 'fit': y - r}
+
+
+def step_response(rp: scpi.scpi, ftype: str = 'BP', f0: float = 1000.0, Q: float = 5.0, **kwargs) -> dict:
+    '''measure() and fit_second_order() in one call, adds the elapsed time as 't'.'''
+    t0 = time.perf_counter()
+    x, y, fs = measure(rp, f0=f0, Q=Q, **kwargs)
+    fit = fit_second_order(x, y, fs, ftype)
+    fit['t'] = time.perf_counter() - t0
+    return fit
+
+
+# %% Example: check a digipot setting
+if __name__ == '__main__':
+    import matplotlib.pyplot as plt
+    from labdesk import LABDESK
+
+    rp = scpi.scpi(LABDESK["ELIE4"])
+
+    x, y, fs = measure(rp, f0=1000, Q=5, ampl=0.5)
+    fit = fit_second_order(x, y, fs, 'BP')
+    print(f"f0 = {fit['f0']:.1f} Hz, Q = {fit['Q']:.2f}, H0 = {fit['H0']:.3f}, NRMSE = {fit['nrmse']:.3f}")
+
+    t = (np.arange(len(y)) - PRE) / fs
+    plt.plot(t * 1e3, x, label='IN1')
+    plt.plot(t * 1e3, y, label='IN2')
+    plt.plot(t * 1e3, fit['fit'], '--', label='fit')
+    plt.xlabel('t / ms')
+    plt.legend()
+    plt.show()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Resumable sweep runs, every capture is on disk as soon as it arrives
+
+The result block (n_freq, n_chan, n_samples) is a capture_archive: a .npy file
+preallocated and opened as memory map, each capture is written into its row
+and flushed. The JSON sidecar holds the frequencies and the settings, a record
+per completed row (dec, fs, trig_pos, length) is appended after the row is
+flushed, so after a crash the records never list a row that is not on disk.
+Opening the same directory again resumes at the first missing frequency.
+Memory use stays flat, only one capture is in RAM.
+
+Layout of a run directory:
+    data.npy        (n_freq, n_chan, n_samples) float32, capture_archive.open_archive(...)
+    data.json       attrs (freqs, meta, dtype)
+    data.jsonl      one record per completed row
+
+(HDF5, Zarr or Parquet would need h5py / zarr / pyarrow, a .npy memory map
+plus a JSON sidecar gives the same incremental writes with NumPy only.)
+
+Usage:
+    run = sweep_run.SweepRun('data/bode_run', freqs, n_samples=16384, meta={'dec': 64})
+    for freq in run.pending():                   # resumes after an interruption
+        ...
+        run.store(freq, np.stack((IN1, IN2)), dec=64, fs=125e6 / 64)
+    DF_IN1, DF_IN2 = run.frames()                # wide DataFrames as before
+"""
+
+# %% Init
+import os
+from typing import List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import capture_archive
+
+ARCHIVE = 'data'
+
+
+# %% Run
+class SweepRun(object):
+    '''
+    Preallocated, incrementally persisted result block of a frequency sweep.
+
+    Args:
+        path (str): Run directory (created if needed, resumed if it holds the same sweep).
+        freqs (array_like): Sweep frequencies in Hz, in measurement order.
+        n_chan (int, optional): Channels per capture. Defaults to 2.
+        n_samples (int, optional): Maximum samples per channel and capture. Defaults to 16384.
+        dtype (str, optional): Sample type, 'float32' (Volts) or 'int16' (RAW). Defaults to 'float32'.
+        meta (dict, optional): Settings stored in the sidecar (decimation, amplitude, board, ...).
+    '''
+
+    def __init__(
+        self,
+        path: str,
+        freqs,
+        n_chan: int = 2,
+        n_samples: int = 16384,
+        dtype: str = 'float32',
+        meta: Optional[dict] = None
+    ):
+        self.path = path
+        self.freqs = np.asarray(freqs)
+        shape = (len(self.freqs), n_chan, n_samples)
+        name = os.path.join(path, ARCHIVE)
+
+        if os.path.exists(name + '.json'):
+            self.archive = capture_archive.open_archive(name, 'r+')
+            attrs = self.archive.attrs
+            if (attrs.get('freqs') != self.freqs.tolist() or self.archive.data.shape != shape
+                    or attrs['dtype'] != np.dtype(dtype).name):
+                raise ValueError(f"{path} holds a different sweep, use another directory")
+        else:
+            self.archive = capture_archive.create(name, len(self.freqs), n_chan, n_samples, dtype,
+                                                  attrs={'freqs': self.freqs.tolist(), 'meta': meta or {}})
+
+    @property
+    def data(self) -> np.ndarray:
+        return self.archive.data
+
+    # %% Progress
+    @property
+    def done(self) -> np.ndarray:
+        return np.array([rec is not None for rec in self.archive.records], dtype=bool)
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.done.all())
+
+    def pending(self) -> List:
+        '''Frequencies without a stored capture, in sweep order.'''
+        return [f for f, d in zip(self.freqs, self.done) if not d]
+
+    def _index(self, freq: float) -> int:
+        idx = np.nonzero(np.isclose(self.freqs, freq, rtol=1e-9, atol=0))[0]
+        assert len(idx) == 1, f"{freq} Hz is not a frequency of this sweep"
+        return int(idx[0])
+
+    # %% Storage
+    def store(self, freq: float, capture: np.ndarray, **record) -> None:
+        '''
+        Write the capture (n_chan, n) of one frequency into its row and mark it done.
+        Extra keyword arguments (dec, fs, trig_pos, ...) go into the record of the row.
+        '''
+        self.archive.write(self._index(freq), capture, freq=freq, **record)
+
+    def capture(self, freq: float) -> np.ndarray:
+        '''Stored capture of one frequency (view into the memory map, without padding).'''
+        return self.archive.raw(self._index(freq))
+
+    def frames(self) -> Tuple[pd.DataFrame, ...]:
+        '''One wide DataFrame per channel with a column str(freq) per stored frequency (old CSV layout).'''
+        return self.archive.frames()
+
+
+# %% Example: resume a run
+if __name__ == '__main__':
+    freqs = np.arange(800, 1200, 5)
+    run = SweepRun('data/sweep_example', freqs, n_samples=1024, meta={'dec': 64, 'ampl': 0.5})
+    print(f"{len(run.pending())} of {len(freqs)} frequencies pending")
+    t = np.arange(1024) * 64 / 125e6
+    for freq in run.pending()[:40]:     # interrupted after 40 points, run again to finish
+        run.store(freq, np.stack((0.5 * np.sin(2 * np.pi * freq * t), 0.25 * np.sin(2 * np.pi * freq * t))),
+                  dec=64, fs=125e6 / 64, trig_pos=0)
+    print(f"{len(run.pending())} pending, complete: {run.complete}")
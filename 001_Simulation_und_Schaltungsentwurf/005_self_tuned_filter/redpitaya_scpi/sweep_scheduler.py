@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Settling-aware scheduling of stepped sine sweeps
+Input signal: IN1
+Output signal: IN2
+
+Instead of a flat time.sleep(1) after every retune, the dwell time follows the
+physics of a second-order section. After a phase-continuous frequency step the
+output transient starts at |H(f_new) - H(f_old)| and decays with the envelope
+time constant
+    tau = Q / (pi f0)            (slower pole for Q < 0.5)
+so the error falls below the relative tolerance `tol` after
+    t = tau * ln(|H(f_new) - H(f_old)| / (tol |H(f_new)|))
+Near the resonance of a high-Q bandpass or in the notch of a bandstop the wait
+is long, on the flat parts it shrinks to a few periods of the test signal.
+
+Before the real capture, steady state is confirmed with short captures: the
+complex gain IN2 / IN1 at the test frequency is estimated from each one and the
+point is accepted once two successive estimates agree within `tol`.
+Frequencies are sorted, so every retune is a small step along the response.
+
+Usage:
+    sched = sweep_scheduler.SettlingScheduler(f0=1000, Q=5, ftype='BP', tol=1e-3)
+    print(sched.plan(freqs))                     # dwell per point and total time
+    for freq in sched.run(gen, freqs):           # retune, wait, confirm
+        ...                                      # real capture
+"""
+
+# %% Init
+import time
+from typing import Iterator, Optional, Tuple
+import numpy as np
+import pandas as pd
+import redpitaya_scpi as scpi
+import acq_plan
+from gen_shadow import ShadowGenerator
+
+
+# %% Second-order section
+def response(f, f0: float, Q: float, H0: float = 1.0, ftype: str = 'BP'):
+    '''Complex frequency response of a second-order section ('LP', 'HP', 'BP' or 'BS').'''
+    s = 2j * np.pi * np.asarray(f, dtype=float)
+    w0 = 2 * np.pi * f0
+    num = {'LP': w0**2, 'HP': s**2, 'BP': s * w0 / Q, 'BS': s**2 + w0**2}[ftype]
+    return H0 * num / (s**2 + s * w0 / Q + w0**2)
+
+
+def envelope_tau(f0: float, Q: float) -> float:
+    '''Time constant of the slowest decaying transient in seconds (Q / (pi f0) for Q >= 0.5).'''
+    if Q >= 0.5:
+        return Q / (np.pi * f0)
+    # Overdamped: two real poles, the slower one dominates
+    w0 = 2 * np.pi * f0
+    return 1 / (w0 * (1 / (2 * Q) - np.sqrt(1 / (4 * Q**2) - 1)))
+
+
+def tone_response(x: np.ndarray, y: np.ndarray, fs: float, freq: float) -> Tuple[complex, float]:
+    '''
+    Complex gain y / x at freq from a least squares fit of cos, sin and offset to both
+    signals (exact for any number of periods, unlike a single DFT bin).
+
+    Returns:
+        (gain, standard deviation of the complex gain from the fit residuals)
+    '''
+    t = np.arange(len(x)) / fs
+    A = np.column_stack((np.cos(2 * np.pi * freq * t), np.sin(2 * np.pi * freq * t), np.ones_like(t)))
+    coef, res = np.linalg.lstsq(A, np.column_stack((x, y)), rcond=None)[:2]
+    X, Y = complex(coef[0, 0], -coef[1, 0]), complex(coef[0, 1], -coef[1, 1])
+    # Residual variance per channel, cos and sin amplitude of a fitted tone have variance 2 sigma^2 / n each
+    var = (res if len(res) else np.zeros(2)) / max(len(x) - 3, 1) * 4 / len(x)
+    H = Y / X
+    return H, abs(H) * np.sqrt(var[0] / abs(X)**2 + var[1] / abs(Y)**2)
+
+
+# %% Scheduler
+class SettlingScheduler(object):
+    '''
+    Dwell times and order of a stepped sine sweep from the expected second-order response.
+
+    Args:
+        f0 (float): Expected centre frequency in Hz.
+        Q (float): Expected quality factor.
+        ftype (str, optional): 'LP', 'HP', 'BP' or 'BS'. Defaults to 'BP'.
+        tol (float, optional): Relative error of the gain left by the transient. Defaults to 1e-3.
+        min_periods (float, optional): Shortest dwell in periods of the test frequency. Defaults to 10.
+        min_dwell (float, optional): Shortest dwell in seconds. Defaults to 0.01.
+        max_dwell (float, optional): Longest dwell in seconds. Defaults to 5.
+    '''
+
+    def __init__(
+        self,
+        f0: float,
+        Q: float,
+        ftype: str = 'BP',
+        tol: float = 1e-3,
+        min_periods: float = 10,
+        min_dwell: float = 0.01,
+        max_dwell: float = 5.0
+    ):
+        assert ftype in ('LP', 'HP', 'BP', 'BS'), f"{ftype} is not a defined filter type"
+        assert 0 < tol < 1, "Tolerance needs to be between 0 and 1"
+        self.f0 = f0
+        self.Q = Q
+        self.ftype = ftype
+        self.tol = tol
+        self.min_periods = min_periods
+        self.min_dwell = min_dwell
+        self.max_dwell = max_dwell
+        self.log = []       # one dict per point of the last run()
+
+    @property
+    def tau(self) -> float:
+        return envelope_tau(self.f0, self.Q)
+
+    def dwell(self, freq: float, prev: Optional[float] = None) -> float:
+        '''
+        Wait time after retuning from prev to freq (phase-continuous), or after switching
+        the output on if prev is None.
+        '''
+        H_new = response(freq, self.f0, self.Q, 1.0, self.ftype)
+        H_old = response(prev, self.f0, self.Q, 1.0, self.ftype) if prev is not None else 0.0
+        # In a notch the error is taken relative to the passband gain
+        rel = np.abs(H_new - H_old) / max(np.abs(H_new), self.tol)
+        t = self.tau * np.log(max(rel / self.tol, 1.0))
+        return float(np.clip(t, max(self.min_periods / freq, self.min_dwell), self.max_dwell))
+
+    def order(self, freqs, start: Optional[float] = None) -> np.ndarray:
+        '''Sorted frequencies, descending if start (current frequency) is closer to the top.'''
+        freqs = np.unique(freqs)
+        if start is not None and abs(start - freqs[-1]) < abs(start - freqs[0]):
+            freqs = freqs[::-1]
+        return freqs
+
+    def plan(self, freqs, start: Optional[float] = None) -> pd.DataFrame:
+        '''Dwell per point in sweep order, with the cumulative time.'''
+        freqs = self.order(freqs, start)
+        prev = [start] + list(freqs[:-1])
+        dwell = np.array([self.dwell(f, p) for f, p in zip(freqs, prev)])
+        return pd.DataFrame({'freq': freqs, 'dwell': dwell, 'elapsed': np.cumsum(dwell)})
+
+    # %% Sweep
+    def run(
+        self,
+        gen: ShadowGenerator,
+        freqs,
+        confirm: bool = True,
+        periods: int = 5,
+        max_checks: int = 8
+    ) -> Iterator[float]:
+        '''
+        Retune, wait and (optionally) confirm steady state for every frequency, then yield it
+        for the real capture. Each point is recorded in self.log.
+
+        Args:
+            gen (ShadowGenerator): Generator channel, set up with waveform and amplitude.
+            freqs (array_like): Test frequencies in Hz (sorted by order()).
+            confirm (bool, optional): Confirm steady state with short captures. Defaults to True.
+            periods (int, optional): Periods per confirmation capture. Defaults to 5.
+            max_checks (int, optional): Confirmation captures before giving up. Defaults to 8.
+        '''
+        self.log = []
+        current = float(gen._value(f"SOUR{gen.chan}:FREQ:FIX")) if gen.output_on else None
+        for freq in self.order(freqs, current):
+            t0 = time.perf_counter()
+            prev = current if gen.output_on else None
+            gen.set(freq=freq)
+            gen.output(True)
+            wait = self.dwell(freq, prev)
+            with gen.rp.timed('settle'):
+                time.sleep(wait)
+
+            H, checks, steady = np.nan, 0, None
+            if confirm:
+                H, checks, steady = confirm_steady(gen.rp, freq, self.tol, periods, max_checks)
+            current = freq
+            self.log.append({'freq': freq, 'dwell': wait, 'checks': checks, 'steady': steady, 'H': H,
+                             'time': time.perf_counter() - t0})
+            yield freq
+
+
+# %% Steady state confirmation
+def capture_tone(rp: scpi.scpi, freq: float, periods: int = 5) -> Tuple[complex, float]:
+    '''
+    Gain IN2 / IN1 at freq and its standard deviation from one capture of `periods` whole
+    periods (decimation and length from acq_plan.plan, only these samples are read).
+    '''
+    p = acq_plan.plan(freq, periods)
+    x, y = acq_plan.capture(rp, p)
+    return tone_response(x, y, p.fs, freq)
+
+
+def confirm_steady(rp: scpi.scpi, freq: float, tol: float = 1e-3, periods: int = 5, max_checks: int = 8) -> Tuple[complex, int, bool]:
+    '''
+    Short captures of `periods` periods until two successive gain estimates agree within tol
+    (or within 3 standard deviations of their difference, if the noise is larger than tol).
+
+    Returns:
+        (last gain IN2 / IN1, number of captures, True if steady state was confirmed)
+    '''
+    prev = None
+    for check in range(1, max_checks + 1):
+        H, H_std = capture_tone(rp, freq, periods)
+        if prev is not None and abs(H - prev[0]) <= max(tol * max(abs(H), tol), 3 * np.hypot(H_std, prev[1])):
+            return H, check, True
+        prev = H, H_std
+    return H, max_checks, False
+
+
+# %% Example: plan of the bode_data_meas.py sweep
+if __name__ == '__main__':
+    for ftype, Q in (('BP', 1), ('BP', 10), ('BS', 10)):
+        sched = SettlingScheduler(f0=1000, Q=Q, ftype=ftype, tol=1e-3)
+        plan = sched.plan(np.arange(800, 1200, 5))
+        print(f"{ftype} Q = {Q:>2}: {plan['elapsed'].iloc[-1]:.2f} s instead of {len(plan)} s, "
+              f"longest dwell {plan['dwell'].max() * 1e3:.0f} ms at {plan['freq'][plan['dwell'].idxmax()]:.0f} Hz")